@@ -0,0 +1,57 @@
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+
+
+class CounterManager(models.Manager):
+    """Per-scope sequences of integers.
+
+    A scope names what is numbered, e.g. 'graph.vertex:12' for the VIDs of
+    graph 12. Values are taken by incrementing the scope's row in place, so
+    concurrent callers queue on that one row lock instead of both reading
+    the same max(). The lock is held until the caller's transaction ends,
+    which keeps the numbering gap-free when an insert is rolled back.
+
+    A scope's row is created on first use; seed is a callable returning
+    the highest value already in use there (values allocated before the
+    counter existed).
+    """
+
+    def _ensure(self, scope, seed):
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(scope=scope, value=seed() if seed else 0)
+        except IntegrityError:
+            # Created concurrently by another caller.
+            pass
+
+    def reserve(self, scope, count=1, seed=None):
+        """Claim count consecutive values in scope and return them as a range."""
+        with transaction.atomic(using=self.db):
+            if not self.filter(scope=scope).update(value=F('value') + count):
+                self._ensure(scope, seed)
+                self.filter(scope=scope).update(value=F('value') + count)
+            last = self.filter(scope=scope).values_list('value', flat=True).get()
+        return range(last - count + 1, last + 1)
+
+    def advance(self, scope, value, seed=None):
+        """Never hand out value or anything below it in scope, e.g. after
+        rows were written with explicit values."""
+        with transaction.atomic(using=self.db):
+            if self.filter(scope=scope, value__lt=value).update(value=value):
+                return
+            if not self.filter(scope=scope).exists():
+                self._ensure(scope, seed)
+                self.filter(scope=scope, value__lt=value).update(value=value)
+
+    def discard(self, scope):
+        self.filter(scope=scope).delete()
+
+
+class Counter(models.Model):
+    scope = models.CharField(max_length=64, unique=True)
+    value = models.BigIntegerField(default=0)
+
+    objects = CounterManager()
+
+    def __str__(self):
+        return "%s = %d" % (self.scope, self.value)
@@ -0,0 +1,55 @@
+import threading
+
+
+def domain_version(domain_id):
+    """(revision, updated_at) of the domain as committed, or None if it is gone."""
+    from domain.models import Domain
+    return Domain.objects.filter(pk=domain_id).values_list('revision', 'updated_at').first()
+
+
+class DomainCache:
+    """Per-process cache of one value per domain, built by loader(domain_id).
+
+    Like graph.snapshot, a value is kept under the domain's version, its
+    (revision, updated_at) read just before loading, and only served for
+    that version: every change the signals in domain.models see bumps the
+    revision, so a change committed by another process is picked up here
+    too. Pass the version read with the domain row where there is one;
+    without it the version costs a query.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._values = {}  # domain_id -> (version, value)
+
+    def get(self, domain_id, version=None):
+        fresh = version is None
+        if fresh:
+            version = domain_version(domain_id)
+        with self._lock:
+            entry = self._values.get(domain_id)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+        if not fresh:
+            # The caller's row may be older than what the loader reads.
+            version = domain_version(domain_id)
+        value = self.loader(domain_id)
+        if version is not None:
+            with self._lock:
+                entry = self._values.get(domain_id)
+                # A slower load of an older state must not replace a newer one.
+                if entry is None or entry[0][0] <= version[0]:
+                    self._values[domain_id] = (version, value)
+        return value
+
+    def invalidate(self, domain_id=None):
+        """Drop the value of one domain, or of every domain when domain_id is None.
+
+        Only frees memory early: a changed domain has a new version anyway.
+        """
+        with self._lock:
+            if domain_id is None:
+                self._values.clear()
+            else:
+                self._values.pop(domain_id, None)
@@ -0,0 +1,56 @@
+"""Grouped strategy choices for the prerequisite pickers of a domain.
+
+Every ActionForm of a strategy offers the same strategies, grouped by
+skill. strategy_choices() builds them with one query and keeps them in a
+per-process cache for the domain's revision, which the signals in
+domain.models bump on every change to its skills or strategies.
+"""
+from itertools import groupby
+
+from django.utils.html import escape
+
+from domain.cache import DomainCache
+
+
+class StrategyChoices(list):
+    """[(skill name, [(strategy pk, strategy name), ...]), ...]
+
+    Also renders its <option> markup once; widgets only mark the selected
+    values.
+    """
+
+    def __init__(self, groups):
+        super().__init__(groups)
+        self._parts = None
+
+    def _render_parts(self):
+        parts = []
+        for group, options in self:
+            parts.append(('<optgroup label="%s">' % escape(group), None, ''))
+            for value, label in options:
+                parts.append(('<option value="%s"' % escape(value), str(value), '>%s</option>' % escape(label)))
+            parts.append(('</optgroup>', None, ''))
+        return parts
+
+    def options_html(self, selected):
+        """The <option> list with the string values in selected marked."""
+        if self._parts is None:
+            self._parts = self._render_parts()
+        return ''.join(head + ' selected' + tail if value in selected else head + tail
+                       for head, value, tail in self._parts)
+
+
+def load_choices(domain_id):
+    from domain.models import Strategy
+    rows = Strategy.objects.filter(skill_goal__domain_id=domain_id).order_by('skill_goal__code', 'code') \
+        .values_list('skill_goal_id', 'skill_goal__name', 'pk', 'name')
+    groups = []
+    for _, group in groupby(rows, key=lambda row: row[0]):
+        group = list(group)
+        groups.append((group[0][1], [(pk, name) for _, _, pk, name in group]))
+    return StrategyChoices(groups)
+
+
+_cache = DomainCache(load_choices)
+strategy_choices = _cache.get
+invalidate = _cache.invalidate
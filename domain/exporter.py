@@ -0,0 +1,59 @@
+import json
+
+from domain.models import Skill, Strategy, Action, Prerequisite
+
+CHUNK_ROWS = 2000
+
+
+def _record(**fields):
+    return json.dumps(fields, ensure_ascii=False) + '\n'
+
+
+def _chunks(records):
+    # One chunk per CHUNK_ROWS lines, as in graph.exporter.
+    buf = []
+    for record in records:
+        buf.append(record)
+        if len(buf) >= CHUNK_ROWS:
+            yield ''.join(buf).encode()
+            buf = []
+    if buf:
+        yield ''.join(buf).encode()
+
+
+def iter_domain_records(domain):
+    """Yield the NDJSON lines of a domain: the domain, then its skills,
+    strategies, actions and prerequisites, parents before children.
+
+    Strategies are addressed by (skill code, strategy code) and actions by
+    (skill, strategy, order). A prerequisite in another domain names that
+    domain in "requires"; null means the exported domain itself. Five
+    queries whatever the size of the domain.
+    """
+    yield _record(type='domain', code=domain.code, name=domain.name, description=domain.description)
+    for code, name, description in Skill.objects.filter(domain=domain).order_by('code') \
+            .values_list('code', 'name', 'description').iterator(CHUNK_ROWS):
+        yield _record(type='skill', code=code, name=name, description=description)
+    for skill, code, name, problem in Strategy.objects.filter(skill_goal__domain=domain) \
+            .order_by('skill_goal__code', 'code') \
+            .values_list('skill_goal__code', 'code', 'name', 'problem').iterator(CHUNK_ROWS):
+        yield _record(type='strategy', skill=skill, code=code, name=name, problem=problem)
+    for skill, strategy, order, description in Action.objects.filter(strategy__skill_goal__domain=domain) \
+            .order_by('strategy__skill_goal__code', 'strategy__code', 'order') \
+            .values_list('strategy__skill_goal__code', 'strategy__code', 'order', 'description') \
+            .iterator(CHUNK_ROWS):
+        yield _record(type='action', skill=skill, strategy=strategy, order=order, description=description)
+    for skill, strategy, order, domain_id, domain_name, required_skill, required_strategy in \
+            Prerequisite.objects.filter(action__strategy__skill_goal__domain=domain) \
+            .order_by('action__strategy__skill_goal__code', 'action__strategy__code', 'action__order', 'pk') \
+            .values_list('action__strategy__skill_goal__code', 'action__strategy__code', 'action__order',
+                         'strategy__skill_goal__domain_id', 'strategy__skill_goal__domain__name',
+                         'strategy__skill_goal__code', 'strategy__code').iterator(CHUNK_ROWS):
+        yield _record(type='prerequisite', skill=skill, strategy=strategy, order=order,
+                      requires={'domain': None if domain_id == domain.pk else domain_name,
+                                'skill': required_skill, 'strategy': required_strategy})
+
+
+def iter_domain_ndjson(domain):
+    """The NDJSON export of a domain as UTF-8 chunks."""
+    return _chunks(iter_domain_records(domain))
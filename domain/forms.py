@@ -1,32 +1,29 @@
-from itertools import groupby
-
 from django.contrib.admin.widgets import FilteredSelectMultiple
 from django.forms import ModelForm
-from django.forms.models import ModelChoiceIterator, inlineformset_factory
+from django.forms.models import inlineformset_factory
+from django.forms.utils import flatatt
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from domain.choices import StrategyChoices
+from domain.models import Strategy, Action
 
-from domain.models import Strategy, Action, Domain
 
+class StrategySelectMultiple(FilteredSelectMultiple):
+    """FilteredSelectMultiple that reuses the <option> markup of shared
+    StrategyChoices instead of rendering every option per form."""
 
-class StrategyIterator(ModelChoiceIterator):
-    def __init__(self, domain_code, *args, **kwargs):
-        #domain_code = kwargs.pop('domain_code', None)
-        print("====================================================================")
-        print(domain_code)
-        print("====================================================================")
-        self.queryset = Strategy.objects.filter(skill_goal__domain=Domain.objects.get(code=domain_code))
-        super(StrategyIterator, self).__init__(*args, **kwargs)
+    def optgroups(self, name, value, attrs=None):
+        if isinstance(self.choices, StrategyChoices):
+            return []
+        return super().optgroups(name, value, attrs)
 
-    def __iter__(self):
-        queryset = self.queryset.select_related('skill_goal').order_by('skill_goal__code', 'code')
-        groups = groupby(queryset, key=lambda x: x.skill_goal)
-        for skill_goal, strategies in groups:
-            yield [
-                skill_goal.name,
-                [
-                    (strategy.id, strategy.name)
-                    for strategy in strategies
-                ]
-            ]
+    def render(self, name, value, attrs=None, renderer=None):
+        if not isinstance(self.choices, StrategyChoices):
+            return super().render(name, value, attrs, renderer)
+        context = self.get_context(name, value, attrs)['widget']
+        return mark_safe('<select name="%s"%s>%s</select>' % (
+            escape(name), flatatt(context['attrs']), self.choices.options_html(set(context['value']))))
 
 
 class ActionForm(ModelForm):
@@ -34,13 +31,21 @@ class ActionForm(ModelForm):
         model = Action
         fields = ['order', 'description', 'prerequisites']
         widgets = {
-            'prerequisites': FilteredSelectMultiple("verbose name", is_stacked=True, attrs={'size': 12})
+            'prerequisites': StrategySelectMultiple("verbose name", is_stacked=True, attrs={'size': 12})
         }
+        help_texts = {'order': 'Leave empty to append.'}
 
-    def __init__(self, domain_code, *args, **kwargs):
-        #domain_code = Domain.objects.get(code=kwargs.pop('domain_code', None))
+    def __init__(self, choices, *args, **kwargs):
+        # choices: strategy_choices() of the domain, shared by all forms of the formset.
         super(ActionForm, self).__init__(*args, **kwargs)
-        self.fields['prerequisites'].choices = StrategyIterator(domain_code=domain_code, field=self.fields['prerequisites'])
+        self.fields['prerequisites'].widget.choices = choices
+        self.fields['order'].required = False
+
+    def validate_unique(self):
+        # ActionsFormSet holds every action of the strategy and checks that
+        # orders are unique across its forms; checking each form against
+        # the stored rows would reject swapping two orders.
+        pass
 
 
 ActionsFormSet = inlineformset_factory(Strategy, Action, form=ActionForm, extra=1)
@@ -0,0 +1,129 @@
+"""Whole-domain trees: Domain -> Skill -> Strategy -> Action -> prerequisites.
+
+load_tree() fetches a domain with everything under it in six queries,
+however large it is, and keeps only plain slotted nodes, so a tree is
+cheap to hold and to serialise.
+"""
+from django.db.models import Prefetch
+
+from domain.models import Domain, Skill, Strategy, Action, Prerequisite
+
+
+class StrategyRef:
+    """A required strategy, addressed by the codes of its URL."""
+    __slots__ = ('domain_code', 'skill_code', 'code', 'name')
+
+    def __init__(self, domain_code, skill_code, code, name):
+        self.domain_code = domain_code
+        self.skill_code = skill_code
+        self.code = code
+        self.name = name
+
+    def as_dict(self):
+        return {'domain': self.domain_code, 'skill': self.skill_code, 'strategy': self.code, 'name': self.name}
+
+
+class ActionNode:
+    __slots__ = ('pk', 'order', 'description', 'prerequisites')
+
+    def __init__(self, pk, order, description, prerequisites):
+        self.pk = pk
+        self.order = order
+        self.description = description
+        self.prerequisites = prerequisites
+
+    def as_dict(self):
+        return {'order': self.order, 'description': self.description,
+                'prerequisites': [ref.as_dict() for ref in self.prerequisites]}
+
+
+class StrategyNode:
+    __slots__ = ('pk', 'code', 'name', 'problem', 'actions')
+
+    def __init__(self, pk, code, name, problem, actions):
+        self.pk = pk
+        self.code = code
+        self.name = name
+        self.problem = problem
+        self.actions = actions
+
+    def as_dict(self):
+        return {'code': self.code, 'name': self.name, 'problem': self.problem,
+                'actions': [action.as_dict() for action in self.actions]}
+
+
+class SkillNode:
+    __slots__ = ('pk', 'code', 'name', 'description', 'strategies')
+
+    def __init__(self, pk, code, name, description, strategies):
+        self.pk = pk
+        self.code = code
+        self.name = name
+        self.description = description
+        self.strategies = strategies
+
+    def as_dict(self):
+        return {'code': self.code, 'name': self.name, 'description': self.description,
+                'strategies': [strategy.as_dict() for strategy in self.strategies]}
+
+
+class DomainTree:
+    __slots__ = ('pk', 'code', 'name', 'description', 'skills')
+
+    def __init__(self, pk, code, name, description, skills):
+        self.pk = pk
+        self.code = code
+        self.name = name
+        self.description = description
+        self.skills = skills
+
+    def strategies(self):
+        for skill in self.skills:
+            yield from skill.strategies
+
+    def as_dict(self):
+        return {'code': self.code, 'name': self.name, 'description': self.description,
+                'skills': [skill.as_dict() for skill in self.skills]}
+
+
+def domain_queryset():
+    """Domains with the hierarchy down to prerequisite rows prefetched into
+    plain lists (skills, strategies, actions, links): five queries."""
+    # Prerequisite rows only carry ids; load_tree() resolves them in one
+    # more query instead of building three joined models per row.
+    prerequisites = Prerequisite.objects.order_by('pk').only('action', 'strategy')
+    actions = Action.objects.order_by('order').only('strategy', 'order', 'description') \
+        .prefetch_related(Prefetch('prerequisite_set', queryset=prerequisites, to_attr='links'))
+    strategies = Strategy.objects.order_by('code').only('skill_goal', 'code', 'name', 'problem') \
+        .prefetch_related(Prefetch('action_set', queryset=actions, to_attr='actions'))
+    skills = Skill.objects.order_by('code') \
+        .prefetch_related(Prefetch('strategy_set', queryset=strategies, to_attr='strategies'))
+    return Domain.objects.prefetch_related(Prefetch('skill_set', queryset=skills, to_attr='skills'))
+
+
+def strategy_refs(pks):
+    """{pk: StrategyRef} for these strategies, which may lie in other domains."""
+    rows = Strategy.objects.filter(pk__in=pks) \
+        .values_list('pk', 'skill_goal__domain__code', 'skill_goal__code', 'code', 'name')
+    return {row[0]: StrategyRef(*row[1:]) for row in rows}
+
+
+def load_tree(domain_code):
+    """DomainTree of the domain with this code; raises Domain.DoesNotExist."""
+    domain = domain_queryset().get(code=domain_code)
+    skills = domain.skills
+    required = {link.strategy_id for skill in skills for strategy in skill.strategies
+                for action in strategy.actions for link in action.links}
+    refs = strategy_refs(required) if required else {}
+
+    def sort_key(ref):
+        return ref.domain_code, ref.skill_code, ref.code
+
+    return DomainTree(domain.pk, domain.code, domain.name, domain.description, [
+        SkillNode(skill.pk, skill.code, skill.name, skill.description, [
+            StrategyNode(strategy.pk, strategy.code, strategy.name, strategy.problem, [
+                ActionNode(action.pk, action.order, action.description,
+                           sorted((refs[link.strategy_id] for link in action.links), key=sort_key))
+                for action in strategy.actions])
+            for strategy in skill.strategies])
+        for skill in skills])
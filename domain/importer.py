@@ -0,0 +1,196 @@
+import json
+
+from django.db import IntegrityError, transaction
+
+from domain.models import Domain, Skill, Strategy, Action, Prerequisite, reserve_codes, domain_rebuilt
+
+
+class DomainImportError(ValueError):
+    pass
+
+
+FIELDS = {
+    'domain': ('name',),
+    'skill': ('code', 'name'),
+    'strategy': ('skill', 'code', 'name'),
+    'action': ('skill', 'strategy', 'order', 'description'),
+    'prerequisite': ('skill', 'strategy', 'order', 'requires'),
+}
+
+# Rows of a domain, parents before children.
+ORDER = ('skill', 'strategy', 'action', 'prerequisite')
+
+
+def parse_records(lines):
+    """(line number, record) of NDJSON lines in the format of
+    domain.exporter, one at a time."""
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise DomainImportError("Line %d is not JSON" % number)
+        kind = record.get('type') if isinstance(record, dict) else None
+        if kind not in FIELDS:
+            raise DomainImportError("Line %d: unknown record type %r" % (number, kind))
+        for field in FIELDS[kind]:
+            if record.get(field) in (None, ''):
+                raise DomainImportError("Line %d: %s needs %s" % (number, kind, field))
+        yield number, record
+
+
+def _key(kind, record):
+    if kind == 'skill':
+        return record['code'],
+    if kind == 'strategy':
+        return record['skill'], record['code']
+    return record['skill'], record['strategy'], record['order']
+
+
+class _Writer:
+    """Writes the rows under a new domain batch_size at a time.
+
+    Keeps the keys and pks of the rows written, not the rows: {key: pk}
+    per kind, a key being (skill code,), (skill code, strategy code) or
+    (skill code, strategy code, action order).
+    """
+
+    def __init__(self, domain, batch_size):
+        self.domain = domain
+        self.batch_size = batch_size
+        self.pending = {kind: [] for kind in ORDER}
+        self.pks = {kind: {} for kind in ORDER[:3]}
+        self.external = {}
+
+    def add(self, number, kind, record):
+        key = _key(kind, record)
+        if not all(isinstance(part, int) for part in key):
+            raise DomainImportError("Line %d: %s needs integer codes" % (number, kind))
+        if kind == 'prerequisite':
+            self._check_prerequisite(number, key, record['requires'])
+        else:
+            if key in self.pks[kind]:
+                raise DomainImportError("Line %d: duplicate %s %r" % (number, kind, key))
+            if kind != 'skill' and key[:-1] not in self.pks[ORDER[ORDER.index(kind) - 1]]:
+                raise DomainImportError("Line %d: %s %r has no parent before it" % (number, kind, key))
+            # Taken; the pk is filled in once the row is written.
+            self.pks[kind][key] = None
+        self.pending[kind].append(record)
+        if len(self.pending[kind]) >= self.batch_size:
+            self.flush(kind)
+
+    def _check_prerequisite(self, number, key, required):
+        if key not in self.pks['action']:
+            raise DomainImportError("Line %d: prerequisite of a missing action %r" % (number, key))
+        if not isinstance(required, dict):
+            raise DomainImportError("Line %d: prerequisite needs requires" % number)
+        if required.get('domain') is None and \
+                (required.get('skill'), required.get('strategy')) not in self.pks['strategy']:
+            raise DomainImportError("Line %d: prerequisite requires a missing strategy" % number)
+
+    def flush(self, kind=ORDER[-1]):
+        """Write the pending rows of kind and, first, of its ancestors."""
+        for parent in ORDER[:ORDER.index(kind) + 1]:
+            if self.pending[parent]:
+                getattr(self, '_write_' + parent)(self.pending[parent])
+                self.pending[parent] = []
+
+    def _write_skill(self, records):
+        Skill.objects.bulk_create([Skill(domain=self.domain, code=r['code'], name=r['name'],
+                                         description=r.get('description')) for r in records])
+        self.pks['skill'].update(((code,), pk) for code, pk in Skill.objects
+                                 .filter(domain=self.domain, code__in=[r['code'] for r in records])
+                                 .values_list('code', 'pk'))
+
+    def _write_strategy(self, records):
+        skills = self.pks['skill']
+        Strategy.objects.bulk_create([Strategy(skill_goal_id=skills[(r['skill'],)], code=r['code'], name=r['name'],
+                                               problem=r.get('problem')) for r in records])
+        written = {_key('strategy', r) for r in records}
+        rows = Strategy.objects.filter(skill_goal_id__in={skills[(r['skill'],)] for r in records},
+                                       code__in={r['code'] for r in records}) \
+            .values_list('skill_goal__code', 'code', 'pk')
+        self.pks['strategy'].update(((skill, code), pk) for skill, code, pk in rows if (skill, code) in written)
+
+    def _write_action(self, records):
+        strategies = self.pks['strategy']
+        Action.objects.bulk_create([Action(strategy_id=strategies[r['skill'], r['strategy']], order=r['order'],
+                                           description=r['description']) for r in records])
+        written = {_key('action', r) for r in records}
+        rows = Action.objects.filter(strategy_id__in={strategies[r['skill'], r['strategy']] for r in records},
+                                     order__in={r['order'] for r in records}) \
+            .values_list('strategy__skill_goal__code', 'strategy__code', 'order', 'pk')
+        self.pks['action'].update(((skill, strategy, order), pk) for skill, strategy, order, pk in rows
+                                  if (skill, strategy, order) in written)
+
+    def _write_prerequisite(self, records):
+        self._find_external([r['requires'] for r in records if r['requires'].get('domain') is not None])
+        links = []
+        for r in records:
+            required = r['requires']
+            if required.get('domain') is None:
+                strategy_pk = self.pks['strategy'][required['skill'], required['strategy']]
+            else:
+                strategy_pk = self.external[required['domain'], required['skill'], required['strategy']]
+            links.append(Prerequisite(action_id=self.pks['action'][_key('action', r)], strategy_id=strategy_pk))
+        Prerequisite.objects.bulk_create(links)
+
+    def _find_external(self, requires):
+        """Look up the strategies in other domains that requires name and
+        are not known yet; they must exist under the same domain name."""
+        wanted = {(r['domain'], r.get('skill'), r.get('strategy')) for r in requires} - set(self.external)
+        if not wanted:
+            return
+        self.external.update(((name, skill, code), pk) for name, skill, code, pk in Strategy.objects
+                             .filter(skill_goal__domain__name__in={name for name, _, _ in wanted})
+                             .values_list('skill_goal__domain__name', 'skill_goal__code', 'code', 'pk'))
+        missing = wanted - set(self.external)
+        if missing:
+            raise DomainImportError("Required strategies do not exist: %s" % ', '.join(
+                '%s/%s/%s' % key for key in sorted(missing, key=str)))
+
+
+def import_domain(lines, name=None, batch_size=1000):
+    """Create a domain from the NDJSON lines of an export, in one transaction.
+
+    The lines are read and written batch_size rows at a time, so the file
+    is never held in memory, and must come in the order domain.exporter
+    writes them: the domain first, every row after its parent and every
+    prerequisite after the strategy of this domain it requires. An invalid
+    line rolls back what was written before it. Rows are written with
+    bulk_create and keep the codes and orders of the file, so no
+    code-allocation signal runs per row; the domain itself gets the next
+    free code. Prerequisites in other domains must already exist here,
+    under the same domain name.
+    """
+    records = parse_records(lines)
+    number, d_dict = next(records, (None, None))
+    if d_dict is None or d_dict['type'] != 'domain':
+        raise DomainImportError("The first record must be the domain")
+    name = name or d_dict['name']
+    if Domain.objects.filter(name=name).exists():
+        raise DomainImportError("Domain with this name already exists!")
+
+    with transaction.atomic():
+        # bulk_create skips the signals: no placeholder skill is added,
+        # and the code comes straight from the counter.
+        code = reserve_codes(Domain)[0]
+        try:
+            Domain.objects.bulk_create([Domain(code=code, name=name, description=d_dict.get('description'))])
+        except IntegrityError:
+            # The check above does not hold off a concurrent import.
+            raise DomainImportError("Domain with this name already exists!")
+        domain = Domain.objects.get(code=code)
+        # The parents are new, so their counters do not exist yet and will
+        # be seeded from the codes written here.
+        writer = _Writer(domain, batch_size)
+        for number, record in records:
+            if record['type'] == 'domain':
+                raise DomainImportError("Line %d: a second domain record" % number)
+            writer.add(number, record['type'], record)
+        writer.flush()
+        domain_rebuilt.send(sender=Domain, domain_id=domain.pk)
+    return domain
@@ -0,0 +1,28 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from domain.exporter import iter_domain_ndjson
+from domain.models import Domain
+
+
+class Command(BaseCommand):
+    help = 'Write a domain with its skills, strategies, actions and prerequisites as NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('code', type=int, help='Code of the domain')
+        parser.add_argument('--output', help='File to write instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            domain = Domain.objects.get(code=options['code'])
+        except Domain.DoesNotExist:
+            raise CommandError('No domain with code %d' % options['code'])
+        if options['output']:
+            with open(options['output'], 'wb') as f:
+                for chunk in iter_domain_ndjson(domain):
+                    f.write(chunk)
+        else:
+            for chunk in iter_domain_ndjson(domain):
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.flush()
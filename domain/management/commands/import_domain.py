@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from domain.importer import import_domain
+from domain.models import Skill, Strategy, Action
+
+
+class Command(BaseCommand):
+    help = 'Create a domain from an NDJSON file in the format of export_domain'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file, or '-' for stdin")
+        parser.add_argument('--name', help='Name of the new domain (defaults to the name in the file)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            if options['path'] == '-':
+                domain = import_domain(sys.stdin, name=options['name'], batch_size=options['batch_size'])
+            else:
+                with open(options['path'], encoding='utf-8') as f:
+                    domain = import_domain(f, name=options['name'], batch_size=options['batch_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+        self.stdout.write('Created domain "%s" (code=%d): %d skills, %d strategies, %d actions' % (
+            domain.name, domain.code, Skill.objects.filter(domain=domain).count(),
+            Strategy.objects.filter(skill_goal__domain=domain).count(),
+            Action.objects.filter(strategy__skill_goal__domain=domain).count()))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from domain.models import Domain
+from domain.projection import project_domain, sync_projection
+
+
+class Command(BaseCommand):
+    help = "Materialise a domain's prerequisite network as a graph, or resync the existing one"
+
+    def add_arguments(self, parser):
+        parser.add_argument('code', type=int, help='Code of the domain')
+        parser.add_argument('--name', help='Name of the graph when it is created')
+
+    def handle(self, *args, **options):
+        try:
+            domain = Domain.objects.get(code=options['code'])
+        except Domain.DoesNotExist:
+            raise CommandError('No domain with code %d' % options['code'])
+        try:
+            projection = project_domain(domain, name=options['name'])
+        except ValueError as e:
+            raise CommandError(e)
+        changes = sync_projection(projection)
+        self.stdout.write('Graph "%s" (pk=%d): %d changes applied' % (
+            projection.graph.name, projection.graph_id, changes))
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.6 on 2026-10-18 19:41
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def _renumber(model, parent, field):
+    """The first row of each duplicate (parent, field) pair keeps its
+    number, the others move past the highest one under the parent."""
+    top = {}
+    for group in model.objects.order_by().values(parent, field).annotate(n=Count('pk')).filter(n__gt=1):
+        key = group[parent]
+        if key not in top:
+            top[key] = model.objects.filter(**{parent: key}).aggregate(m=Max(field))['m']
+        for row in list(model.objects.filter(**{parent: key, field: group[field]}).order_by('pk')[1:]):
+            top[key] += 1
+            setattr(row, field, top[key])
+            row.save(update_fields=[field])
+
+
+def renumber_duplicate_codes(apps, schema_editor):
+    # Forms that picked max() + 1 could number two rows alike.
+    _renumber(apps.get_model('domain', 'Action'), 'strategy', 'order')
+    _renumber(apps.get_model('domain', 'Skill'), 'domain', 'code')
+    _renumber(apps.get_model('domain', 'Strategy'), 'skill_goal', 'code')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domain', '0002_rename_problem_formulation_strategy_problem'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicate_codes, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='action',
+            unique_together={('strategy', 'order')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='skill',
+            unique_together={('domain', 'code')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='strategy',
+            unique_together={('skill_goal', 'code')},
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.6 on 2026-10-18 20:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0014_alter_vertex_unique_together'),
+        ('domain', '0003_unique_codes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraphProjection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='projection', to='domain.domain')),
+                ('graph', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='domain_projection', to='graph.graph')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProjectedVertex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('projection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vertices', to='domain.graphprojection')),
+                ('strategy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='domain.strategy')),
+                ('vertex', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='projected_strategy', to='graph.vertex')),
+            ],
+            options={
+                'unique_together': {('projection', 'strategy')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ProjectedEdge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('links', models.IntegerField(default=0)),
+                ('edge', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='projected_link', to='graph.edge')),
+                ('projection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='edges', to='domain.graphprojection')),
+                ('required', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='domain.strategy')),
+                ('strategy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='domain.strategy')),
+            ],
+            options={
+                'unique_together': {('projection', 'required', 'strategy')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.6 on 2026-10-18 20:57
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('domain', '0004_graph_projection'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='domain',
+            name='revision',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='domain',
+            name='updated_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
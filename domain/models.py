@@ -1,18 +1,46 @@
 from django.db import models
-from django.db.models.signals import post_save, pre_save
-from django.dispatch import receiver
+from django.db.models import F, Max, Q
+from django.db.models.signals import post_save, pre_save, post_delete, m2m_changed
+from django.dispatch import receiver, Signal
+from django.utils import timezone
+
+from allocator.models import Counter
+from domain import choices, planner
+
+# Sent with domain_id after a bulk operation (bulk_create, queryset update)
+# changed a domain's rows without per-row model signals.
+domain_rebuilt = Signal()
 
 
 class Domain(models.Model):
     code = models.IntegerField(unique=True)
     name = models.CharField(max_length=128, unique=True)
     description = models.TextField(null=True, blank=True)
+    # Bumped by the signals below on every change to the domain or the rows
+    # under it; conditional GETs compare against it instead of the content.
+    revision = models.PositiveBigIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
 
     def __str__(self):
         return "[%d] %s" % (self.code, self.name)
 
+    @property
+    def version(self):
+        """(revision, updated_at) as read with this row; keys domain.cache."""
+        return self.revision, self.updated_at
+
+    def save(self, *args, **kwargs):
+        # As for graph.Graph: the revision only moves through bump_revisions().
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name not in ('revision', 'updated_at')]
+        super().save(*args, **kwargs)
+
 
 class Skill(models.Model):
+    class Meta:
+        unique_together = [('domain', 'code')]
+
     code = models.IntegerField()
     domain = models.ForeignKey(Domain, on_delete=models.CASCADE)
     name = models.CharField(max_length=128)
@@ -23,6 +51,9 @@ class Skill(models.Model):
 
 
 class Strategy(models.Model):
+    class Meta:
+        unique_together = [('skill_goal', 'code')]
+
     code = models.IntegerField()
     skill_goal = models.ForeignKey(Skill, on_delete=models.CASCADE)
     name = models.CharField(max_length=128)
@@ -33,6 +64,9 @@ class Strategy(models.Model):
 
 
 class Action(models.Model):
+    class Meta:
+        unique_together = [('strategy', 'order')]
+
     strategy = models.ForeignKey(Strategy, on_delete=models.CASCADE)
     order = models.IntegerField()
     description = models.TextField()
@@ -44,10 +78,79 @@ class Prerequisite(models.Model):
     strategy = models.ForeignKey(Strategy, on_delete=models.CASCADE)
 
 
+class GraphProjection(models.Model):
+    """A graph.Graph kept in sync with the prerequisite network of a domain
+    by domain.projection: strategies are vertices, and an edge leads from a
+    required strategy to each strategy with an action requiring it."""
+    domain = models.OneToOneField(Domain, on_delete=models.CASCADE, related_name='projection')
+    graph = models.OneToOneField('graph.Graph', on_delete=models.CASCADE, related_name='domain_projection')
+
+
+class ProjectedVertex(models.Model):
+    class Meta:
+        unique_together = [('projection', 'strategy')]
+
+    projection = models.ForeignKey(GraphProjection, on_delete=models.CASCADE, related_name='vertices')
+    strategy = models.ForeignKey(Strategy, on_delete=models.CASCADE, related_name='+')
+    vertex = models.OneToOneField('graph.Vertex', on_delete=models.CASCADE, related_name='projected_strategy')
+
+
+class ProjectedEdge(models.Model):
+    """links counts the Prerequisite rows behind the edge; edge is null
+    while it would close a cycle in the graph."""
+
+    class Meta:
+        unique_together = [('projection', 'required', 'strategy')]
+
+    projection = models.ForeignKey(GraphProjection, on_delete=models.CASCADE, related_name='edges')
+    required = models.ForeignKey(Strategy, on_delete=models.CASCADE, related_name='+')
+    strategy = models.ForeignKey(Strategy, on_delete=models.CASCADE, related_name='+')
+    links = models.IntegerField(default=0)
+    edge = models.OneToOneField('graph.Edge', on_delete=models.SET_NULL, null=True, related_name='projected_link')
+
+
+# model -> (numbered field, parent foreign key); numbers run per parent.
+NUMBERING = {
+    'domain': ('code', None),
+    'skill': ('code', 'domain'),
+    'strategy': ('code', 'skill_goal'),
+    'action': ('order', 'strategy'),
+}
+
+
+def code_scope(model, parent_id=None):
+    name = model._meta.model_name
+    return 'domain.%s' % name if NUMBERING[name][1] is None else 'domain.%s:%d' % (name, parent_id)
+
+
+def _max_code(model, parent_id):
+    field, parent = NUMBERING[model._meta.model_name]
+    rows = model.objects.filter(**{parent + '_id': parent_id}) if parent else model.objects.all()
+    return lambda: rows.aggregate(m=Max(field))['m'] or 0
+
+
+def reserve_codes(model, parent_id=None, count=1):
+    """The next count free codes (orders for actions) under parent, as a range."""
+    return Counter.objects.reserve(code_scope(model, parent_id), count, seed=_max_code(model, parent_id))
+
+
+def advance_codes(model, parent_id, code):
+    Counter.objects.advance(code_scope(model, parent_id), code, seed=_max_code(model, parent_id))
+
+
+def bump_revisions(domains):
+    """Mark the domains of the queryset as changed."""
+    domains.update(revision=F('revision') + 1, updated_at=timezone.now())
+
+
+def bump_revision(domain_id):
+    bump_revisions(Domain.objects.filter(pk=domain_id))
+
+
 @receiver(pre_save, sender=Domain)
 def set_domain_code(sender, instance, **kwargs):
     if instance.pk is None:
-        instance.code = max(Domain.objects.all().values_list('code', flat=True), default=0) + 1
+        instance.code = reserve_codes(Domain)[0]
 
 
 @receiver(post_save, sender=Domain)
@@ -61,18 +164,124 @@ def set_plugs_in_domain(sender, instance, created, **kwargs):
 @receiver(pre_save, sender=Skill)
 def set_skill_code(sender, instance, **kwargs):
     if instance.pk is None:
-        instance.code = max(Skill.objects.filter(domain=instance.domain).values_list('code', flat=True), default=0) + 1
+        instance.code = reserve_codes(Skill, instance.domain_id)[0]
 
 
 @receiver(pre_save, sender=Strategy)
 def set_strategy_code(sender, instance, **kwargs):
+    # A strategy moved to another skill is renumbered there.
     if instance.pk is None:
-        instance.code = max(Strategy.objects.filter(skill_goal=instance.skill_goal).values_list('code', flat=True),
-                            default=0) + 1
+        instance.code = reserve_codes(Strategy, instance.skill_goal_id)[0]
+    elif Strategy.objects.filter(pk=instance.pk).exclude(skill_goal=instance.skill_goal_id).exists():
+        instance.code = reserve_codes(Strategy, instance.skill_goal_id)[0]
+        # It may have left another domain too.
+        choices.invalidate()
+        planner.invalidate()
+        bump_revisions(Domain.objects.filter(skill__strategy=instance.pk))
 
 
 @receiver(pre_save, sender=Action)
 def set_action_order(sender, instance, **kwargs):
-    if instance.pk is None:
-        instance.order = max(Action.objects.filter(strategy=instance.strategy).values_list('order', flat=True),
-                             default=0) + 1
+    if instance.order is None:
+        instance.order = reserve_codes(Action, instance.strategy_id)[0]
+    else:
+        advance_codes(Action, instance.strategy_id, instance.order)
+
+
+@receiver(post_delete, sender=Domain)
+@receiver(post_delete, sender=Skill)
+@receiver(post_delete, sender=Strategy)
+def discard_counter(sender, instance, **kwargs):
+    child = {Domain: Skill, Skill: Strategy, Strategy: Action}[sender]
+    Counter.objects.discard(code_scope(child, instance.pk))
+
+
+@receiver(post_save, sender=Skill)
+@receiver(post_delete, sender=Skill)
+def skill_changed(sender, instance, **kwargs):
+    choices.invalidate(instance.domain_id)
+    bump_revision(instance.domain_id)
+
+
+def strategy_domain_id(strategy):
+    """Domain of the strategy, or None while its skill is being deleted."""
+    if Strategy.skill_goal.is_cached(strategy):
+        return strategy.skill_goal.domain_id
+    return Skill.objects.filter(pk=strategy.skill_goal_id).values_list('domain_id', flat=True).first()
+
+
+def action_domain_id(action):
+    if Action.strategy.is_cached(action):
+        return strategy_domain_id(action.strategy)
+    return Strategy.objects.filter(pk=action.strategy_id).values_list('skill_goal__domain_id', flat=True).first()
+
+
+@receiver(post_save, sender=Strategy)
+@receiver(post_delete, sender=Strategy)
+def strategy_changed(sender, instance, **kwargs):
+    # When the domain is gone, the skill's or domain's own signal covers it.
+    domain_id = strategy_domain_id(instance)
+    if domain_id is not None:
+        choices.invalidate(domain_id)
+    # Domains whose actions require the strategy show its name.
+    bump_revisions(Domain.objects.filter(Q(pk=domain_id) | Q(skill__strategy__action__prerequisites=instance.pk)))
+
+
+@receiver(post_save, sender=Action)
+@receiver(post_delete, sender=Action)
+def action_changed(sender, instance, **kwargs):
+    domain_id = action_domain_id(instance)
+    if domain_id is not None:
+        planner.invalidate(domain_id)
+        bump_revision(domain_id)
+
+
+@receiver(post_save, sender=Prerequisite)
+@receiver(post_delete, sender=Prerequisite)
+def prerequisite_changed(sender, instance, **kwargs):
+    domain_id = Action.objects.filter(pk=instance.action_id) \
+        .values_list('strategy__skill_goal__domain_id', flat=True).first()
+    if domain_id is not None:
+        planner.invalidate(domain_id)
+        bump_revision(domain_id)
+
+
+@receiver(m2m_changed, sender=Prerequisite)
+def prerequisites_changed(sender, instance, action, reverse, pk_set=None, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # strategy.prerequisites: the actions may lie in any domain.
+        planner.invalidate()
+        domains = Domain.objects.all()
+        if pk_set is not None:
+            domains = domains.filter(skill__strategy__action__in=pk_set)
+        bump_revisions(domains)
+    else:
+        domain_id = action_domain_id(instance)
+        if domain_id is not None:
+            planner.invalidate(domain_id)
+            bump_revision(domain_id)
+
+
+@receiver(post_save, sender=Domain)
+@receiver(post_delete, sender=Domain)
+def domain_changed(sender, instance, created=False, **kwargs):
+    choices.invalidate(instance.pk)
+    planner.invalidate(instance.pk)
+    if not created:
+        bump_revision(instance.pk)
+
+
+@receiver(post_save, sender=GraphProjection)
+@receiver(post_delete, sender=GraphProjection)
+def projection_changed(sender, instance, **kwargs):
+    # The domain page links to its graph.
+    bump_revision(instance.domain_id)
+
+
+@receiver(domain_rebuilt)
+def domain_bulk_changed(sender, domain_id, **kwargs):
+    choices.invalidate(domain_id)
+    planner.invalidate(domain_id)
+    bump_revision(domain_id)
@@ -0,0 +1,147 @@
+"""Learning paths over the Prerequisite links of a domain.
+
+A strategy requires every strategy that one of its actions lists as a
+prerequisite. PrerequisiteGraph compiles these links of one domain into
+integer-indexed adjacency lists, orders them once (depth, critical path,
+cycles) and is cached per domain revision, which every change to an
+Action or Prerequisite bumps. Required strategies of other domains are
+leaves here: what they require in turn belongs to their own domain's
+graph.
+"""
+from array import array
+
+from domain.cache import DomainCache
+
+
+class PrerequisiteCycleError(ValueError):
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super().__init__("Prerequisites contain a cycle: " + " -> ".join(str(pk) for pk in cycle))
+
+
+class Plan:
+    """Strategies to learn for the targets, each after all it requires.
+
+    steps: [(strategy pk, depth)] in learning order, targets included.
+    depth: longest chain of prerequisites below the targets.
+    critical_path: strategy pks of that chain, first to learn first.
+    """
+    __slots__ = ('targets', 'steps', 'depth', 'critical_path')
+
+    def __init__(self, targets, steps, depth, critical_path):
+        self.targets = targets
+        self.steps = steps
+        self.depth = depth
+        self.critical_path = critical_path
+
+
+class PrerequisiteGraph:
+    """Strategy i requires strategies requires[i]; strategies are indexed
+    in pk order.
+
+    depth[i] is 0 for a strategy that requires nothing and one more than
+    its deepest requirement otherwise, or -1 for strategies on or behind a
+    cycle. parent[i] is the requirement that gives that depth, -1 if none.
+    """
+
+    def __init__(self, domain_id, links):
+        self.domain_id = domain_id
+        self.pks = array('q', sorted({pk for link in links for pk in link}))
+        self.index = {pk: i for i, pk in enumerate(self.pks)}
+        n = len(self.pks)
+        self.requires = [[] for _ in range(n)]
+        required_by = [[] for _ in range(n)]
+        for strategy, required in links:
+            i, j = self.index[strategy], self.index[required]
+            self.requires[i].append(j)
+            required_by[j].append(i)
+        self.depth = array('l', [-1]) * n
+        self.parent = array('l', [-1]) * n
+
+        # Kahn's algorithm from the strategies that require nothing.
+        missing = [len(r) for r in self.requires]
+        ready = [i for i in range(n) if not missing[i]]
+        for i in ready:
+            self.depth[i] = 0
+        while ready:
+            j = ready.pop()
+            for i in required_by[j]:
+                if self.depth[j] + 1 > self.depth[i]:
+                    self.depth[i] = self.depth[j] + 1
+                    self.parent[i] = j
+                missing[i] -= 1
+                if not missing[i]:
+                    ready.append(i)
+        # Whatever still misses a requirement is on or behind a cycle.
+        unordered = [i for i in range(n) if missing[i]]
+        for i in unordered:
+            self.depth[i] = self.parent[i] = -1
+        self.cycle = self._cycle_from(unordered[0]) if unordered else None
+
+    @classmethod
+    def load(cls, domain_id):
+        from domain.models import Prerequisite
+        links = Prerequisite.objects.filter(action__strategy__skill_goal__domain_id=domain_id) \
+            .values_list('action__strategy_id', 'strategy_id').distinct()
+        return cls(domain_id, list(links))
+
+    def __len__(self):
+        return len(self.pks)
+
+    def _cycle_from(self, i):
+        """Strategy pks of a cycle reached from the unordered strategy i,
+        closed by repeating the first."""
+        # An unordered strategy always requires another unordered one.
+        seen = {}
+        path = []
+        while i not in seen:
+            seen[i] = len(path)
+            path.append(i)
+            i = next(j for j in self.requires[i] if self.depth[j] < 0)
+        cycle = path[seen[i]:]
+        return [self.pks[j] for j in cycle + cycle[:1]]
+
+    def _chain(self, i):
+        chain = []
+        while i >= 0:
+            chain.append(self.pks[i])
+            i = self.parent[i]
+        chain.reverse()
+        return chain
+
+    def max_depth(self):
+        return max(self.depth, default=0)
+
+    def critical_path(self):
+        """The longest chain of prerequisites in the domain, as strategy pks."""
+        if not len(self) or self.cycle:
+            return []
+        return self._chain(max(range(len(self)), key=self.depth.__getitem__))
+
+    def plan(self, targets):
+        """Plan for the strategy pks in targets; raises PrerequisiteCycleError
+        if they depend on a cycle."""
+        closure = set()
+        stack = [self.index[pk] for pk in targets if pk in self.index]
+        while stack:
+            i = stack.pop()
+            if i not in closure:
+                closure.add(i)
+                stack.extend(self.requires[i])
+        for i in closure:
+            if self.depth[i] < 0:
+                raise PrerequisiteCycleError(self._cycle_from(i))
+        # Targets without any links still are a step of their own.
+        steps = [(self.pks[i], self.depth[i]) for i in closure] + \
+                [(pk, 0) for pk in set(targets) if pk not in self.index]
+        steps.sort(key=lambda step: (step[1], step[0]))
+        deepest = max((self.index[pk] for pk in targets if pk in self.index),
+                      key=self.depth.__getitem__, default=None)
+        if deepest is None:
+            return Plan(list(targets), steps, 0, list(targets[:1]))
+        return Plan(list(targets), steps, self.depth[deepest], self._chain(deepest))
+
+
+_cache = DomainCache(PrerequisiteGraph.load)
+prerequisite_graph = _cache.get
+invalidate = _cache.invalidate
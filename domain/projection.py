@@ -0,0 +1,322 @@
+"""The prerequisite network of a domain as a graph.Graph.
+
+project_domain() creates the graph of a domain: strategies become
+vertices, and an edge leads from a required strategy to each strategy
+with an action that requires it. Several actions may require the same
+strategy; the edge stays while any of them does. Required strategies of
+other domains are vertices too.
+
+From then on the receivers below apply each saved or deleted Strategy and
+Prerequisite to the graph one vertex or edge at a time, through the graph
+app's own per-row maintenance (ranks, closure, snapshots).
+sync_projection() compares a whole projection with its domain and writes
+only the differences, in bulk; it builds new projections and repairs
+after changes the signals cannot see (bulk_create, queryset updates).
+
+The graph stays acyclic: a link that would close a cycle is kept without
+an edge and retried whenever an edge of the projection goes away.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from domain.models import Domain, Strategy, Action, Prerequisite, GraphProjection, ProjectedVertex, ProjectedEdge, \
+    strategy_domain_id
+from graph.models import Graph, Vertex, Edge, reserve_vids
+from graph.signals import graph_rebuilt
+from graph.snapshot import GraphCycleError
+
+
+def _labels(strategies):
+    """{pk: (vertex name, vertex description)} of a Strategy queryset."""
+    rows = strategies.values_list('pk', 'name', 'skill_goal__domain__code', 'skill_goal__code', 'code')
+    return {pk: (name, '%d/%d/%d' % tuple(codes)) for pk, name, *codes in rows}
+
+
+def _desired(domain_id):
+    """Vertex labels by strategy pk and link counts by (required, strategy)."""
+    labels = _labels(Strategy.objects.filter(skill_goal__domain_id=domain_id).order_by('skill_goal__code', 'code'))
+    links = Counter(Prerequisite.objects.filter(action__strategy__skill_goal__domain_id=domain_id)
+                    .values_list('strategy_id', 'action__strategy_id'))
+    external = {required for required, _ in links} - set(labels)
+    if external:
+        labels.update(_labels(Strategy.objects.filter(pk__in=external)
+                              .order_by('skill_goal__domain__code', 'skill_goal__code', 'code')))
+    return labels, links
+
+
+def _reaches(adjacency, start, goal):
+    seen = {start}
+    stack = [start]
+    while stack:
+        u = stack.pop()
+        if u == goal:
+            return True
+        for v in adjacency[u]:
+            if v not in seen:
+                seen.add(v)
+                stack.append(v)
+    return False
+
+
+def _acyclic(adjacency, candidates):
+    """True if the edges in adjacency plus the candidate edges form a DAG."""
+    adjacency = defaultdict(list, {u: list(vs) for u, vs in adjacency.items()})
+    for u, v in candidates:
+        adjacency[u].append(v)
+    missing = Counter(v for vs in adjacency.values() for v in vs)
+    ready = [u for u in adjacency if not missing[u]]
+    ordered = 0
+    while ready:
+        u = ready.pop()
+        ordered += 1
+        for v in adjacency[u]:
+            missing[v] -= 1
+            if not missing[v]:
+                ready.append(v)
+    return ordered == len(set(adjacency) | set(missing))
+
+
+def _addable(edges, candidates):
+    """The candidate (source, target) pairs, in order, that can join the
+    graph edges without closing a cycle."""
+    adjacency = defaultdict(list)
+    for u, v in edges:
+        adjacency[u].append(v)
+    if _acyclic(adjacency, candidates):
+        return list(candidates)
+    accepted = []
+    for u, v in candidates:
+        if not _reaches(adjacency, v, u):
+            adjacency[u].append(v)
+            accepted.append((u, v))
+    return accepted
+
+
+def sync_projection(projection):
+    """Bring the projection up to date with its domain, writing only what differs.
+
+    Returns the number of vertices and edges created, changed or deleted.
+    """
+    graph_id = projection.graph_id
+    labels, links = _desired(projection.domain_id)
+    changes = 0
+    with transaction.atomic():
+        mapped = {strategy: (vertex, (name, description)) for strategy, vertex, name, description in
+                  ProjectedVertex.objects.filter(projection=projection)
+                  .values_list('strategy_id', 'vertex_id', 'vertex__name', 'vertex__description')}
+        gone = [vertex for strategy, (vertex, _) in mapped.items() if strategy not in labels]
+        # Cascades to the edges and mapping rows of these vertices.
+        Vertex.objects.filter(pk__in=gone).delete()
+        renamed = [Vertex(pk=vertex, name=labels[strategy][0], description=labels[strategy][1])
+                   for strategy, (vertex, label) in mapped.items() if strategy in labels and label != labels[strategy]]
+        Vertex.objects.bulk_update(renamed, ['name', 'description'])
+        new = [strategy for strategy in labels if strategy not in mapped]
+        if new:
+            vids = reserve_vids(graph_id, len(new))
+            Vertex.objects.bulk_create([Vertex(graph_id=graph_id, VID=vid, name=labels[strategy][0],
+                                               description=labels[strategy][1]) for vid, strategy in zip(vids, new)])
+            by_vid = dict(Vertex.objects.filter(graph_id=graph_id, VID__gte=vids.start, VID__lt=vids.stop)
+                          .values_list('VID', 'pk'))
+            ProjectedVertex.objects.bulk_create([ProjectedVertex(projection=projection, strategy_id=strategy,
+                                                                 vertex_id=by_vid[vid])
+                                                 for vid, strategy in zip(vids, new)])
+        changes += len(gone) + len(renamed) + len(new)
+
+        current = {(required, strategy): (pk, count, edge) for pk, required, strategy, count, edge in
+                   ProjectedEdge.objects.filter(projection=projection)
+                   .values_list('pk', 'required_id', 'strategy_id', 'links', 'edge_id')}
+        stale = [value for key, value in current.items() if key not in links]
+        Edge.objects.filter(pk__in=[edge for _, _, edge in stale if edge is not None]).delete()
+        ProjectedEdge.objects.filter(pk__in=[pk for pk, _, _ in stale]).delete()
+        recounted = [ProjectedEdge(pk=pk, links=links[key]) for key, (pk, count, _) in current.items()
+                     if key in links and count != links[key]]
+        ProjectedEdge.objects.bulk_update(recounted, ['links'])
+        ProjectedEdge.objects.bulk_create([ProjectedEdge(projection=projection, required_id=required,
+                                                         strategy_id=strategy, links=count)
+                                           for (required, strategy), count in links.items()
+                                           if (required, strategy) not in current])
+        changes += len(stale)
+
+        vertex_of = dict(ProjectedVertex.objects.filter(projection=projection).values_list('strategy_id', 'vertex_id'))
+        pending = {(vertex_of[required], vertex_of[strategy]): pk for pk, required, strategy in
+                   ProjectedEdge.objects.filter(projection=projection, edge=None).order_by('pk')
+                   .values_list('pk', 'required_id', 'strategy_id')}
+        if pending:
+            edges = Edge.objects.filter(source__graph_id=graph_id).values_list('pk', 'source_id', 'target_id')
+            existing = {pk: (source, target) for pk, source, target in edges}
+            added = _addable(existing.values(), list(pending))
+            created = Edge.objects.bulk_create([Edge(source_id=source, target_id=target) for source, target in added])
+            new_edges = [(edge.source_id, edge.target_id, edge.pk) for edge in created]
+            if not all(pk for _, _, pk in new_edges):
+                # The backend returns no pks from bulk inserts: find ours by
+                # their ends among the edges that were not there before.
+                wanted = set(added)
+                new_edges = [(source, target, pk) for pk, source, target in edges.all()
+                             if pk not in existing and (source, target) in wanted]
+            ProjectedEdge.objects.bulk_update([ProjectedEdge(pk=pending[source, target], edge_id=pk)
+                                               for source, target, pk in new_edges], ['edge'])
+            changes += len(added)
+        if changes:
+            graph_rebuilt.send(sender=Graph, graph_id=graph_id)
+    return changes
+
+
+def project_domain(domain, name=None):
+    """The projection of the domain, created with its graph if there is none."""
+    projection = GraphProjection.objects.filter(domain=domain).first()
+    if projection is not None:
+        return projection
+    name = name or ('Domain %d: %s' % (domain.code, domain.name))[:128]
+    if Graph.objects.filter(name=name).exists():
+        raise ValueError("Graph with this name already exists!")
+    with transaction.atomic():
+        graph = Graph.objects.create(name=name, description='Prerequisite network of domain %d' % domain.code)
+        projection = GraphProjection.objects.create(domain=domain, graph=graph)
+        sync_projection(projection)
+    return projection
+
+
+def _vertex(projection, strategy_pk):
+    """Vertex pk of the strategy in the projection; created if missing."""
+    vertex_id = ProjectedVertex.objects.filter(projection=projection, strategy_id=strategy_pk) \
+        .values_list('vertex_id', flat=True).first()
+    if vertex_id is None:
+        name, description = _labels(Strategy.objects.filter(pk=strategy_pk))[strategy_pk]
+        vertex_id = Vertex.objects.create(graph_id=projection.graph_id, name=name, description=description).pk
+        ProjectedVertex.objects.create(projection=projection, strategy_id=strategy_pk, vertex_id=vertex_id)
+    return vertex_id
+
+
+def _add_edge(link, source_id, target_id):
+    if source_id == target_id:
+        return
+    try:
+        edge = Edge.objects.create(source_id=source_id, target_id=target_id)
+    except GraphCycleError:
+        return
+    ProjectedEdge.objects.filter(pk=link.pk).update(edge=edge)
+
+
+def link_added(projection, required_pk, strategy_pk):
+    link, created = ProjectedEdge.objects.get_or_create(projection=projection, required_id=required_pk,
+                                                        strategy_id=strategy_pk, defaults={'links': 1})
+    if not created:
+        link.links += 1
+        link.save(update_fields=['links'])
+    if link.edge_id is None:
+        _add_edge(link, _vertex(projection, required_pk), _vertex(projection, strategy_pk))
+
+
+def link_removed(projection, required_pk, strategy_pk):
+    link = ProjectedEdge.objects.filter(projection=projection, required_id=required_pk,
+                                        strategy_id=strategy_pk).first()
+    if link is None:
+        return
+    if link.links > 1:
+        link.links -= 1
+        link.save(update_fields=['links'])
+        return
+    link.delete()
+    if link.edge_id is not None:
+        Edge.objects.get(pk=link.edge_id).delete()
+        _retry_skipped(projection)
+    # A strategy of another domain stays only while something here requires it.
+    if not ProjectedEdge.objects.filter(projection=projection, required_id=required_pk).exists() and \
+            not Strategy.objects.filter(pk=required_pk, skill_goal__domain_id=projection.domain_id).exists():
+        for mapping in ProjectedVertex.objects.filter(projection=projection, strategy_id=required_pk) \
+                .select_related('vertex'):
+            mapping.vertex.delete()
+
+
+def _retry_skipped(projection):
+    skipped = list(ProjectedEdge.objects.filter(projection=projection, edge=None))
+    if skipped:
+        vertex_of = dict(ProjectedVertex.objects.filter(projection=projection)
+                         .values_list('strategy_id', 'vertex_id'))
+        for link in skipped:
+            if link.required_id in vertex_of and link.strategy_id in vertex_of:
+                _add_edge(link, vertex_of[link.required_id], vertex_of[link.strategy_id])
+
+
+def _projection_of_actions(action_pks):
+    """[(GraphProjection, strategy pk)] of the actions whose domain is projected."""
+    rows = Action.objects.filter(pk__in=action_pks, strategy__skill_goal__domain__projection__isnull=False) \
+        .values_list('strategy_id', 'strategy__skill_goal__domain_id', 'strategy__skill_goal__domain__projection',
+                     'strategy__skill_goal__domain__projection__graph_id')
+    return [(GraphProjection(pk=projection, domain_id=domain, graph_id=graph), strategy)
+            for strategy, domain, projection, graph in rows]
+
+
+@receiver(post_save, sender=Prerequisite)
+def prerequisite_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        for projection, strategy in _projection_of_actions([instance.action_id]):
+            link_added(projection, instance.strategy_id, strategy)
+
+
+# remove() and clear() delete the Prerequisite rows with signals, so only
+# add() needs the m2m signal.
+@receiver(m2m_changed, sender=Prerequisite)
+def prerequisites_added(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        for projection, strategy in _projection_of_actions(pk_set):
+            link_added(projection, instance.pk, strategy)
+    else:
+        for projection, strategy in _projection_of_actions([instance.pk]):
+            for required in pk_set:
+                link_added(projection, required, strategy)
+
+
+@receiver(post_delete, sender=Prerequisite)
+def prerequisite_deleted(sender, instance, **kwargs):
+    for projection, strategy in _projection_of_actions([instance.action_id]):
+        link_removed(projection, instance.strategy_id, strategy)
+
+
+@receiver(pre_save, sender=Strategy)
+def remember_strategy_domain(sender, instance, raw=False, **kwargs):
+    if instance.pk is not None and not raw:
+        instance._domain_before_save = Strategy.objects.filter(pk=instance.pk) \
+            .values_list('skill_goal__domain_id', flat=True).first()
+
+
+@receiver(post_save, sender=Strategy)
+def strategy_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    domain_id = strategy_domain_id(instance)
+    before = getattr(instance, '_domain_before_save', domain_id)
+    if before != domain_id:
+        # Moved to another domain together with the links of its actions.
+        for projection in GraphProjection.objects.filter(domain_id__in=[before, domain_id]):
+            sync_projection(projection)
+        return
+    if created:
+        for projection in GraphProjection.objects.filter(domain_id=domain_id):
+            _vertex(projection, instance.pk)
+        return
+    label = None
+    for mapping in ProjectedVertex.objects.filter(strategy=instance).select_related('vertex'):
+        label = label or _labels(Strategy.objects.filter(pk=instance.pk))[instance.pk]
+        if (mapping.vertex.name, mapping.vertex.description) != label:
+            mapping.vertex.name, mapping.vertex.description = label
+            mapping.vertex.save()
+
+
+@receiver(pre_delete, sender=Strategy)
+def strategy_deleting(sender, instance, **kwargs):
+    for mapping in ProjectedVertex.objects.filter(strategy=instance).select_related('vertex'):
+        mapping.vertex.delete()
+
+
+@receiver(pre_delete, sender=Domain)
+def domain_deleting(sender, instance, **kwargs):
+    # The graph goes with the domain; deleting it first spares the
+    # per-vertex updates of the cascade.
+    for projection in GraphProjection.objects.filter(domain=instance).select_related('graph'):
+        projection.graph.delete()
@@ -1 +1,383 @@
-# Create your tests here.
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+
+from domain.hierarchy import load_tree
+from domain.importer import DomainImportError, import_domain
+from domain.models import Domain, Skill, Strategy, Action, Prerequisite, ProjectedEdge, bump_revision
+from domain.planner import PrerequisiteCycleError, PrerequisiteGraph, prerequisite_graph
+from domain.projection import project_domain, sync_projection
+from graph.models import Graph, Vertex, Edge
+from perf.testing import QueryBudgetMixin
+from skillmap.pagination import encode_cursor
+
+
+def make_domain(name, size):
+    """A domain with size skills of size strategies, each with size actions
+    that all require the first strategy of the domain."""
+    domain = Domain.objects.create(name=name)
+    first = None
+    for i in range(size):
+        skill = Skill.objects.create(domain=domain, name='s%d' % i)
+        for j in range(size):
+            strategy = Strategy.objects.create(skill_goal=skill, name='st%d' % j)
+            first = first or strategy
+            for k in range(size):
+                Action.objects.create(strategy=strategy, description='a%d' % k).prerequisites.add(first)
+    return domain
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    # The same budget must hold for a small and a larger domain.
+    SIZES = (2, 5)
+
+    def test_domain_list(self):
+        for size in self.SIZES:
+            make_domain('d%d' % size, size)
+            with self.assertMaxQueries(1):
+                self.assertEqual(self.client.get(reverse('domains')).status_code, 200)
+
+    def test_domain_detail(self):
+        for size in self.SIZES:
+            domain = make_domain('d%d' % size, size)
+            # One query for the domain's revision, one for the page.
+            with self.assertMaxQueries(3):
+                self.assertEqual(self.client.get(reverse('domain_detail', args=(domain.code,))).status_code, 200)
+
+    def test_skill_detail(self):
+        for size in self.SIZES:
+            domain = make_domain('d%d' % size, size)
+            url = reverse('skill_detail', args=(domain.code, domain.skill_set.last().code))
+            with self.assertMaxQueries(3):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_strategy_detail(self):
+        for size in self.SIZES:
+            strategy = Strategy.objects.select_related('skill_goal__domain') \
+                .filter(skill_goal__domain=make_domain('d%d' % size, size)).last()
+            url = reverse('strategy_detail', args=(strategy.skill_goal.domain.code, strategy.skill_goal.code,
+                                                   strategy.code))
+            # Cold: the planner's cache reads the domain version it loads at.
+            with self.assertMaxQueries(7):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_domain_tree(self):
+        for size in self.SIZES:
+            domain = make_domain('d%d' % size, size)
+            with self.assertMaxQueries(7):
+                response = self.client.get(reverse('domain_tree', args=(domain.code,)))
+                self.assertEqual(response.status_code, 200)
+            tree = response.json()
+            self.assertEqual(len(tree['skills']), size + 1)
+            self.assertEqual(sum(len(action['prerequisites']) for skill in tree['skills']
+                                 for strategy in skill['strategies'] for action in strategy['actions']),
+                             size ** 3)
+            with self.assertMaxQueries(1):
+                response = self.client.get(reverse('domain_tree', args=(domain.code,)),
+                                           HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+
+    def test_strategy_update(self):
+        for size in self.SIZES:
+            strategies = Strategy.objects.select_related('skill_goal__domain') \
+                .filter(skill_goal__domain=make_domain('d%d' % size, size)).order_by('pk')
+            first, strategy = strategies.first(), strategies.last()
+            url = reverse('strategy_update', args=(strategy.skill_goal.domain.code, strategy.skill_goal.code,
+                                                   strategy.code))
+            # Cold: the choices' cache reads the domain version it loads at.
+            with self.assertMaxQueries(6):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+            # Every action requires the first strategy.
+            self.assertContains(response, '<option value="%d" selected>' % first.pk, count=size)
+            self.assertContains(response, '<option value="%d">' % strategy.pk, count=size + 1)
+
+
+class DomainListTests(QueryBudgetMixin, TestCase):
+    def test_pages(self):
+        domain = make_domain('big', 2)
+        for i in range(55):
+            Domain.objects.create(name='d%d' % i)
+        response = self.client.get(reverse('domains'))
+        first = list(response.context['domains'])
+        self.assertEqual(len(first), 50)
+        self.assertEqual([d['code'] for d in first], sorted(d['code'] for d in first))
+        row = next(d for d in first if d['code'] == domain.code)
+        self.assertEqual((row['skill_count'], row['strategy_count']),
+                         (domain.skill_set.count(), Strategy.objects.filter(skill_goal__domain=domain).count()))
+        rest = list(self.client.get(reverse('domains') + '?' + response.context['page_obj'].next_query)
+                    .context['domains'])
+        self.assertEqual(len(first) + len(rest), Domain.objects.count())
+        self.assertGreater(rest[0]['code'], first[-1]['code'])
+        with self.assertMaxQueries(1):
+            response = self.client.get(reverse('domains'), {'before': encode_cursor([rest[0]['code']])})
+            self.assertEqual(response.status_code, 200)
+
+
+class RevisionTests(QueryBudgetMixin, TestCase):
+    def test_not_modified(self):
+        domain, other = make_domain('d', 2), make_domain('other', 1)
+        strategy = Strategy.objects.filter(skill_goal__domain=domain).last()
+        url = reverse('strategy_detail', args=(domain.code, strategy.skill_goal.code, strategy.code))
+        etag = self.client.get(url)['ETag']
+        with self.assertMaxQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Action.objects.create(strategy=strategy, description='new')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        # Renaming a strategy another domain requires changes that domain's pages too.
+        required = Strategy.objects.get(skill_goal__domain=other)
+        Action.objects.filter(strategy=strategy).first().prerequisites.add(required)
+        etag = self.client.get(url)['ETag']
+        required.name = 'renamed'
+        required.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+    def test_etags_differ_between_pages(self):
+        first, second = make_domain('d', 1), make_domain('e', 1)
+        Domain.objects.update(revision=1)
+        etags = set()
+        for domain in (first, second):
+            skill = Skill.objects.filter(domain=domain).first()
+            for name, args in (('domain_detail', ()), ('domain_tree', ()), ('domain_export', ()),
+                               ('skill_detail', (skill.code,)), ('skill_plan', (skill.code,))):
+                etags.add(self.client.get(reverse(name, args=(domain.code,) + args))['ETag'])
+        self.assertEqual(len(etags), 10)
+
+
+class StrategyChoicesTests(TestCase):
+    def test_choices_follow_changes(self):
+        domain = make_domain('d', 2)
+        strategy = Strategy.objects.filter(skill_goal__domain=domain).last()
+        url = reverse('strategy_update', args=(domain.code, strategy.skill_goal.code, strategy.code))
+        self.client.get(url)
+        added = Strategy.objects.create(skill_goal=strategy.skill_goal, name='added later')
+        self.assertContains(self.client.get(url), '>added later</option>', count=3)
+        added.skill_goal.name = 'renamed skill'
+        added.skill_goal.save()
+        self.assertContains(self.client.get(url), '<optgroup label="renamed skill">', count=3)
+        added.delete()
+        self.assertNotContains(self.client.get(url), 'added later')
+
+    def test_change_from_another_process(self):
+        domain = make_domain('d', 2)
+        strategy = Strategy.objects.filter(skill_goal__domain=domain).last()
+        url = reverse('strategy_update', args=(domain.code, strategy.skill_goal.code, strategy.code))
+        self.client.get(url)
+        # New rows and a new revision, but no signal in this process.
+        Strategy.objects.bulk_create([Strategy(skill_goal=strategy.skill_goal, code=99, name='added elsewhere')])
+        bump_revision(domain.pk)
+        self.assertContains(self.client.get(url), '>added elsewhere</option>', count=3)
+
+
+class PlannerTests(TestCase):
+    def chain(self, domain, length):
+        """length strategies, each with one action requiring the one before."""
+        skill = Skill.objects.create(domain=domain, name='chain')
+        strategies = []
+        for i in range(length):
+            strategies.append(Strategy.objects.create(skill_goal=skill, name='c%d' % i))
+            action = Action.objects.create(strategy=strategies[-1], description='step')
+            if i:
+                action.prerequisites.add(strategies[-2])
+        return strategies
+
+    def test_plan(self):
+        graph = PrerequisiteGraph(1, [(4, 2), (4, 3), (3, 2), (2, 1), (5, 1)])
+        self.assertIsNone(graph.cycle)
+        self.assertEqual(graph.critical_path(), [1, 2, 3, 4])
+        plan = graph.plan([4])
+        self.assertEqual(plan.steps, [(1, 0), (2, 1), (3, 2), (4, 3)])
+        self.assertEqual(plan.depth, 3)
+        plan = graph.plan([5, 9])
+        self.assertEqual(plan.steps, [(1, 0), (9, 0), (5, 1)])
+        self.assertEqual(plan.critical_path, [1, 5])
+
+    def test_cycle(self):
+        graph = PrerequisiteGraph(1, [(2, 1), (3, 2), (2, 3), (4, 1)])
+        self.assertEqual(graph.cycle, [2, 3, 2])
+        self.assertEqual(graph.plan([4]).steps, [(1, 0), (4, 1)])
+        with self.assertRaises(PrerequisiteCycleError) as raised:
+            graph.plan([3])
+        cycle = raised.exception.cycle
+        self.assertEqual((set(cycle), len(cycle), cycle[0]), ({2, 3}, 3, cycle[-1]))
+
+    def test_cache_follows_changes(self):
+        domain = Domain.objects.create(name='d')
+        strategies = self.chain(domain, 3)
+        self.assertEqual(prerequisite_graph(domain.pk).max_depth(), 2)
+        self.assertIs(prerequisite_graph(domain.pk), prerequisite_graph(domain.pk))
+        strategies[0].action_set.get().prerequisites.add(strategies[2])
+        self.assertEqual(len(prerequisite_graph(domain.pk).cycle), 4)
+        strategies[0].action_set.get().delete()
+        self.assertIsNone(prerequisite_graph(domain.pk).cycle)
+
+    def test_cache_follows_other_processes(self):
+        domain = Domain.objects.create(name='d')
+        strategies = self.chain(domain, 3)
+        self.assertEqual(prerequisite_graph(domain.pk).max_depth(), 2)
+        # A link and a new revision, but no signal in this process.
+        Prerequisite.objects.bulk_create([Prerequisite(action=strategies[0].action_set.get(),
+                                                       strategy=strategies[2])])
+        bump_revision(domain.pk)
+        self.assertEqual(len(prerequisite_graph(domain.pk).cycle), 4)
+
+    def test_views(self):
+        domain = Domain.objects.create(name='d')
+        first, _, last = self.chain(domain, 3)
+        args = (domain.code, last.skill_goal.code)
+        path = self.client.get(reverse('strategy_plan', args=args + (last.code,))).json()
+        self.assertEqual([step['strategy'] for step in path['steps']], [first.code, first.code + 1, last.code])
+        self.assertEqual(path['depth'], 2)
+        self.assertEqual(self.client.get(reverse('skill_plan', args=args)).json()['depth'], 2)
+        self.assertContains(self.client.get(reverse('strategy_detail', args=args + (last.code,))),
+                            'critical path: 3 strategies')
+        first.action_set.get().prerequisites.add(last)
+        self.assertEqual(self.client.get(reverse('strategy_plan', args=args + (last.code,))).status_code, 409)
+        self.assertContains(self.client.get(reverse('strategy_detail', args=args + (last.code,))),
+                            'Prerequisites contain a cycle')
+
+
+class ExportImportTests(QueryBudgetMixin, TestCase):
+    def export(self, domain):
+        response = self.client.get(reverse('domain_export', args=(domain.code,)))
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def contents(self, domain):
+        """The tree of the domain without its own code and name."""
+        tree = load_tree(domain.code).as_dict()
+        for skill in tree['skills']:
+            for strategy in skill['strategies']:
+                for action in strategy['actions']:
+                    for ref in action['prerequisites']:
+                        if ref['domain'] == tree['code']:
+                            ref['domain'] = None
+        del tree['code'], tree['name']
+        return tree
+
+    def test_round_trip(self):
+        for size in (2, 4):
+            other = make_domain('other%d' % size, 1)
+            domain = make_domain('d%d' % size, size)
+            # One prerequisite in another domain.
+            Action.objects.filter(strategy__skill_goal__domain=domain).first().prerequisites \
+                .add(Strategy.objects.get(skill_goal__domain=other))
+            lines = self.export(domain)
+            # 17 to import, 9 to index the new domain for search, 1 for its revision.
+            with self.assertMaxQueries(27):
+                copy = import_domain(lines, name='copy%d' % size)
+            self.assertEqual(self.contents(copy), self.contents(domain))
+            # Counters continue after the imported codes.
+            self.assertEqual(Skill.objects.create(domain=copy, name='new').code, size + 2)
+
+    def test_invalid(self):
+        lines = self.export(make_domain('d', 2))
+        with self.assertRaises(DomainImportError):
+            import_domain(lines)
+        with self.assertRaises(DomainImportError):
+            import_domain([line for line in lines if '"type": "strategy"' not in line], name='copy')
+        self.assertFalse(Domain.objects.filter(name='copy').exists())
+        # Another import took the name after the check.
+        with mock.patch('domain.importer.Domain.objects.filter') as existing:
+            existing.return_value.exists.return_value = False
+            with self.assertRaises(DomainImportError):
+                import_domain(lines)
+
+    def test_batches(self):
+        domain = make_domain('d', 3)
+        lines = self.export(domain)
+        for size in (1, 2):
+            copy = import_domain(lines, name='copy%d' % size, batch_size=size)
+            self.assertEqual(self.contents(copy), self.contents(domain))
+        # Written batch by batch, but still all or nothing.
+        with self.assertRaises(DomainImportError):
+            import_domain(lines + ['{"type": "skill", "code": 1, "name": "again"}'], name='broken', batch_size=1)
+        self.assertFalse(Domain.objects.filter(name='broken').exists())
+
+
+class ProjectionTests(TestCase):
+    def edges(self, projection):
+        """Graph edges as (required, strategy) pairs of strategy pks."""
+        strategy_of = dict(projection.vertices.values_list('vertex_id', 'strategy_id'))
+        edges = Edge.objects.filter(source__graph=projection.graph_id) \
+            .values_list('source_id', 'target_id', 'source__rank', 'target__rank')
+        for _, _, source_rank, target_rank in edges:
+            self.assertLess(source_rank, target_rank)
+        return sorted((strategy_of[source], strategy_of[target]) for source, target, _, _ in edges)
+
+    def test_project_and_follow(self):
+        other = make_domain('other', 1)
+        domain = make_domain('d', 3)
+        strategies = list(Strategy.objects.filter(skill_goal__domain=domain).order_by('pk'))
+        first, second, last = strategies[0], strategies[1], strategies[-1]
+        external = Strategy.objects.get(skill_goal__domain=other)
+        Action.objects.filter(strategy=last).first().prerequisites.add(external)
+        projection = project_domain(domain)
+        self.assertEqual(projection.graph.vertex_set.count(), len(strategies) + 1)
+        self.assertEqual(self.edges(projection),
+                         sorted([(first.pk, s.pk) for s in strategies[1:]] + [(external.pk, last.pk)]))
+
+        # Two actions of second now require last: one edge.
+        actions = list(second.action_set.all())
+        actions[0].prerequisites.add(last)
+        actions[1].prerequisites.add(last)
+        self.assertIn((last.pk, second.pk), self.edges(projection))
+        actions[0].prerequisites.remove(last)
+        self.assertIn((last.pk, second.pk), self.edges(projection))
+        # last requiring second would close a cycle: kept without an edge...
+        Action.objects.filter(strategy=last).first().prerequisites.add(second)
+        self.assertNotIn((second.pk, last.pk), self.edges(projection))
+        # ...until the edge in the way goes.
+        actions[1].prerequisites.remove(last)
+        self.assertIn((second.pk, last.pk), self.edges(projection))
+        self.assertNotIn((last.pk, second.pk), self.edges(projection))
+
+        added = Strategy.objects.create(skill_goal=first.skill_goal, name='added')
+        added.name = 'renamed'
+        added.save()
+        self.assertTrue(projection.graph.vertex_set.filter(name='renamed').exists())
+        Action.objects.filter(strategy=last).first().prerequisites.remove(external)
+        self.assertFalse(projection.vertices.filter(strategy=external).exists())
+        last.delete()
+        self.assertEqual(projection.graph.vertex_set.count(), len(strategies))
+        # The signals left nothing for a full comparison to fix.
+        self.assertEqual(sync_projection(projection), 0)
+
+        domain.delete()
+        self.assertFalse(Graph.objects.filter(pk=projection.graph_id).exists())
+
+    def test_sync_repairs_bulk_changes(self):
+        domain = make_domain('d', 2)
+        projection = project_domain(domain)
+        strategies = list(Strategy.objects.filter(skill_goal__domain=domain).order_by('pk'))
+        Strategy.objects.filter(pk=strategies[1].pk).update(name='bulk renamed')
+        Prerequisite.objects.bulk_create([Prerequisite(action=strategies[1].action_set.first(),
+                                                       strategy=strategies[2])])
+        self.assertNotIn((strategies[2].pk, strategies[1].pk), self.edges(projection))
+        self.assertEqual(sync_projection(projection), 2)
+        self.assertIn((strategies[2].pk, strategies[1].pk), self.edges(projection))
+        self.assertTrue(projection.graph.vertex_set.filter(name='bulk renamed').exists())
+        self.assertEqual(sync_projection(projection), 0)
+
+    def test_sync_maps_only_its_own_edges(self):
+        domain = make_domain('d', 2)
+        projection = project_domain(domain)
+        strategies = list(Strategy.objects.filter(skill_goal__domain=domain).order_by('pk'))
+        Vertex.objects.bulk_create([Vertex(graph_id=projection.graph_id, VID=100 + i, name='x%d' % i) for i in (0, 1)])
+        outside = list(Vertex.objects.filter(graph_id=projection.graph_id, VID__gte=100))
+        bulk_create = Edge.objects.bulk_create
+
+        def with_concurrent_insert(objs, *args, **kwargs):
+            # Another writer adds an edge to the graph just before ours.
+            bulk_create([Edge(source=outside[0], target=outside[1])])
+            return bulk_create(objs, *args, **kwargs)
+        Prerequisite.objects.bulk_create([Prerequisite(action=strategies[1].action_set.first(),
+                                                       strategy=strategies[2])])
+        with mock.patch.object(Edge.objects, 'bulk_create', with_concurrent_insert):
+            self.assertEqual(sync_projection(projection), 1)
+        mapped = ProjectedEdge.objects.get(projection=projection, required=strategies[2], strategy=strategies[1])
+        self.assertEqual((mapped.edge.source_id, mapped.edge.target_id),
+                         tuple(projection.vertices.get(strategy=s).vertex_id for s in (strategies[2], strategies[1])))
+        self.assertFalse(ProjectedEdge.objects.filter(edge__source=outside[0]).exists())
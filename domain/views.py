@@ -1,25 +1,129 @@
 # Create your views here.
-from django.shortcuts import get_object_or_404
+import json
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce, Substr
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
-from django.views.generic import ListView, CreateView, DetailView, UpdateView
+from django.views.generic import ListView, CreateView, DetailView, UpdateView, View
 
+from domain.choices import strategy_choices
+from domain.exporter import iter_domain_ndjson
 from domain.forms import ActionsFormSet
-from domain.models import Domain, Skill, Strategy
-
-
-class DomainListView(ListView):
-    model = Domain
+from domain.hierarchy import load_tree, strategy_refs
+from domain.models import Domain, Skill, Strategy, Action
+from domain.planner import PrerequisiteCycleError, prerequisite_graph
+from domain.projection import project_domain, sync_projection
+from graph.exporter import gzip_chunks
+from skillmap.conditional import ConditionalGetMixin, revision_etag
+from skillmap.pagination import KeysetListMixin, SUMMARY_LENGTH
+
+
+def learning_path(domain, targets):
+    """Plan for the target strategies with StrategyRefs in place of pks:
+    {'depth', 'steps': [{'ref', 'depth', 'target'}], 'critical_path'},
+    or {'cycle'} when they depend on a prerequisite cycle."""
+    try:
+        plan = prerequisite_graph(domain.pk, domain.version).plan(targets)
+    except PrerequisiteCycleError as e:
+        refs = strategy_refs(e.cycle)
+        return {'cycle': [refs[pk] for pk in e.cycle]}
+    refs = strategy_refs({pk for pk, _ in plan.steps})
+    targets = set(plan.targets)
+    return {'depth': plan.depth,
+            'steps': [{'ref': refs[pk], 'depth': depth, 'target': pk in targets} for pk, depth in plan.steps],
+            'critical_path': [refs[pk] for pk in plan.critical_path]}
+
+
+class DomainRevisionMixin(ConditionalGetMixin):
+    """Conditional GET for the pages under a domain: each shows nothing but
+    the domain's rows and the names of strategies it requires, so the
+    domain's revision covers them. The ETag also names the domain, the
+    view (etag_name) and the codes in its URL, so that no two pages share
+    one."""
+    etag_name = None
+
+    def get_validators(self, domain_code, **kwargs):
+        row = Domain.objects.filter(code=domain_code).values_list('pk', 'revision', 'updated_at').first()
+        if row is None:
+            return None
+        codes = [kwargs[name] for name in sorted(kwargs)]
+        return revision_etag(row[0], row[1], self.etag_name, *codes), row[2]
+
+
+class DomainListView(KeysetListMixin, ListView):
     context_object_name = 'domains'
     template_name = 'domain/domains.html'
+    keys = ('code',)
+
+    def get_queryset(self):
+        skills = Skill.objects.filter(domain=OuterRef('pk')).order_by().values('domain')
+        strategies = Strategy.objects.filter(skill_goal__domain=OuterRef('pk')).order_by().values('skill_goal__domain')
+        return Domain.objects.values('code', 'name').annotate(
+            summary=Substr('description', 1, SUMMARY_LENGTH + 1),
+            skill_count=Coalesce(Subquery(skills.annotate(n=Count('pk')).values('n')), 0),
+            strategy_count=Coalesce(Subquery(strategies.annotate(n=Count('pk')).values('n')), 0))
 
 
-class DomainDetailView(DetailView):
+class DomainDetailView(DomainRevisionMixin, DetailView):
+    etag_name = 'domain'
     model = Domain
     context_object_name = 'domain'
     template_name = 'domain/domain_detail.html'
 
     def get_object(self):
-        return get_object_or_404(Domain, code=self.kwargs['domain_code'])
+        return get_object_or_404(Domain.objects.select_related('projection'), code=self.kwargs['domain_code'])
+
+
+class DomainProjectView(View):
+    """Create the graph of the domain's prerequisite network, or bring it up to date."""
+
+    def post(self, request, domain_code):
+        domain = get_object_or_404(Domain, code=domain_code)
+        try:
+            projection = project_domain(domain)
+        except ValueError as e:
+            raise Http404(str(e))
+        sync_projection(projection)
+        return redirect('detail_graph', projection.graph_id)
+
+
+class DomainTreeView(DomainRevisionMixin, View):
+    """The whole domain as JSON; clients revalidate with its ETag."""
+    etag_name = 'tree'
+
+    def get(self, request, domain_code):
+        try:
+            tree = load_tree(domain_code)
+        except Domain.DoesNotExist:
+            raise Http404("No domain with this code")
+        return HttpResponse(json.dumps(tree.as_dict(), ensure_ascii=False).encode(), content_type='application/json')
+
+
+class DomainExportView(DomainRevisionMixin, View):
+    """The domain with everything under it as NDJSON, for manage.py import_domain."""
+    etag_name = 'ndjson'
+
+    def get_validators(self, domain_code, **kwargs):
+        validators = super().get_validators(domain_code)
+        if validators is not None and 'gzip' in self.request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            etag, last_modified = validators
+            return etag[:-1] + '-gzip"', last_modified
+        return validators
+
+    def get(self, request, domain_code):
+        domain = get_object_or_404(Domain, code=domain_code)
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = StreamingHttpResponse(gzip_chunks(iter_domain_ndjson(domain)))
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = StreamingHttpResponse(iter_domain_ndjson(domain))
+        response['Content-Type'] = 'application/x-ndjson; charset=utf-8'
+        response['Content-Disposition'] = 'attachment; filename="domain-%d.ndjson"' % domain.code
+        response['Vary'] = 'Accept-Encoding'
+        return response
 
 
 class DomainCreateView(CreateView):
@@ -58,14 +162,15 @@ class SkillCreateView(CreateView):
         return reverse_lazy("skill_detail", args=(self.object.domain.code, self.object.code,))
 
 
-class SkillDetailView(DetailView):
+class SkillDetailView(DomainRevisionMixin, DetailView):
+    etag_name = 'skill'
     model = Skill
     context_object_name = 'skill'
     template_name = 'domain/skill_detail.html'
 
     def get_object(self):
-        domain = get_object_or_404(Domain, code=self.kwargs['domain_code'])
-        return get_object_or_404(Skill, domain=domain, code=self.kwargs['skill_code'])
+        return get_object_or_404(Skill.objects.select_related('domain'),
+                                 domain__code=self.kwargs['domain_code'], code=self.kwargs['skill_code'])
 
 
 class SkillUpdateView(UpdateView):
@@ -75,8 +180,8 @@ class SkillUpdateView(UpdateView):
     template_name = 'domain/skill_update.html'
 
     def get_object(self):
-        domain = get_object_or_404(Domain, code=self.kwargs['domain_code'])
-        return get_object_or_404(Skill, domain=domain, code=self.kwargs['skill_code'])
+        return get_object_or_404(Skill.objects.select_related('domain'),
+                                 domain__code=self.kwargs['domain_code'], code=self.kwargs['skill_code'])
 
     def get_success_url(self, **kwargs):
         return reverse_lazy("skill_detail", args=(self.object.domain.code, self.object.code,))
@@ -99,15 +204,45 @@ class StrategyCreateView(CreateView):
                                                      self.object.code,))
 
 
-class StrategyDetailView(DetailView):
+class StrategyDetailView(DomainRevisionMixin, DetailView):
+    etag_name = 'strategy'
     model = Strategy
     context_object_name = 'strategy'
     template_name = 'domain/strategy_detail.html'
 
     def get_object(self):
-        domain = get_object_or_404(Domain, code=self.kwargs['domain_code'])
-        skill = get_object_or_404(Skill, domain=domain, code=self.kwargs['skill_code'])
-        return get_object_or_404(Strategy, skill_goal=skill, code=self.kwargs['strategy_code'])
+        prerequisites = Strategy.objects.select_related('skill_goal__domain')
+        actions = Action.objects.order_by('order').prefetch_related(Prefetch('prerequisites', queryset=prerequisites))
+        return get_object_or_404(Strategy.objects.select_related('skill_goal__domain')
+                                 .prefetch_related(Prefetch('action_set', queryset=actions)),
+                                 skill_goal__domain__code=self.kwargs['domain_code'],
+                                 skill_goal__code=self.kwargs['skill_code'],
+                                 code=self.kwargs['strategy_code'])
+
+    def get_context_data(self, **kwargs):
+        context = super(StrategyDetailView, self).get_context_data(**kwargs)
+        context['learning_path'] = learning_path(self.object.skill_goal.domain, [self.object.pk])
+        return context
+
+
+class LearningPathView(DomainRevisionMixin, View):
+    """JSON learning path to a strategy, or to all strategies of a skill."""
+    etag_name = 'plan'
+
+    def get(self, request, domain_code, skill_code, strategy_code=None):
+        skill = get_object_or_404(Skill.objects.select_related('domain'), domain__code=domain_code, code=skill_code)
+        if strategy_code is None:
+            targets = list(skill.strategy_set.values_list('pk', flat=True))
+        else:
+            targets = [get_object_or_404(Strategy, skill_goal=skill, code=strategy_code).pk]
+        path = learning_path(skill.domain, targets)
+        if 'cycle' in path:
+            return JsonResponse({'error': 'Prerequisites contain a cycle',
+                                 'cycle': [ref.as_dict() for ref in path['cycle']]}, status=409)
+        return JsonResponse({'depth': path['depth'],
+                             'steps': [dict(step['ref'].as_dict(), depth=step['depth'], target=step['target'])
+                                       for step in path['steps']],
+                             'critical_path': [ref.as_dict() for ref in path['critical_path']]})
 
 
 class StrategyUpdateView(UpdateView):
@@ -117,41 +252,46 @@ class StrategyUpdateView(UpdateView):
     template_name = 'domain/strategy_actions_update.html'
 
     def get_object(self):
-        domain = get_object_or_404(Domain, code=self.kwargs['domain_code'])
-        skill = get_object_or_404(Skill, domain=domain, code=self.kwargs['skill_code'])
-        return get_object_or_404(Strategy, skill_goal=skill, code=self.kwargs['strategy_code'])
+        return get_object_or_404(Strategy.objects.select_related('skill_goal__domain'),
+                                 skill_goal__domain__code=self.kwargs['domain_code'],
+                                 skill_goal__code=self.kwargs['skill_code'],
+                                 code=self.kwargs['strategy_code'])
 
     def get_success_url(self, **kwargs):
         return reverse_lazy("strategy_update", args=(self.object.skill_goal.domain.code,
                                                      self.object.skill_goal.code,
                                                      self.object.code,))
 
-    #    def get_form_kwargs(self):
-    #        kwargs = super(StrategyUpdateView, self).get_form_kwargs()
-    #        kwargs.update({
-    #            'domain_code': self.kwargs['domain_code']
-    #        })
-    #        return kwargs
-
     def get_context_data(self, **kwargs):
         context = super(StrategyUpdateView, self).get_context_data(**kwargs)
+        # One query for the prerequisites of all actions, one (or none, when
+        # cached) for the choices every form shares.
+        kwargs = {'instance': self.object,
+                  'queryset': Action.objects.prefetch_related(Prefetch('prerequisites',
+                                                                       queryset=Strategy.objects.only('pk'))),
+                  'form_kwargs': {'choices': strategy_choices(self.object.skill_goal.domain_id,
+                                                                 self.object.skill_goal.domain.version)}}
         if self.request.POST:
-            context['formset'] = ActionsFormSet(self.request.POST, instance=self.object,
-                                                form_kwargs={'domain_code': self.object.skill_goal.domain.code})
+            context['formset'] = ActionsFormSet(self.request.POST, **kwargs)
             context['formset'].full_clean()
         else:
-            context['formset'] = ActionsFormSet(instance=self.object,
-                                                form_kwargs={'domain_code': self.object.skill_goal.domain.code})
-            print(context['formset'])
+            context['formset'] = ActionsFormSet(**kwargs)
         return context
 
     def form_valid(self, form):
         context = self.get_context_data(form=form)
         formset = context['formset']
         if formset.is_valid():
-            response = super().form_valid(form)
-            formset.instance = self.object
-            formset.save()
+            with transaction.atomic():
+                response = super().form_valid(form)
+                formset.instance = self.object
+                # Orders are unique per strategy: park the renumbered and
+                # deleted actions out of the way so that swapping two
+                # orders does not collide halfway through the save.
+                parked = [f.instance.pk for f in formset.initial_forms
+                          if 'order' in f.changed_data or f in formset.deleted_forms]
+                Action.objects.filter(pk__in=parked).update(order=-F('order'))
+                formset.save()
             return response
         else:
             return super().form_invalid(form)
@@ -0,0 +1,168 @@
+"""Online maintenance of Vertex.rank (a topological order) and Vertex.depth.
+
+Inserting an edge u -> v only has to reorder when rank(u) > rank(v); then
+the vertices reachable from v with rank below rank(u) and the vertices
+reaching u with rank above rank(v) swap places within the ranks they
+already hold (Pearce & Kelly). Every search walks the database level by
+level and only visits that region, never the whole graph.
+"""
+import heapq
+
+from django.db import transaction
+from django.db.models import Max
+
+from allocator.models import Counter
+from graph import reachability
+from graph.models import Graph, Vertex, Edge
+from graph.snapshot import GraphSnapshot, GraphCycleError
+
+CHUNK = 500
+
+
+def _chunks(items):
+    items = list(items)
+    for i in range(0, len(items), CHUNK):
+        yield items[i:i + CHUNK]
+
+
+def _search(start_pk, forward, bound, goal_pk=None):
+    """Vertices reachable from start (following edges forward or backward)
+    whose rank stays within bound. Returns {pk: (rank, parent_pk)}."""
+    found = {start_pk: (None, None)}
+    frontier = [start_pk]
+    near, far = ('source_id', 'target') if forward else ('target_id', 'source')
+    rank_filter = {far + '__rank__lte' if forward else far + '__rank__gte': bound}
+    while frontier:
+        next_frontier = []
+        for chunk in _chunks(frontier):
+            rows = Edge.objects.filter(**{near + '__in': chunk}, **rank_filter) \
+                .values_list(near, far + '_id', far + '__rank')
+            for parent, pk, rank in rows:
+                if pk not in found:
+                    found[pk] = (rank, parent)
+                    next_frontier.append(pk)
+                    if pk == goal_pk:
+                        return found
+        frontier = next_frontier
+    return found
+
+
+def find_cycle(source, target):
+    """VIDs of the cycle the edge source -> target would close, or None."""
+    if source.pk == target.pk:
+        return [source.VID, source.VID]
+    if source.rank < target.rank or not reachability.reaches(target.pk, source.pk):
+        return None
+    found = _search(target.pk, True, source.rank, goal_pk=source.pk)
+    path = [source.pk]
+    while path[-1] != target.pk:
+        path.append(found[path[-1]][1])
+    vids = dict(Vertex.objects.filter(pk__in=path).values_list('pk', 'VID'))
+    return [source.VID] + [vids[pk] for pk in reversed(path)]
+
+
+def before_edge_insert(edge):
+    """Reorder ranks so that edge.source precedes edge.target.
+
+    Raises GraphCycleError (and leaves everything untouched) when the edge
+    would close a cycle. Runs inside Edge.save's transaction, so the graph
+    row lock taken here is held until the edge is inserted.
+    """
+    # Serialise rank updates per graph; the ranks are read only once the
+    # lock is held, so a concurrent insert cannot reorder from stale values.
+    list(Graph.objects.select_for_update(of=('self',)).filter(vertex=edge.source_id).values_list('pk'))
+    source = Vertex.objects.get(pk=edge.source_id)
+    target = Vertex.objects.get(pk=edge.target_id)
+    if source.rank < target.rank:
+        return
+    if reachability.reaches(target.pk, source.pk):
+        raise GraphCycleError(find_cycle(source, target))
+    forward = _search(target.pk, True, source.rank)
+    backward = _search(source.pk, False, target.rank)
+    forward[target.pk] = (target.rank, None)
+    backward[source.pk] = (source.rank, None)
+    moved = _by_rank(backward) + _by_rank(forward)
+    ranks = sorted([r for r, _ in backward.values()] + [r for r, _ in forward.values()])
+    Vertex.objects.bulk_update([Vertex(pk=pk, rank=rank) for pk, rank in zip(moved, ranks)], ['rank'])
+
+
+def _by_rank(region):
+    return sorted(region, key=lambda pk: region[pk][0])
+
+
+def after_edge_insert(edge):
+    source_depth = Vertex.objects.filter(pk=edge.source_id).values_list('depth', flat=True).get()
+    # Depths only grow on insert: push the increase forward while it lasts.
+    new_depth = {}
+    frontier = {edge.target_id: source_depth + 1}
+    while frontier:
+        current = dict(Vertex.objects.filter(pk__in=frontier.keys()).values_list('pk', 'depth'))
+        raised = {pk: d for pk, d in frontier.items() if d > new_depth.get(pk, current[pk])}
+        new_depth.update(raised)
+        frontier = {}
+        for chunk in _chunks(raised):
+            for pk, successor in Edge.objects.filter(source_id__in=chunk).values_list('source_id', 'target_id'):
+                frontier[successor] = max(frontier.get(successor, 0), new_depth[pk] + 1)
+    Vertex.objects.bulk_update([Vertex(pk=pk, depth=d) for pk, d in new_depth.items()], ['depth'])
+
+
+def after_edge_delete(edge):
+    """Recompute depths downstream of the removed edge's target, in rank order."""
+    start = Vertex.objects.filter(pk=edge.target_id).values_list('pk', 'rank', 'depth').first()
+    if start is None:
+        return
+    new_depth = {}
+    heap = [(start[1], start[0], start[2])]
+    queued = {start[0]}
+    while heap:
+        _, pk, old = heapq.heappop(heap)
+        depth = 0
+        for pred, pred_depth in Edge.objects.filter(target_id=pk).values_list('source_id', 'source__depth'):
+            depth = max(depth, new_depth.get(pred, pred_depth) + 1)
+        if depth == old:
+            continue
+        new_depth[pk] = depth
+        for rank, successor, successor_depth in Edge.objects.filter(source_id=pk) \
+                .values_list('target__rank', 'target_id', 'target__depth'):
+            if successor not in queued:
+                queued.add(successor)
+                heapq.heappush(heap, (rank, successor, successor_depth))
+    Vertex.objects.bulk_update([Vertex(pk=pk, depth=d) for pk, d in new_depth.items()], ['depth'])
+
+
+def rank_scope(graph_id):
+    return 'graph.rank:%d' % graph_id
+
+
+def _max_rank(graph_id):
+    return lambda: Vertex.objects.filter(graph_id=graph_id).aggregate(r=Max('rank'))['r'] or 0
+
+
+def next_rank(graph_id):
+    """A rank after every vertex of the graph, for a new vertex.
+
+    Taken from an allocator counter, so concurrent creates never share one.
+    """
+    return Counter.objects.reserve(rank_scope(graph_id), seed=_max_rank(graph_id))[0]
+
+
+def rebuild_order(graph_id):
+    """Recompute rank and depth of every vertex, for bulk writers.
+
+    Vertices on a cycle (possible only in data created before ranks were
+    maintained) are placed after the acyclic part in VID order.
+    """
+    snapshot = GraphSnapshot.load(graph_id)
+    order = snapshot.topological_order(strict=False)
+    depth = [0] * len(snapshot)
+    placed = set()
+    for i in order:
+        placed.add(i)
+        for j in snapshot.successors(i):
+            if j not in placed:
+                depth[j] = max(depth[j], depth[i] + 1)
+    with transaction.atomic():
+        Vertex.objects.bulk_update([Vertex(pk=snapshot.pks[i], rank=rank + 1, depth=depth[i])
+                                    for rank, i in enumerate(order)], ['rank', 'depth'], batch_size=1000)
+        Counter.objects.advance(rank_scope(graph_id), len(order), seed=_max_rank(graph_id))
+
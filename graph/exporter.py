@@ -0,0 +1,86 @@
+import json
+import re
+import zlib
+
+from graph.models import Edge
+
+CHUNK_ROWS = 2000
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _rows(template, rows):
+    # Join CHUNK_ROWS rows per yielded chunk: one write per row would make
+    # the per-chunk overhead of the WSGI server dominate.
+    buf = []
+    separator = ''
+    for row in rows:
+        buf.append(separator + template % tuple(_dumps(value) for value in row))
+        separator = ', '
+        if len(buf) >= CHUNK_ROWS:
+            yield ''.join(buf).encode()
+            buf = []
+    if buf:
+        yield ''.join(buf).encode()
+
+
+def iter_graph_json(graph):
+    """Yield the JSON document of a graph (the format GraphFromJSONView reads) as UTF-8 chunks.
+
+    Rows are read with .iterator(), so memory use does not depend on graph
+    size, and the document costs two queries whatever its size.
+    """
+    yield ('{"name": %s, "description": %s, "vertexes": [' % (_dumps(graph.name), _dumps(graph.description))).encode()
+    vertexes = graph.vertex_set.order_by('VID').values_list('VID', 'name', 'description').iterator(CHUNK_ROWS)
+    yield from _rows('{"VID": %s, "name": %s, "description": %s}', vertexes)
+    yield b'], "edges": ['
+    edges = Edge.objects.filter(source__graph=graph).order_by('source__VID', 'target__VID', 'pk') \
+        .values_list('source__VID', 'target__VID', 'description').iterator(CHUNK_ROWS)
+    yield from _rows('{"source": %s, "target": %s, "description": %s}', edges)
+    yield b']}'
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def slice_chunks(chunks, start, end):
+    """Yield bytes start..end (inclusive) of a chunk stream."""
+    offset = 0
+    for chunk in chunks:
+        chunk_end = offset + len(chunk)
+        if chunk_end > start and offset <= end:
+            yield chunk[max(start - offset, 0):end - offset + 1]
+        if chunk_end > end:
+            return
+        offset = chunk_end
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, length):
+    """Resolve a single-range Range header against length.
+
+    Returns (start, end), None for a header we ignore (multiple ranges,
+    malformed) and raises ValueError for an unsatisfiable range.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(length - int(last), 0), length - 1
+    else:
+        start = int(first)
+        end = min(int(last), length - 1) if last else length - 1
+    if start >= length or start > end:
+        raise ValueError(header)
+    return start, end
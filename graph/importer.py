@@ -0,0 +1,83 @@
+from array import array
+
+from django.db import IntegrityError, transaction
+
+from graph.models import Graph, Vertex, Edge
+from graph.signals import graph_rebuilt
+from graph.snapshot import GraphCycleError, GraphSnapshot
+
+
+class GraphImportError(ValueError):
+    pass
+
+
+def _rows(g_dict, key):
+    rows = g_dict.get(key, [])
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise GraphImportError("%s must be a list of objects" % key)
+    return rows
+
+
+def _is_int(value):
+    # JSON true and false load as bool, a subclass of int.
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _check_graph_dict(g_dict, name):
+    if not isinstance(g_dict, dict):
+        raise GraphImportError("A graph must be a JSON object")
+    if not name or not isinstance(name, str):
+        raise GraphImportError("Graph name is missing")
+    if Graph.objects.filter(name=name).exists():
+        raise GraphImportError("Graph with this name already exists!")
+    vids = set()
+    for v_dict in _rows(g_dict, 'vertexes'):
+        if not _is_int(v_dict.get('VID')) or not v_dict.get('name'):
+            raise GraphImportError("Vertex needs an integer VID and a name: %r" % (v_dict,))
+        if v_dict['VID'] in vids:
+            raise GraphImportError("Duplicate VID %d" % v_dict['VID'])
+        vids.add(v_dict['VID'])
+    edges = _rows(g_dict, 'edges')
+    for e_dict in edges:
+        for end in ('source', 'target'):
+            if not _is_int(e_dict.get(end)) or e_dict[end] not in vids:
+                raise GraphImportError("Edge %s %r is not a vertex of the graph" % (end, e_dict.get(end)))
+    # Graphs are acyclic (see graph.dag); an import must not bring a cycle in.
+    vids = sorted(vids)
+    position = {vid: i for i, vid in enumerate(vids)}
+    structure = GraphSnapshot(None, array('q', vids), array('q', vids), [''] * len(vids),
+                              array('l', (position[e_dict['source']] for e_dict in edges)),
+                              array('l', (position[e_dict['target']] for e_dict in edges)))
+    try:
+        structure.topological_order()
+    except GraphCycleError as e:
+        raise GraphImportError(str(e))
+
+
+def import_graph(g_dict, name=None, batch_size=1000):
+    """Create a graph from its JSON dict in one transaction.
+
+    The whole document is validated before anything is written; vertices
+    and edges are inserted with bulk_create and edge endpoints are resolved
+    through a single VID -> pk query.
+    """
+    name = name or (g_dict.get('name') if isinstance(g_dict, dict) else None)
+    _check_graph_dict(g_dict, name)
+    with transaction.atomic():
+        try:
+            g = Graph.objects.create(name=name, description=g_dict.get('description'))
+        except IntegrityError:
+            # The check above does not hold off a concurrent import.
+            raise GraphImportError("Graph with this name already exists!")
+        Vertex.objects.bulk_create([Vertex(graph=g,
+                                           VID=v_dict['VID'],
+                                           name=v_dict['name'],
+                                           description=v_dict.get('description'))
+                                    for v_dict in g_dict.get('vertexes', [])], batch_size=batch_size)
+        pk_by_vid = dict(g.vertex_set.values_list('VID', 'pk'))
+        Edge.objects.bulk_create([Edge(source_id=pk_by_vid[e_dict['source']],
+                                       target_id=pk_by_vid[e_dict['target']],
+                                       description=e_dict.get('description'))
+                                  for e_dict in g_dict.get('edges', [])], batch_size=batch_size)
+        graph_rebuilt.send(sender=Graph, graph_id=g.pk)
+    return g
@@ -0,0 +1,319 @@
+"""Vertex coordinates for drawing a graph, stored in Vertex.x and Vertex.y.
+
+The algorithm depends on the graph:
+
+    layered  -- DAGs: a vertex sits on the layer of its longest incoming
+                path, ordered within the layer by the mean position of
+                its neighbours (a few barycenter sweeps)
+    sfdp     -- other graphs from SFDP_MIN_VERTICES on, when the graphviz
+                sfdp program is installed
+    force    -- other graphs: Fruchterman-Reingold in NumPy, with exact
+                repulsion up to EXACT_MAX_VERTICES and repulsion from
+                grid cell centroids above
+
+Other graphs are those with cycles (only older data has them) and DAGs
+with more than FLAT_RATIO times as many vertices in their widest layer
+as they have layers, which would be drawn as a thin strip.
+
+Every layout is scaled to edges of about unit length. ensure_layout()
+keeps the stored positions and only places vertices without one, or,
+in a layered layout, vertices whose layer changed; the whole graph is
+laid out again when its algorithm changes or on request. Positions are
+stored by the render worker and the layout_graph command; requests only
+read them, see layout_positions().
+"""
+import math
+import shutil
+import subprocess
+
+import numpy as np
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from graph import snapshot as snapshots
+from graph.snapshot import GraphCycleError, get_snapshot
+
+LAYERED, FORCE, SFDP = 'layered', 'force', 'sfdp'
+
+SFDP_MIN_VERTICES = 1000
+FLAT_RATIO = 10
+EXACT_MAX_VERTICES = 2000
+GRID_CELLS = 400
+ITERATIONS = 50
+INCREMENTAL_ITERATIONS = 30
+SWEEPS = 4
+# Pairwise differences held at once by the exact repulsion.
+CHUNK_PAIRS = 1 << 21
+SEED = 0
+
+
+def _arrays(snapshot):
+    """The edge arrays of the snapshot as NumPy views."""
+    return (np.frombuffer(snapshot.sources, dtype=np.dtype(snapshot.sources.typecode)),
+            np.frombuffer(snapshot.targets, dtype=np.dtype(snapshot.targets.typecode)))
+
+
+def layers(snapshot):
+    """Length of the longest path ending at each vertex, or None if the
+    graph has a cycle."""
+    try:
+        order = snapshot.topological_order()
+    except GraphCycleError:
+        return None
+    layer = np.zeros(len(snapshot), dtype=np.int64)
+    for i in order:
+        for j in snapshot.predecessors(i):
+            if layer[j] + 1 > layer[i]:
+                layer[i] = layer[j] + 1
+    return layer
+
+
+def choose_algorithm(snapshot, layer):
+    if layer is not None and len(layer):
+        widest = np.bincount(layer).max()
+        if widest <= FLAT_RATIO * (layer.max() + 1):
+            return LAYERED
+    if len(snapshot) >= SFDP_MIN_VERTICES and shutil.which('sfdp'):
+        return SFDP
+    return FORCE
+
+
+def _mean_of_neighbours(n, ends, others, values):
+    """Mean of values[others] over the edges at each vertex in ends; NaN without edges."""
+    total = np.bincount(ends, weights=values[others], minlength=n)
+    count = np.bincount(ends, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / count
+
+
+def layered_layout(snapshot, layer):
+    n = len(snapshot)
+    sources, targets = _arrays(snapshot)
+    sizes = np.bincount(layer, minlength=int(layer.max()) + 1 if n else 0)
+
+    def spread(order):
+        # Place of each vertex within its layer, as a fraction of the layer
+        # width so that it compares across layers of different sizes.
+        sorted_layers = layer[order]
+        place = np.empty(n)
+        place[order] = np.arange(n) - np.searchsorted(sorted_layers, sorted_layers)
+        return (place + 0.5) / sizes[layer]
+
+    # Start in VID order, then sort each layer by the mean place of the
+    # vertices above it, and of those below on alternate sweeps.
+    fraction = spread(np.lexsort((np.arange(n), layer)))
+    for sweep in range(SWEEPS):
+        if sweep % 2 == 0:
+            centre = _mean_of_neighbours(n, targets, sources, fraction)
+        else:
+            centre = _mean_of_neighbours(n, sources, targets, fraction)
+        centre = np.where(np.isnan(centre), fraction, centre)
+        fraction = spread(np.lexsort((fraction, centre, layer)))
+    # Every layer spans the width of the widest one, so that what sits
+    # above each other in the order also does on the drawing.
+    return (fraction - 0.5) * sizes.max(), -layer.astype(float)
+
+
+def _repulsion(pos, rows):
+    """Repulsive displacement of the vertices in rows by all others."""
+    n = len(pos)
+    out = np.zeros((len(rows), 2))
+    if n <= EXACT_MAX_VERTICES:
+        others, mass, softening = pos, None, 1e-9
+    else:
+        # Every vertex is pushed by the centroid of each grid cell,
+        # weighted with the number of vertices in it.
+        side = int(math.ceil(math.sqrt(GRID_CELLS)))
+        low, high = pos.min(axis=0), pos.max(axis=0)
+        size = np.maximum((high - low) / side, 1e-9)
+        cell_xy = np.minimum(((pos - low) / size).astype(np.int64), side - 1)
+        cell = cell_xy[:, 0] * side + cell_xy[:, 1]
+        mass = np.bincount(cell, minlength=side * side).astype(float)
+        used = mass > 0
+        others = np.stack([np.bincount(cell, weights=pos[:, 0], minlength=side * side)[used],
+                           np.bincount(cell, weights=pos[:, 1], minlength=side * side)[used]], axis=1)
+        mass = mass[used]
+        others /= mass[:, None]
+        softening = float((size ** 2).sum()) / 4
+    ox, oy = others[:, 0], others[:, 1]
+    step = max(1, CHUNK_PAIRS // max(len(others), 1))
+    for start in range(0, len(rows), step):
+        chunk = rows[start:start + step]
+        dx = pos[chunk, 0, None] - ox
+        dy = pos[chunk, 1, None] - oy
+        force = 1.0 / (dx * dx + dy * dy + softening)
+        if mass is not None:
+            force *= mass
+        out[start:start + len(chunk), 0] = (dx * force).sum(axis=1)
+        out[start:start + len(chunk), 1] = (dy * force).sum(axis=1)
+    return out
+
+
+def force_layout(snapshot, pos=None, free=None, iterations=ITERATIONS, seed=SEED):
+    """Fruchterman-Reingold with ideal edge length 1. Only the vertices in
+    free move (all by default); pos gives the starting positions."""
+    n = len(snapshot)
+    if pos is None:
+        pos = np.random.RandomState(seed).rand(n, 2) * math.sqrt(max(n, 1))
+    pos = np.array(pos, dtype=float)
+    rows = np.arange(n) if free is None else np.asarray(free, dtype=np.int64)
+    if not len(rows):
+        return pos
+    sources, targets = _arrays(snapshot)
+    moving = np.zeros(n, dtype=bool)
+    moving[rows] = True
+    # Only edges at a moving vertex pull on anything that moves.
+    touching = moving[sources] | moving[targets]
+    sources, targets = sources[touching], targets[touching]
+    temperature = math.sqrt(max(n, 1)) / 10 if free is None else 1.0
+    for iteration in range(iterations):
+        disp = np.zeros((n, 2))
+        disp[rows] = _repulsion(pos, rows)
+        delta = pos[sources] - pos[targets]
+        distance = np.sqrt((delta ** 2).sum(axis=1)) + 1e-9
+        pull = delta * distance[:, None]
+        for axis in (0, 1):
+            disp[:, axis] -= np.bincount(sources, weights=pull[:, axis], minlength=n)
+            disp[:, axis] += np.bincount(targets, weights=pull[:, axis], minlength=n)
+        length = np.sqrt((disp[rows] ** 2).sum(axis=1)) + 1e-9
+        step = temperature * (1 - iteration / iterations)
+        pos[rows] += disp[rows] / length[:, None] * np.minimum(length, step)[:, None]
+    return pos
+
+
+def sfdp_layout(snapshot):
+    """Positions from graphviz sfdp, or None when it fails."""
+    dot = ['digraph{'] + ['n%d;' % i for i in range(len(snapshot))] + \
+        ['n%d->n%d;' % edge for edge in zip(snapshot.sources, snapshot.targets)] + ['}']
+    try:
+        result = subprocess.run(['sfdp', '-Tplain'], input='\n'.join(dot).encode(), capture_output=True,
+                                check=True, timeout=600)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    pos = np.zeros((len(snapshot), 2))
+    for line in result.stdout.decode().splitlines():
+        fields = line.split()
+        if fields and fields[0] == 'node':
+            pos[int(fields[1][1:])] = float(fields[2]), float(fields[3])
+    return pos
+
+
+def _unit_edges(snapshot, pos):
+    """pos scaled so that the median edge is 1 long."""
+    sources, targets = _arrays(snapshot)
+    if not len(sources):
+        return pos
+    lengths = np.sqrt(((pos[sources] - pos[targets]) ** 2).sum(axis=1))
+    median = float(np.median(lengths))
+    return pos / median if median > 0 else pos
+
+
+def full_layout(snapshot, algorithm, layer=None):
+    if not len(snapshot):
+        return np.zeros((0, 2))
+    if algorithm == LAYERED:
+        return np.stack(layered_layout(snapshot, layer), axis=1)
+    pos = sfdp_layout(snapshot) if algorithm == SFDP else None
+    if pos is None:
+        pos = force_layout(snapshot)
+    return _unit_edges(snapshot, pos)
+
+
+def _place_new(snapshot, pos, stale, rng):
+    """Start stale vertices at the mean of their placed neighbours, or
+    next to the drawing when they have none."""
+    n = len(snapshot)
+    sources, targets = _arrays(snapshot)
+    placed = (~stale).astype(float)
+    for axis in (0, 1):
+        values = np.where(stale, 0.0, pos[:, axis])
+        total = np.bincount(targets, weights=values[sources], minlength=n) + \
+            np.bincount(sources, weights=values[targets], minlength=n)
+        count = np.bincount(targets, weights=placed[sources], minlength=n) + \
+            np.bincount(sources, weights=placed[targets], minlength=n)
+        fallback = pos[~stale, axis].max() + 1 if (~stale).any() else 0.0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pos[stale, axis] = np.where(count[stale] > 0, total[stale] / count[stale], fallback)
+    pos[stale] += rng.uniform(-0.5, 0.5, size=(int(stale.sum()), 2))
+    return pos
+
+
+def _place_in_layers(pos, stale, layer):
+    """Put stale vertices of a layered layout on their layer, at the free
+    slot nearest to the mean of their placed neighbours."""
+    taken = {(int(layer[i]), int(round(pos[i, 0]))) for i in np.flatnonzero(~stale)}
+    for i in np.flatnonzero(stale):
+        x = int(round(pos[i, 0]))
+        offset = 0
+        while (layer[i], x + offset) in taken:
+            offset = -offset if offset > 0 else -offset + 1
+        x += offset
+        taken.add((int(layer[i]), x))
+        pos[i] = x, -layer[i]
+    return pos
+
+
+def compute_layout(snapshot, stored, previous_algorithm=None, full=False):
+    """(algorithm, positions, indices of the changed vertices) for the
+    snapshot, given the stored positions as an (n, 2) array with NaN where
+    there is none."""
+    layer = layers(snapshot)
+    algorithm = choose_algorithm(snapshot, layer)
+    stale = np.isnan(stored).any(axis=1)
+    if full or algorithm != previous_algorithm or stale.all():
+        return algorithm, full_layout(snapshot, algorithm, layer), np.arange(len(snapshot))
+    pos = stored.copy()
+    if algorithm == LAYERED:
+        stale |= pos[:, 1] != -layer
+    if not stale.any():
+        return algorithm, pos, np.arange(0)
+    pos = _place_new(snapshot, pos, stale, np.random.RandomState(SEED))
+    free = np.flatnonzero(stale)
+    if algorithm == LAYERED:
+        return algorithm, _place_in_layers(pos, stale, layer), free
+    return algorithm, force_layout(snapshot, pos, free, INCREMENTAL_ITERATIONS), free
+
+
+def layout_positions(graph, full=False, store=False):
+    """(snapshot, algorithm, (n, 2) array of positions in snapshot order)
+    of the graph: the stored positions, with what is missing laid out.
+
+    Reads only unless store is set, so GET handlers can call it; the
+    placement is deterministic, so later reads return the same positions
+    until something is stored. Storing bumps graph.layout_revision (and
+    updated_at), not the structural revision, and sets graph.layout,
+    graph.layout_revision and graph.updated_at to the new values.
+    """
+    from graph.models import Graph, Vertex
+    snapshot = get_snapshot(graph.pk, graph.version)
+    stored = np.full((len(snapshot), 2), np.nan)
+    for pk, x, y in Vertex.objects.filter(graph_id=graph.pk).values_list('pk', 'x', 'y'):
+        i = snapshot.index.get(pk)
+        if i is not None and x is not None and y is not None:
+            stored[i] = x, y
+    algorithm, pos, changed = compute_layout(snapshot, stored, graph.layout, full)
+    if store and (len(changed) or graph.layout != algorithm):
+        with transaction.atomic():
+            # A structural change bumps the revision too: with the row
+            # locked, the snapshot is still current only if it is unchanged.
+            current = Graph.objects.select_for_update().filter(pk=graph.pk) \
+                .values_list('revision', 'updated_at').first()
+            Vertex.objects.bulk_update([Vertex(pk=snapshot.pks[i], x=float(pos[i, 0]), y=float(pos[i, 1]))
+                                        for i in changed], ['x', 'y'], batch_size=1000)
+            Graph.objects.filter(pk=graph.pk).update(layout=algorithm, layout_revision=F('layout_revision') + 1,
+                                                     updated_at=timezone.now())
+            graph.revision, graph.updated_at, graph.layout_revision = Graph.objects.filter(pk=graph.pk) \
+                .values_list('revision', 'updated_at', 'layout_revision').get()
+        graph.layout = algorithm
+        if current == snapshot.version:
+            snapshots.advance(graph.pk, current, graph.version)
+    return snapshot, algorithm, pos
+
+
+def ensure_layout(graph, full=False, store=True):
+    """{vid: (x, y)} of the graph, laying out and (unless store is False)
+    storing what is missing."""
+    snapshot, _, pos = layout_positions(graph, full, store)
+    return {snapshot.vids[i]: (float(pos[i, 0]), float(pos[i, 1])) for i in range(len(snapshot))}
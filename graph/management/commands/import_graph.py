@@ -0,0 +1,28 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from graph.importer import import_graph, GraphImportError
+
+
+class Command(BaseCommand):
+    help = 'Create a graph from a JSON file in the format of the graph JSON export'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="JSON file, or '-' for stdin")
+        parser.add_argument('--name', help='Name of the new graph (defaults to the name in the file)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            if options['path'] == '-':
+                g_dict = json.load(sys.stdin)
+            else:
+                with open(options['path'], encoding='utf-8') as f:
+                    g_dict = json.load(f)
+            g = import_graph(g_dict, name=options['name'], batch_size=options['batch_size'])
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+        self.stdout.write('Created graph "%s" (pk=%d): %d vertices, %d edges' % (
+            g.name, g.pk, len(g_dict.get('vertexes', [])), len(g_dict.get('edges', []))))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from graph.layout import ensure_layout
+from graph.models import Graph
+
+
+class Command(BaseCommand):
+    help = 'Compute and store the vertex positions of graphs, and redraw their images on the next request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pk', nargs='*', type=int, help='Graphs to lay out (defaults to all)')
+        parser.add_argument('--full', action='store_true', help='Lay out every vertex again, not only new ones')
+
+    def handle(self, *args, **options):
+        graphs = Graph.objects.order_by('pk')
+        if options['pk']:
+            graphs = graphs.filter(pk__in=options['pk'])
+            missing = set(options['pk']) - set(graphs.values_list('pk', flat=True))
+            if missing:
+                raise CommandError('No graph with pk %s' % ', '.join(map(str, sorted(missing))))
+        for graph in graphs:
+            # Storing positions bumps the layout revision.
+            positions = ensure_layout(graph, full=options['full'])
+            # The stored image was drawn from the old positions.
+            Graph.objects.filter(pk=graph.pk).update(render_hash=None)
+            self.stdout.write('Laid out graph "%s" (pk=%d): %d vertices, %s' % (
+                graph.name, graph.pk, len(positions), graph.layout))
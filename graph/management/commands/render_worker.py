@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from graph.models import RenderJob
+
+
+class Command(BaseCommand):
+    help = 'Render queued graph images in the background'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty')
+
+    def handle(self, *args, **options):
+        while True:
+            job = RenderJob.run_next()
+            if job is not None:
+                self.stdout.write('%s [%s]' % (job.graph, job.status))
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.6 on 2026-10-18 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0009_auto_20210928_1826'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='graph',
+            name='render_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.2.6 on 2026-10-18 19:05
+
+from collections import deque
+
+from django.db import migrations, models
+
+
+def compute_ranks(apps, schema_editor):
+    Graph = apps.get_model('graph', 'Graph')
+    Vertex = apps.get_model('graph', 'Vertex')
+    Edge = apps.get_model('graph', 'Edge')
+    for graph_id in Graph.objects.values_list('pk', flat=True):
+        pks = list(Vertex.objects.filter(graph_id=graph_id).order_by('VID', 'pk').values_list('pk', flat=True))
+        successors = {pk: [] for pk in pks}
+        degree = dict.fromkeys(pks, 0)
+        for source_id, target_id in Edge.objects.filter(source__graph_id=graph_id).values_list('source_id',
+                                                                                               'target_id'):
+            if target_id in degree:
+                successors[source_id].append(target_id)
+                degree[target_id] += 1
+        depth = dict.fromkeys(pks, 0)
+        queue = deque(pk for pk in pks if degree[pk] == 0)
+        order = []
+        while queue:
+            pk = queue.popleft()
+            order.append(pk)
+            for successor in successors[pk]:
+                depth[successor] = max(depth[successor], depth[pk] + 1)
+                degree[successor] -= 1
+                if degree[successor] == 0:
+                    queue.append(successor)
+        # Vertices on a cycle go last, in VID order.
+        order += [pk for pk in pks if degree[pk] > 0]
+        Vertex.objects.bulk_update([Vertex(pk=pk, rank=rank + 1, depth=depth[pk]) for rank, pk in enumerate(order)],
+                                   ['rank', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0011_renderjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vertex',
+            name='depth',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='vertex',
+            name='rank',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='vertex',
+            index=models.Index(fields=['graph', 'rank'], name='graph_verte_graph_i_aa7168_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vertex',
+            index=models.Index(fields=['graph', 'depth'], name='graph_verte_graph_i_c21edd_idx'),
+        ),
+        migrations.RunPython(compute_ranks, migrations.RunPython.noop),
+    ]
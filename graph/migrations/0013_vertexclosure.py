@@ -0,0 +1,56 @@
+# Generated by Django 3.2.6 on 2026-10-18 19:08
+
+from collections import deque
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_closure(apps, schema_editor):
+    Vertex = apps.get_model('graph', 'Vertex')
+    Edge = apps.get_model('graph', 'Edge')
+    VertexClosure = apps.get_model('graph', 'VertexClosure')
+    successors = {pk: [] for pk in Vertex.objects.values_list('pk', flat=True)}
+    for source_id, target_id in Edge.objects.values_list('source_id', 'target_id'):
+        successors[source_id].append(target_id)
+    rows = []
+    for start in successors:
+        distance = {start: 0}
+        queue = deque([start])
+        while queue:
+            pk = queue.popleft()
+            for successor in successors[pk]:
+                if successor not in distance:
+                    distance[successor] = distance[pk] + 1
+                    queue.append(successor)
+        rows += [VertexClosure(ancestor_id=start, descendant_id=pk, distance=d)
+                 for pk, d in distance.items() if pk != start]
+    VertexClosure.objects.bulk_create(rows, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0012_vertex_rank_depth'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VertexClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.IntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='graph.vertex')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='graph.vertex')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='vertexclosure',
+            index=models.Index(fields=['descendant', 'distance'], name='graph_verte_descend_6f49fe_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='vertexclosure',
+            unique_together={('ancestor', 'descendant')},
+        ),
+        migrations.RunPython(build_closure, migrations.RunPython.noop),
+    ]
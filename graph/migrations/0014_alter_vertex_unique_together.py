@@ -0,0 +1,35 @@
+# Generated by Django 3.2.6 on 2026-10-18 19:41
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def renumber_duplicate_vids(apps, schema_editor):
+    """Forms that picked max(VID) + 1 could give two vertices of a graph the
+    same VID. The first one keeps it, the others move past the highest VID
+    of the graph, so the constraint below can be added."""
+    Vertex = apps.get_model('graph', 'Vertex')
+    top = {}
+    for group in Vertex.objects.order_by().values('graph', 'VID').annotate(n=Count('pk')).filter(n__gt=1):
+        graph_id = group['graph']
+        if graph_id not in top:
+            top[graph_id] = Vertex.objects.filter(graph_id=graph_id).aggregate(m=Max('VID'))['m']
+        for vertex in list(Vertex.objects.filter(graph_id=graph_id, VID=group['VID']).order_by('pk')[1:]):
+            top[graph_id] += 1
+            vertex.VID = top[graph_id]
+            vertex.save(update_fields=['VID'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0013_vertexclosure'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicate_vids, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='vertex',
+            unique_together={('graph', 'VID')},
+        ),
+    ]
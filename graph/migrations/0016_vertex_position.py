@@ -0,0 +1,28 @@
+# Generated by Django 3.2.6 on 2026-10-18 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0015_graph_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='graph',
+            name='layout',
+            field=models.CharField(blank=True, default='', editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='vertex',
+            name='x',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='vertex',
+            name='y',
+            field=models.FloatField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.6 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0016_vertex_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='renderjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
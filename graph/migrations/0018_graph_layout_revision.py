@@ -0,0 +1,18 @@
+# Generated by Django 3.2.6 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0017_renderjob_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='graph',
+            name='layout_revision',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-18 22:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0018_graph_layout_revision'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='edge',
+            index=models.Index(fields=['source', 'target'], name='graph_edge_source__983d96_idx'),
+        ),
+    ]
@@ -1,65 +1,307 @@
-from django.db import models
-from django.forms import ModelForm, CharField, Textarea, Form
+import hashlib
+import json
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Max
+from django.forms import ModelForm, CharField, BooleanField, Textarea, Form, ValidationError
 import networkx as nx
-from django.apps import apps
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from django.core.files.base import ContentFile
+from django.utils import timezone
 from io import BytesIO
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from networkx.drawing.nx_agraph import graphviz_layout
+
+from allocator.models import Counter
+from graph.layout import ensure_layout
+from graph.snapshot import get_snapshot
+from perf.timing import span
+
+# Everything that affects the picture besides the graph structure itself.
+# Changing any of these invalidates all cached images.
+RENDER_PARAMS = {'figsize': (10, 10), 'layout': 'stored', 'with_labels': True}
+
+_cascade = threading.local()
+
+
+def deleting_graph():
+    """pk of the graph whose delete cascade is running in this thread, if any."""
+    return getattr(_cascade, 'graph_id', None)
 
 
 class Graph(models.Model):
     name = models.CharField(max_length=128, unique=True)
     description = models.TextField(null=True, blank=True)
     image = models.ImageField(upload_to='graphs/', null=True, default=None)
+    render_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    # Bumped by graph.signals on every change to the graph, its vertices or
+    # its edges; conditional GETs compare against it instead of the content.
+    revision = models.PositiveBigIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Algorithm of the coordinates stored on the vertices, see graph.layout.
+    layout = models.CharField(max_length=16, blank=True, default='', editable=False)
+    # Bumped whenever graph.layout stores coordinates; layout payloads are
+    # validated by it together with the revision.
+    layout_revision = models.PositiveBigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
 
-    def create_image(self):
-        Edge = apps.get_model(app_label='graph', model_name='Edge')
-        edges = Edge.objects.filter(source__graph=self)
-        d = {}
-        for vertex in self.vertex_set.all():
-            d[vertex.VID] = [edge.target.VID for edge in vertex.outcoming_edges.all()]
-        g = nx.DiGraph()
-        g.add_nodes_from(d.keys())
-        for k, v in d.items():
-            g.add_edges_from(([(k, t) for t in v]))
-        #        pos = graphviz_layout(g, prog = 'fdp', root = 10)
-        plt.figure(figsize=(10, 10))
-        nx.draw_kamada_kawai(g, with_labels=True)
-        f = BytesIO()
-        plt.savefig(f)
-        content_file = ContentFile(f.getvalue())
-        self.image.delete()
-        self.image.save(self.name + ".png", content_file)
-        plt.figure()
+    def save(self, *args, **kwargs):
+        # The revision only moves forward through bump_revision(); never
+        # write a stale in-memory value back.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kept = ('revision', 'updated_at', 'layout', 'layout_revision')
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name not in kept]
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        # Per-row maintenance (ranks, closure) of the cascaded vertices and
+        # edges is pointless when the whole graph goes; signal handlers skip it.
+        _cascade.graph_id = self.pk
+        try:
+            return super().delete(*args, **kwargs)
+        finally:
+            _cascade.graph_id = None
+
+    @property
+    def version(self):
+        """(revision, updated_at) as read with this row; keys graph.snapshot."""
+        return self.revision, self.updated_at
+
+    def structure_hash(self):
+        snapshot = get_snapshot(self.pk, self.version)
+        h = hashlib.sha256()
+        h.update(json.dumps(sorted(RENDER_PARAMS.items())).encode())
+        for row in zip(snapshot.vids, snapshot.names):
+            h.update(json.dumps(row).encode())
+        h.update(b'|')
+        for row in sorted(snapshot.edge_vids()):
+            h.update(json.dumps(row).encode())
+        return h.hexdigest()
+
+    def image_is_fresh(self, digest=None):
+        if not self.image or not self.render_hash:
+            return False
+        if self.render_hash != (digest or self.structure_hash()):
+            return False
+        return self.image.storage.exists(self.image.name)
+
+    def create_image(self, force=False, store_layout=False):
+        with span('render-hash'):
+            digest = self.structure_hash()
+        if not force and self.image_is_fresh(digest):
+            return False
+        with span('render-graph'):
+            g = get_snapshot(self.pk, self.version).to_networkx()
+        with span('render-layout'):
+            pos = ensure_layout(self, store=store_layout)
+        # Figure/FigureCanvasAgg instead of pyplot: no global state, so renders
+        # in different threads do not draw into each other's figures.
+        with span('render-draw'):
+            fig = Figure(figsize=RENDER_PARAMS['figsize'])
+            FigureCanvasAgg(fig)
+            nx.draw(g, pos, ax=fig.add_subplot(), with_labels=RENDER_PARAMS['with_labels'])
+        with span('render-savefig'):
+            f = BytesIO()
+            fig.savefig(f, format='png')
+        with span('render-storage'):
+            content_file = ContentFile(f.getvalue())
+            self.image.delete(save=False)
+            self.image.save(self.name + ".png", content_file, save=False)
+            self.render_hash = digest
+            self.save(update_fields=['image', 'render_hash'])
+        return True
+
+    def topological_vertices(self):
+        return self.vertex_set.order_by('rank')
+
+    def layer(self, depth):
+        return self.vertex_set.filter(depth=depth).order_by('rank')
+
+    def request_image(self):
+        """Queue a background render unless the stored image is up to date.
+
+        Returns the graph's RenderJob, or None when nothing has to be drawn.
+        Repeated requests for the same graph share a single job row.
+        """
+        digest = self.structure_hash()
+        if self.image_is_fresh(digest):
+            return None
+        try:
+            job, created = RenderJob.objects.get_or_create(graph=self, defaults={'render_hash': digest})
+        except IntegrityError:
+            # get_or_create() lost the race for the graph's one job row to a
+            # concurrent request and could not see its row yet.
+            job, created = RenderJob.objects.get(graph=self), False
+        if created:
+            return job
+        if job.render_hash == digest:
+            if job.in_progress:
+                return job
+            if job.status == RenderJob.FAILED and not job.retry_due():
+                return job
+        # A new structure starts over; a retry of the same one keeps counting.
+        attempts = job.attempts if job.render_hash == digest else 0
+        RenderJob.objects.filter(pk=job.pk).update(status=RenderJob.PENDING, render_hash=digest, attempts=attempts,
+                                                   error=None, requested=timezone.now())
+        job.refresh_from_db()
+        return job
+
+
+def bump_revision(graph_id):
+    Graph.objects.filter(pk=graph_id).update(revision=F('revision') + 1, updated_at=timezone.now())
+
+
+class RenderJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    graph = models.OneToOneField(Graph, on_delete=models.CASCADE, related_name='render_job')
+    render_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    requested = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    # Failed renders of render_hash; see retry_due().
+    attempts = models.PositiveIntegerField(default=0, editable=False)
+
+    def __str__(self):
+        return '%s: %s' % (self.graph, self.status)
+
+    @property
+    def in_progress(self):
+        return self.status in (self.PENDING, self.RUNNING)
+
+    def retry_due(self):
+        """Whether a failed render may be queued again: up to
+        GRAPH_RENDER_RETRIES times, each after twice the wait of the one
+        before, starting at GRAPH_RENDER_RETRY_DELAY seconds."""
+        if self.attempts > settings.GRAPH_RENDER_RETRIES:
+            return False
+        delay = settings.GRAPH_RENDER_RETRY_DELAY * 2 ** max(self.attempts - 1, 0)
+        return self.finished is None or timezone.now() >= self.finished + timedelta(seconds=delay)
+
+    @classmethod
+    def run_next(cls):
+        """Claim and render the oldest pending job. Returns it, or None if the queue is empty."""
+        while True:
+            job = cls.objects.filter(status=cls.PENDING).order_by('requested').first()
+            if job is None:
+                return None
+            # The conditional update is the claim: only one worker gets a row count of 1.
+            claimed = cls.objects.filter(pk=job.pk, status=cls.PENDING).update(status=cls.RUNNING,
+                                                                                started=timezone.now())
+            if claimed:
+                break
+        try:
+            # The worker is where positions laid out for a picture are kept.
+            job.graph.create_image(store_layout=True)
+        except Exception:
+            # A request that arrived while rendering has put the job back to
+            # pending; leave it there so the next pass retries with fresh data.
+            cls.objects.filter(pk=job.pk, status=cls.RUNNING).update(status=cls.FAILED,
+                                                                     attempts=F('attempts') + 1,
+                                                                     error=traceback.format_exc(),
+                                                                     finished=timezone.now())
+        else:
+            cls.objects.filter(pk=job.pk, status=cls.RUNNING).update(status=cls.DONE, attempts=0,
+                                                                     finished=timezone.now())
+        job.refresh_from_db()
+        return job
 
 
 class Vertex(models.Model):
     class Meta:
         ordering = ['VID']
+        unique_together = [('graph', 'VID')]
+        indexes = [models.Index(fields=['graph', 'rank']),
+                   models.Index(fields=['graph', 'depth'])]
 
     graph = models.ForeignKey(Graph, on_delete=models.CASCADE)
     VID = models.IntegerField(null=False)
     name = models.CharField(max_length=128, null=False)
     description = models.TextField(null=True, blank=True)
+    # Position in a topological order of the graph and length of the longest
+    # path ending here. Both are maintained incrementally by graph.dag.
+    rank = models.IntegerField(default=0, editable=False)
+    depth = models.IntegerField(default=0, editable=False)
+    # Drawing position, filled in lazily by graph.layout.
+    x = models.FloatField(null=True, editable=False)
+    y = models.FloatField(null=True, editable=False)
 
     def __str__(self):
         return str(self.VID) + ', ' + str(self.name)
 
+    def save(self, *args, **kwargs):
+        # rank, depth and the position change underneath loaded instances
+        # whenever an edge elsewhere is inserted or the graph is laid out;
+        # never write stale in-memory values back.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.name not in ('rank', 'depth', 'x', 'y')]
+        super().save(*args, **kwargs)
+
+
+def vid_scope(graph_id):
+    return 'graph.vertex:%d' % graph_id
+
+
+def _max_vid(graph_id):
+    return lambda: Vertex.objects.filter(graph_id=graph_id).aggregate(m=Max('VID'))['m'] or 0
+
+
+def reserve_vids(graph_id, count=1):
+    """The next count free VIDs of the graph, as a range."""
+    return Counter.objects.reserve(vid_scope(graph_id), count, seed=_max_vid(graph_id))
+
+
+def advance_vids(graph_id, vid):
+    Counter.objects.advance(vid_scope(graph_id), vid, seed=_max_vid(graph_id))
+
 
 class Edge(models.Model):
     class Meta:
         ordering = ['source__VID', 'target__VID']
+        # The edge table of a graph pages by (source, target, pk).
+        indexes = [models.Index(fields=['source', 'target'])]
 
     source = models.ForeignKey(Vertex, on_delete=models.CASCADE, related_name='outcoming_edges')
     target = models.ForeignKey(Vertex, on_delete=models.CASCADE, related_name='incoming_edges')
     description = models.TextField(null=True, blank=True)
 
+    def save(self, *args, **kwargs):
+        # The rank maintenance in the pre/post_save handlers must commit or
+        # roll back together with the edge itself.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class VertexClosure(models.Model):
+    """One row per pair of vertices connected by a path (transitive closure).
+
+    distance is the number of edges on the shortest such path. Maintained
+    incrementally by graph.reachability.
+    """
+
+    class Meta:
+        unique_together = [('ancestor', 'descendant')]
+        indexes = [models.Index(fields=['descendant', 'distance'])]
+
+    ancestor = models.ForeignKey(Vertex, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Vertex, on_delete=models.CASCADE, related_name='ancestor_links')
+    distance = models.IntegerField()
+
 
 class AddEdgeForm(ModelForm):
     class Meta:
@@ -71,12 +313,29 @@ class AddEdgeForm(ModelForm):
         self.fields['source'].queryset = Vertex.objects.filter(graph__pk=pk)
         self.fields['target'].queryset = Vertex.objects.filter(graph__pk=pk)
 
+    def clean(self):
+        from graph.dag import find_cycle
+        cleaned_data = super().clean()
+        source, target = cleaned_data.get('source'), cleaned_data.get('target')
+        if source is not None and target is not None:
+            cycle = find_cycle(source, target)
+            if cycle:
+                raise ValidationError('This edge would close a cycle: ' + ' -> '.join(str(vid) for vid in cycle))
+        return cleaned_data
+
 
-class AddEdgeVertexForm(ModelForm):
+class VertexForm(ModelForm):
     class Meta:
         model = Vertex
         fields = ['graph', 'VID', 'name', 'description']
+        help_texts = {'VID': 'Leave empty to take the next free VID.'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['VID'].required = False
 
+
+class AddEdgeVertexForm(VertexForm):
     edge_description = CharField(label='Edge description', widget=Textarea, required=False)
 
 
@@ -93,4 +352,11 @@ class GraphFromJSONForm(Form):
 
 
 class TopSortForm(Form):
-    new_name = CharField(label='New name for sorted graph')
+    new_name = CharField(label='New name for sorted graph', required=False)
+    in_place = BooleanField(label='Renumber this graph instead of copying it', required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('in_place') and not cleaned_data.get('new_name'):
+            raise ValidationError('Enter a name for the sorted copy or choose to renumber in place.')
+        return cleaned_data
@@ -0,0 +1,105 @@
+"""Ego graphs: the vertices within a few hops of one vertex, following
+edges in either direction, and the edges among them.
+
+The breadth-first search runs over the cached snapshot and stops at
+max_nodes vertices, nearest first, so its cost depends on the size of
+the neighbourhood only. The result is laid out on its own and kept per
+(vertex, hops, max_nodes, revision) of the snapshot it was built from: a
+newer revision of the graph is a new key, and old entries age out of the
+LRU. The time of the revision is
+part of the key too, so a pk and revision that come back after a rollback
+do not find an entry of the rolled-back graph.
+"""
+import threading
+from array import array
+from collections import OrderedDict
+from itertools import chain
+
+from django.conf import settings
+
+from graph.layout import layers, choose_algorithm, full_layout
+from graph.snapshot import GraphSnapshot, get_snapshot
+
+DEFAULT_HOPS = 2
+MAX_HOPS = 10
+DEFAULT_MAX_NODES = 100
+MAX_NODES = 1000
+
+
+class Neighbourhood:
+    """snapshot: the induced subgraph in VID order; pos: its layout;
+    distance: hops from the centre per vertex; truncated: whether
+    max_nodes cut the search short."""
+    __slots__ = ('vertex_id', 'snapshot', 'pos', 'distance', 'truncated')
+
+    def __init__(self, vertex_id, snapshot, pos, distance, truncated):
+        self.vertex_id = vertex_id
+        self.snapshot = snapshot
+        self.pos = pos
+        self.distance = distance
+        self.truncated = truncated
+
+    @classmethod
+    def build(cls, graph, vertex_id, hops, max_nodes):
+        start = graph.index[vertex_id]
+        distance = {start: 0}
+        frontier = [start]
+        truncated = False
+        for hop in range(1, hops + 1):
+            reached = []
+            for i in frontier:
+                for j in chain(graph.successors(i), graph.predecessors(i)):
+                    if j in distance:
+                        continue
+                    if len(distance) >= max_nodes:
+                        truncated = True
+                        break
+                    distance[j] = hop
+                    reached.append(j)
+                if truncated:
+                    break
+            frontier = reached
+            if truncated or not frontier:
+                break
+        selected = sorted(distance)
+        local = {i: k for k, i in enumerate(selected)}
+        sources, targets = array('l'), array('l')
+        for i in selected:
+            for j in graph.successors(i):
+                if j in local:
+                    sources.append(local[i])
+                    targets.append(local[j])
+        snapshot = GraphSnapshot(graph.graph_id, array('q', (graph.pks[i] for i in selected)),
+                                 array('q', (graph.vids[i] for i in selected)),
+                                 [graph.names[i] for i in selected], sources, targets, graph.version)
+        layer = layers(snapshot)
+        pos = full_layout(snapshot, choose_algorithm(snapshot, layer), layer)
+        return cls(vertex_id, snapshot, pos, [distance[i] for i in selected], truncated)
+
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # (vertex_id, hops, max_nodes, revision, updated_at) -> Neighbourhood
+
+
+def get_neighbourhood(graph_id, version, vertex_id, hops=DEFAULT_HOPS, max_nodes=DEFAULT_MAX_NODES):
+    """The neighbourhood of the vertex in the graph at version, its
+    (revision, updated_at), or None if the vertex is not in the graph.
+
+    It is built from, and kept under the version of, the snapshot it came
+    from, which may be newer than the one asked for, never older; the
+    caller reads the version from found.snapshot.version.
+    """
+    key = (vertex_id, hops, max_nodes) + tuple(version)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    snapshot = get_snapshot(graph_id, tuple(version))
+    if vertex_id not in snapshot.index:
+        return None
+    value = Neighbourhood.build(snapshot, vertex_id, hops, max_nodes)
+    with _lock:
+        _cache[(vertex_id, hops, max_nodes) + snapshot.version] = value
+        while len(_cache) > settings.GRAPH_NEIGHBOURHOOD_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return value
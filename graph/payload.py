@@ -0,0 +1,77 @@
+"""Vertex positions of a graph, or of a part of it, for drawing in the
+browser.
+
+Both formats carry the same arrays in snapshot (VID) order: vertex pks,
+VIDs, labels, x and y, and the edges as indices into those arrays.
+
+JSON: {"ids", "vids", "labels", "x", "y", "edges"} and the fields of the
+view, e.g. "graph" and "revision"; edges is flat, [source0, target0,
+source1, target1, ...].
+
+Binary, little-endian, every section aligned to 4 bytes so that the
+client can view it with typed arrays without copying:
+
+    header         6 x uint32: MAGIC, VERSION, vertex count n,
+                   edge count m, label bytes, revision (low 32 bits)
+    ids            n x uint32
+    vids           n x int32
+    x, y           n x float32 each
+    sources        m x uint32
+    targets        m x uint32
+    label offsets  (n + 1) x uint32 into the label bytes
+    labels         UTF-8, padded with zeros to a multiple of 4
+"""
+import json
+import struct
+
+import numpy as np
+
+from graph.layout import layout_positions
+
+MAGIC = 0x594c4b53  # b'SKLY' read as a little-endian uint32
+VERSION = 1
+# Decimals of the JSON coordinates; the binary format has float32.
+PRECISION = 3
+
+
+def to_json(snapshot, pos, **fields):
+    """The JSON payload of the snapshot's vertices at pos, with fields added."""
+    pos = np.round(pos, PRECISION)
+    edges = np.empty(2 * snapshot.edge_count, dtype=np.int64)
+    edges[0::2] = snapshot.sources
+    edges[1::2] = snapshot.targets
+    fields.update({'ids': list(snapshot.pks),
+                   'vids': list(snapshot.vids),
+                   'labels': snapshot.names,
+                   'x': pos[:, 0].tolist(),
+                   'y': pos[:, 1].tolist(),
+                   'edges': edges.tolist()})
+    return json.dumps(fields, ensure_ascii=False).encode()
+
+
+def to_binary(snapshot, pos, revision):
+    labels = [name.encode() for name in snapshot.names]
+    offsets = np.zeros(len(labels) + 1, dtype='<u4')
+    offsets[1:] = np.cumsum([len(label) for label in labels])
+    text = b''.join(labels)
+    return b''.join([
+        struct.pack('<6I', MAGIC, VERSION, len(snapshot), snapshot.edge_count, len(text), revision & 0xffffffff),
+        np.asarray(snapshot.pks, dtype='<u4').tobytes(),
+        np.asarray(snapshot.vids, dtype='<i4').tobytes(),
+        pos[:, 0].astype('<f4').tobytes(),
+        pos[:, 1].astype('<f4').tobytes(),
+        np.asarray(snapshot.sources, dtype='<u4').tobytes(),
+        np.asarray(snapshot.targets, dtype='<u4').tobytes(),
+        offsets.tobytes(),
+        text, b'\0' * (-len(text) % 4),
+    ])
+
+
+def layout_json(graph):
+    snapshot, algorithm, pos = layout_positions(graph)
+    return to_json(snapshot, pos, graph=graph.pk, revision=graph.revision, layout=algorithm)
+
+
+def layout_binary(graph):
+    snapshot, _, pos = layout_positions(graph)
+    return to_binary(snapshot, pos, graph.revision)
@@ -0,0 +1,233 @@
+"""Transitive closure of every graph, kept in VertexClosure.
+
+Ancestor/descendant lookups are a single indexed query. Inserting u -> v
+adds the pairs (ancestors of u) x (descendants of v); deleting it
+recomputes only the pairs between those two sets, from their edges and
+the closure rows of the vertices just outside them. Deleting a vertex
+recomputes once for the vertex, not again for each edge it takes along.
+"""
+import threading
+from collections import deque
+
+from django.db import transaction
+from django.db.models import Q
+
+from graph.models import Vertex, VertexClosure
+from graph.snapshot import GraphSnapshot, get_snapshot
+
+CHUNK = 500
+BATCH = 5000
+
+# Regions of the vertices whose delete is running in this thread, by pk.
+_pending = threading.local()
+
+
+def _pending_regions():
+    if not hasattr(_pending, 'regions'):
+        _pending.regions = {}
+    return _pending.regions
+
+
+def _chunks(items):
+    items = list(items)
+    for i in range(0, len(items), CHUNK):
+        yield items[i:i + CHUNK]
+
+
+def ancestors(vertex_id):
+    """Vertices with a path to vertex_id as (Vertex, distance), in topological order."""
+    rows = VertexClosure.objects.filter(descendant_id=vertex_id).select_related('ancestor') \
+        .order_by('ancestor__rank')
+    return [(row.ancestor, row.distance) for row in rows]
+
+
+def descendants(vertex_id):
+    """Vertices reachable from vertex_id as (Vertex, distance), in topological order."""
+    rows = VertexClosure.objects.filter(ancestor_id=vertex_id).select_related('descendant') \
+        .order_by('descendant__rank')
+    return [(row.descendant, row.distance) for row in rows]
+
+
+def reaches(source_id, target_id):
+    return VertexClosure.objects.filter(ancestor_id=source_id, descendant_id=target_id).exists()
+
+
+def _upward(vertex_id):
+    up = dict(VertexClosure.objects.filter(descendant_id=vertex_id).values_list('ancestor_id', 'distance'))
+    up[vertex_id] = 0
+    return up
+
+
+def _downward(vertex_id):
+    down = dict(VertexClosure.objects.filter(ancestor_id=vertex_id).values_list('descendant_id', 'distance'))
+    down[vertex_id] = 0
+    return down
+
+
+def _below(vertex_id):
+    return Q(descendant_id=vertex_id) | Q(descendant__in=VertexClosure.objects.filter(ancestor_id=vertex_id)
+                                         .values('descendant_id'))
+
+
+def edge_inserted(edge):
+    up, down = _upward(edge.source_id), _downward(edge.target_id)
+    existing = {}
+    for chunk in _chunks(up):
+        for row in VertexClosure.objects.filter(_below(edge.target_id), ancestor_id__in=chunk):
+            existing[row.ancestor_id, row.descendant_id] = row
+    created, shortened = [], []
+    for a, da in up.items():
+        for d, dd in down.items():
+            distance = da + 1 + dd
+            row = existing.get((a, d))
+            if row is None:
+                created.append(VertexClosure(ancestor_id=a, descendant_id=d, distance=distance))
+            elif distance < row.distance:
+                row.distance = distance
+                shortened.append(row)
+    VertexClosure.objects.bulk_create(created, batch_size=BATCH)
+    VertexClosure.objects.bulk_update(shortened, ['distance'], batch_size=BATCH)
+
+
+def _distances(snapshot, start, forward=True):
+    step = snapshot.successors if forward else snapshot.predecessors
+    distance = {start: 0}
+    queue = deque([start])
+    while queue:
+        i = queue.popleft()
+        for j in step(i):
+            if j not in distance:
+                distance[j] = distance[i] + 1
+                queue.append(j)
+    return distance
+
+
+def _region_order(snapshot, region):
+    """Positions of region in a topological order of the subgraph they
+    induce; vertices on a cycle come last."""
+    indegree = dict.fromkeys(region, 0)
+    for i in region:
+        for j in snapshot.successors(i):
+            if j in indegree:
+                indegree[j] += 1
+    order = [i for i, n in indegree.items() if n == 0]
+    for i in order:
+        for j in snapshot.successors(i):
+            if j in indegree:
+                indegree[j] -= 1
+                if indegree[j] == 0:
+                    order.append(j)
+    if len(order) < len(region):
+        placed = set(order)
+        order += [i for i in region if i not in placed]
+    return order
+
+
+def _recompute(graph_id, up, down):
+    """Rewrite the closure rows between the ancestor set up and the descendant set down.
+
+    Paths that start outside up never passed through what was removed, so
+    the closure rows of those vertices still hold. The new distances from
+    up follow from its successors', nearest to the removed part first;
+    only older data with cycles inside up needs more than one pass.
+    """
+    snapshot = get_snapshot(graph_id)
+    index, pks = snapshot.index, snapshot.pks
+    inside = {index[a] for a in up if a in index}
+    down = {d for d in down if d in index}
+    # reach[i]: {descendant in down: distance} of position i, itself at 0.
+    reach = {i: {} for i in inside}
+    exits = {j for i in inside for j in snapshot.successors(i) if j not in inside}
+    for j in exits:
+        reach[j] = {pks[j]: 0} if pks[j] in down else {}
+    for exit_chunk in _chunks(pks[j] for j in exits):
+        for down_chunk in _chunks(down):
+            rows = VertexClosure.objects.filter(ancestor_id__in=exit_chunk, descendant_id__in=down_chunk)
+            for a, d, distance in rows.values_list('ancestor_id', 'descendant_id', 'distance'):
+                reach[index[a]][d] = distance
+    for i in inside:
+        if pks[i] in down:
+            reach[i][pks[i]] = 0
+    order = _region_order(snapshot, inside)[::-1]
+    changed = True
+    while changed:
+        changed, cyclic, done = False, False, set()
+        for i in order:
+            mine = reach[i]
+            for j in snapshot.successors(i):
+                cyclic |= j in inside and j not in done
+                for d, distance in reach[j].items():
+                    if distance + 1 < mine.get(d, distance + 2):
+                        mine[d] = distance + 1
+                        changed = True
+            done.add(i)
+        changed &= cyclic
+    rows = [VertexClosure(ancestor_id=pks[i], descendant_id=d, distance=distance)
+            for i in order for d, distance in reach[i].items() if d != pks[i]]
+    with transaction.atomic():
+        for up_chunk in _chunks(up):
+            for down_chunk in _chunks(down):
+                VertexClosure.objects.filter(ancestor_id__in=up_chunk, descendant_id__in=down_chunk).delete()
+        VertexClosure.objects.bulk_create(rows, batch_size=BATCH)
+
+
+def edge_deleted(edge, graph_id):
+    # Called after the row is gone, while VertexClosure still describes the
+    # graph with the edge: that gives exactly the affected pairs. An edge
+    # cascaded from a vertex delete is covered by the vertex's recompute.
+    pending = _pending_regions()
+    if edge.source_id in pending or edge.target_id in pending:
+        return
+    _recompute(graph_id, _upward(edge.source_id), _downward(edge.target_id))
+
+
+def vertex_deleting(vertex):
+    """Remember which pairs may pass through vertex before the cascade drops its closure rows."""
+    _pending_regions()[vertex.pk] = (_upward(vertex.pk), _downward(vertex.pk))
+
+
+def vertex_deleted(vertex):
+    up, down = _pending_regions().pop(vertex.pk)
+    up.pop(vertex.pk)
+    down.pop(vertex.pk)
+    if up and down:
+        _recompute(vertex.graph_id, up, down)
+
+
+def closure_rows(snapshot):
+    """(ancestor position, descendant position, distance) for every connected pair."""
+    order = snapshot.topological_order(strict=False)
+    position = {i: n for n, i in enumerate(order)}
+    if all(position[s] < position[t] for s, t in zip(snapshot.sources, snapshot.targets)):
+        # Acyclic: merge successors' descendant maps in reverse topological order.
+        below = {}
+        for i in reversed(order):
+            mine = {}
+            for j in snapshot.successors(i):
+                mine[j] = 1
+            for j in snapshot.successors(i):
+                for k, d in below[j].items():
+                    if d + 1 < mine.get(k, d + 2):
+                        mine[k] = d + 1
+            below[i] = mine
+            for k, d in mine.items():
+                yield i, k, d
+    else:
+        for i in range(len(snapshot)):
+            for k, d in _distances(snapshot, i).items():
+                if k != i:
+                    yield i, k, d
+
+
+def rebuild_closure(graph_id):
+    snapshot = GraphSnapshot.load(graph_id)
+    pks = snapshot.pks
+    with transaction.atomic():
+        VertexClosure.objects.filter(ancestor__graph_id=graph_id).delete()
+        batch = []
+        for i, k, d in closure_rows(snapshot):
+            batch.append(VertexClosure(ancestor_id=pks[i], descendant_id=pks[k], distance=d))
+            if len(batch) >= BATCH:
+                VertexClosure.objects.bulk_create(batch)
+                batch = []
+        VertexClosure.objects.bulk_create(batch)
@@ -0,0 +1,107 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver, Signal
+
+from graph import dag, reachability, snapshot
+from allocator.models import Counter
+from graph.models import Graph, Vertex, Edge, deleting_graph, vid_scope, reserve_vids, advance_vids, bump_revision
+
+# Sent with graph_id after a bulk operation (bulk_create, queryset update)
+# changed a graph's vertices or edges without per-row model signals.
+graph_rebuilt = Signal()
+
+
+def edge_graph_id(edge):
+    if Edge.source.is_cached(edge):
+        return edge.source.graph_id
+    return Vertex.objects.filter(pk=edge.source_id).values_list('graph_id', flat=True).first()
+
+
+@receiver(post_delete, sender=Graph)
+def graph_deleted(sender, instance, **kwargs):
+    snapshot.invalidate(instance.pk)
+    Counter.objects.discard(vid_scope(instance.pk))
+    Counter.objects.discard(dag.rank_scope(instance.pk))
+
+
+@receiver(pre_save, sender=Vertex)
+def set_vertex_vid(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if instance.VID is None:
+        instance.VID = reserve_vids(instance.graph_id)[0]
+    else:
+        advance_vids(instance.graph_id, instance.VID)
+
+
+@receiver(pre_save, sender=Vertex)
+def set_vertex_rank(sender, instance, raw=False, **kwargs):
+    if instance.pk is None and not raw:
+        instance.rank = dag.next_rank(instance.graph_id)
+
+
+@receiver(post_save, sender=Graph)
+def graph_saved(sender, instance, created, update_fields=None, **kwargs):
+    # A new image alone leaves the revision; views look at render_hash.
+    if not created and (update_fields is None or set(update_fields) - {'image', 'render_hash'}):
+        bump_revision(instance.pk)
+
+
+@receiver(post_save, sender=Vertex)
+@receiver(post_delete, sender=Vertex)
+def vertex_changed(sender, instance, **kwargs):
+    if deleting_graph() is None:
+        snapshot.invalidate(instance.graph_id)
+        bump_revision(instance.graph_id)
+
+
+@receiver(pre_delete, sender=Vertex)
+def vertex_deleting(sender, instance, **kwargs):
+    if deleting_graph() is None:
+        reachability.vertex_deleting(instance)
+
+
+@receiver(post_delete, sender=Vertex)
+def vertex_deleted(sender, instance, **kwargs):
+    if deleting_graph() is None:
+        reachability.vertex_deleted(instance)
+
+
+@receiver(post_save, sender=Edge)
+@receiver(post_delete, sender=Edge)
+def edge_changed(sender, instance, **kwargs):
+    if deleting_graph() is None:
+        graph_id = edge_graph_id(instance)
+        snapshot.invalidate(graph_id)
+        bump_revision(graph_id)
+
+
+@receiver(pre_save, sender=Edge)
+def order_edge_endpoints(sender, instance, raw=False, **kwargs):
+    if instance.pk is None and not raw:
+        dag.before_edge_insert(instance)
+
+
+@receiver(post_save, sender=Edge)
+def edge_inserted(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        dag.after_edge_insert(instance)
+        reachability.edge_inserted(instance)
+
+
+@receiver(post_delete, sender=Edge)
+def edge_deleted(sender, instance, **kwargs):
+    if deleting_graph() is not None:
+        return
+    graph_id = edge_graph_id(instance)
+    if graph_id is None:
+        return
+    dag.after_edge_delete(instance)
+    reachability.edge_deleted(instance, graph_id)
+
+
+@receiver(graph_rebuilt)
+def graph_bulk_changed(sender, graph_id, **kwargs):
+    snapshot.invalidate(graph_id)
+    bump_revision(graph_id)
+    dag.rebuild_order(graph_id)
+    reachability.rebuild_closure(graph_id)
@@ -0,0 +1,242 @@
+import copy
+import heapq
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+
+import networkx as nx
+from django.conf import settings
+
+
+class GraphCycleError(ValueError):
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super().__init__("Graph contains a cycle: " + " -> ".join(str(vid) for vid in cycle))
+
+
+class GraphSnapshot:
+    """Immutable structure of one graph held in flat integer arrays.
+
+    Vertices are addressed by their position in VID order, edges are two
+    parallel arrays of vertex positions. Built from two queries, shared
+    between requests through the per-process cache below.
+    """
+
+    def __init__(self, graph_id, pks, vids, names, sources, targets, version=None):
+        self.graph_id = graph_id
+        self.version = version
+        self.pks = pks
+        self.vids = vids
+        self.names = names
+        self.sources = sources
+        self.targets = targets
+        self.index = {pk: i for i, pk in enumerate(pks)}
+        self._out = None
+        self._in = None
+
+    @classmethod
+    def load(cls, graph_id):
+        from graph.models import Vertex, Edge
+        # Read before the rows: the structure is then at least this version.
+        version = graph_version(graph_id)
+        pks, vids, names = array('q'), array('q'), []
+        for pk, vid, name in Vertex.objects.filter(graph_id=graph_id).order_by('VID', 'pk') \
+                .values_list('pk', 'VID', 'name'):
+            pks.append(pk)
+            vids.append(vid)
+            names.append(name)
+        index = {pk: i for i, pk in enumerate(pks)}
+        sources, targets = array('l'), array('l')
+        for source_id, target_id in Edge.objects.filter(source__graph_id=graph_id).order_by('pk') \
+                .values_list('source_id', 'target_id'):
+            # Edges committed after the vertices were read may reach past them.
+            if source_id in index and target_id in index:
+                sources.append(index[source_id])
+                targets.append(index[target_id])
+        return cls(graph_id, pks, vids, names, sources, targets, version)
+
+    def __len__(self):
+        return len(self.pks)
+
+    @property
+    def edge_count(self):
+        return len(self.sources)
+
+    @property
+    def nbytes(self):
+        size = sum(a.itemsize * len(a) for a in (self.pks, self.vids, self.sources, self.targets))
+        size += sys.getsizeof(self.names) + sum(sys.getsizeof(n) for n in self.names)
+        size += sys.getsizeof(self.index)
+        for csr in (self._out, self._in):
+            if csr is not None:
+                size += sum(a.itemsize * len(a) for a in csr)
+        return size
+
+    def _csr(self, keys, values):
+        offsets = array('l', [0]) * (len(self.pks) + 1)
+        for k in keys:
+            offsets[k + 1] += 1
+        for i in range(len(self.pks)):
+            offsets[i + 1] += offsets[i]
+        fill = array('l', offsets)
+        packed = array('l', [0]) * len(keys)
+        for k, v in zip(keys, values):
+            packed[fill[k]] = v
+            fill[k] += 1
+        return offsets, packed
+
+    def successors(self, i):
+        if self._out is None:
+            self._out = self._csr(self.sources, self.targets)
+        offsets, packed = self._out
+        return packed[offsets[i]:offsets[i + 1]]
+
+    def predecessors(self, i):
+        if self._in is None:
+            self._in = self._csr(self.targets, self.sources)
+        offsets, packed = self._in
+        return packed[offsets[i]:offsets[i + 1]]
+
+    def in_degrees(self):
+        degrees = array('l', [0]) * len(self.pks)
+        for t in self.targets:
+            degrees[t] += 1
+        return degrees
+
+    def max_vid(self):
+        return self.vids[-1] if self.vids else 0
+
+    def vid_by_pk(self):
+        return dict(zip(self.pks, self.vids))
+
+    def edge_vids(self):
+        vids = self.vids
+        return [(vids[s], vids[t]) for s, t in zip(self.sources, self.targets)]
+
+    def adjacency(self):
+        d = {vid: [] for vid in self.vids}
+        for s, t in self.edge_vids():
+            d[s].append(t)
+        return d
+
+    def topological_order(self, strict=True):
+        """Vertex positions in topological order (Kahn's algorithm).
+
+        Ties are broken by VID, so an already sorted graph keeps its order.
+        If there is no such order, raises GraphCycleError naming one cycle,
+        or with strict=False appends the vertices left on cycles in VID order.
+        """
+        degrees = self.in_degrees()
+        # A heap of positions, which are in VID order: always the lowest
+        # VID that is ready, O((V + E) log V).
+        ready = [i for i, degree in enumerate(degrees) if degree == 0]
+        order = []
+        while ready:
+            i = heapq.heappop(ready)
+            order.append(i)
+            for j in self.successors(i):
+                degrees[j] -= 1
+                if degrees[j] == 0:
+                    heapq.heappush(ready, j)
+        if len(order) < len(self.pks):
+            if strict:
+                raise GraphCycleError(self._find_cycle(degrees))
+            order.extend(i for i, degree in enumerate(degrees) if degree > 0)
+        return order
+
+    def _find_cycle(self, degrees):
+        # Every vertex left with a positive in-degree has a predecessor that
+        # is left too, so walking predecessors must eventually repeat.
+        i = next(i for i, degree in enumerate(degrees) if degree > 0)
+        seen = {}
+        path = []
+        while i not in seen:
+            seen[i] = len(path)
+            path.append(i)
+            i = next(p for p in self.predecessors(i) if degrees[p] > 0)
+        cycle = path[seen[i]:]
+        cycle.reverse()
+        return [self.vids[j] for j in cycle + cycle[:1]]
+
+    def to_networkx(self):
+        g = nx.DiGraph()
+        g.add_nodes_from(self.vids)
+        g.add_edges_from(self.edge_vids())
+        return g
+
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # graph_id -> (snapshot, size at insertion)
+_cache_bytes = 0
+
+
+def graph_version(graph_id):
+    """(revision, updated_at) of the graph as committed, or None if it is gone."""
+    from graph.models import Graph
+    return Graph.objects.filter(pk=graph_id).values_list('revision', 'updated_at').first()
+
+
+def get_snapshot(graph_id, version=None):
+    """The snapshot of the graph at version, its (revision, updated_at).
+
+    Pass the version read together with the graph row where there is one;
+    without it the version costs a query. Entries are keyed by version, so
+    a change committed by another process is picked up here on its next
+    revision, and a state loaded before a commit, or inside a transaction
+    that rolled back, is never served for a different version: updated_at
+    makes the pair unique even when a revision number is reused.
+    """
+    global _cache_bytes
+    if version is None:
+        version = graph_version(graph_id)
+    with _lock:
+        entry = _cache.get(graph_id)
+        if entry is not None and entry[0].version == version:
+            _cache.move_to_end(graph_id)
+            return entry[0]
+    snapshot = GraphSnapshot.load(graph_id)
+    size = snapshot.nbytes
+    budget = settings.GRAPH_SNAPSHOT_CACHE_BYTES
+    with _lock:
+        entry = _cache.get(graph_id)
+        # A slower load of an older state must not replace a newer one.
+        if size > budget or snapshot.version is None or \
+                (entry is not None and entry[0].version[0] > snapshot.version[0]):
+            return snapshot
+        if entry is not None:
+            del _cache[graph_id]
+            _cache_bytes -= entry[1]
+        _cache[graph_id] = (snapshot, size)
+        _cache_bytes += size
+        while _cache_bytes > budget:
+            _, (_, evicted_size) = _cache.popitem(last=False)
+            _cache_bytes -= evicted_size
+    return snapshot
+
+
+def advance(graph_id, old_version, new_version):
+    """Keep the cached snapshot of old_version for new_version, after a
+    revision bump that is known not to have touched the structure."""
+    with _lock:
+        entry = _cache.get(graph_id)
+        if entry is not None and entry[0].version == old_version:
+            snapshot = copy.copy(entry[0])
+            snapshot.version = new_version
+            _cache[graph_id] = (snapshot, entry[1])
+
+
+def invalidate(graph_id=None):
+    """Drop the cached snapshot of one graph, or of every graph when graph_id is None.
+
+    Only frees memory early: a changed graph has a new version anyway.
+    """
+    global _cache_bytes
+    with _lock:
+        if graph_id is None:
+            _cache.clear()
+            _cache_bytes = 0
+            return
+        entry = _cache.pop(graph_id, None)
+        if entry is not None:
+            _cache_bytes -= entry[1]
@@ -0,0 +1,301 @@
+/* Draws a graph on a canvas from its binary layout payload (see
+ * graph/payload.py), with pan (drag), zoom (wheel, double click fits)
+ * and level-of-detail culling: only what is on screen is drawn, labels
+ * only once they fit, and every k-th edge while too many are visible.
+ * The vertex with the pk in data-highlight, if any, stands out.
+ */
+(function () {
+    'use strict';
+
+    var MAGIC = 0x594c4b53, VERSION = 1, HEADER_BYTES = 24;
+    // Labels show once vertices are this many pixels apart and at most
+    // LABEL_LIMIT of them are on screen.
+    var LABEL_SPACING = 40, LABEL_LIMIT = 300;
+    var ARROW_SPACING = 60;
+    var EDGE_LIMIT = 20000;
+    var HIT_PIXELS = 6;
+
+    function parse(buffer) {
+        // Typed arrays use the platform's byte order, little-endian on
+        // everything that runs a browser today.
+        var header = new Uint32Array(buffer, 0, 6);
+        if (header[0] !== MAGIC || header[1] !== VERSION) {
+            throw new Error('Unknown layout format');
+        }
+        var n = header[2], m = header[3], offset = HEADER_BYTES;
+        function take(Type, count) {
+            var array = new Type(buffer, offset, count);
+            offset += 4 * count;
+            return array;
+        }
+        var g = {n: n, m: m, revision: header[5]};
+        g.ids = take(Uint32Array, n);
+        g.vids = take(Int32Array, n);
+        g.x = take(Float32Array, n);
+        g.y = take(Float32Array, n);
+        g.sources = take(Uint32Array, m);
+        g.targets = take(Uint32Array, m);
+        g.labelOffsets = take(Uint32Array, n + 1);
+        g.text = new Uint8Array(buffer, offset, header[4]);
+        g.labels = new Array(n);
+        return g;
+    }
+
+    function GraphCanvas(container, g) {
+        this.container = container;
+        this.canvas = container.querySelector('canvas');
+        this.status = container.querySelector('.graph-canvas-status');
+        this.context = this.canvas.getContext('2d');
+        this.g = g;
+        this.vertexUrl = container.getAttribute('data-vertex-url');
+        this.decoder = new TextDecoder();
+        this.visible = new Uint32Array(g.n);
+        this.visibleCount = 0;
+        this.edges = new Uint32Array(g.m);
+        this.hover = -1;
+        this.highlight = Array.prototype.indexOf.call(g.ids, +container.getAttribute('data-highlight'));
+        this.pending = false;
+        this.resize();
+        this.fit();
+        this.listen();
+    }
+
+    GraphCanvas.prototype.label = function (i) {
+        var g = this.g;
+        if (g.labels[i] === undefined) {
+            g.labels[i] = this.decoder.decode(g.text.subarray(g.labelOffsets[i], g.labelOffsets[i + 1]));
+        }
+        return g.labels[i];
+    };
+
+    GraphCanvas.prototype.resize = function () {
+        var ratio = window.devicePixelRatio || 1;
+        this.width = this.container.clientWidth;
+        this.height = this.canvas.clientHeight;
+        this.canvas.width = Math.round(this.width * ratio);
+        this.canvas.height = Math.round(this.height * ratio);
+        this.context.setTransform(ratio, 0, 0, ratio, 0, 0);
+    };
+
+    GraphCanvas.prototype.fit = function () {
+        var g = this.g, minX = Infinity, maxX = -Infinity, minY = Infinity, maxY = -Infinity;
+        for (var i = 0; i < g.n; i++) {
+            if (g.x[i] < minX) minX = g.x[i];
+            if (g.x[i] > maxX) maxX = g.x[i];
+            if (g.y[i] < minY) minY = g.y[i];
+            if (g.y[i] > maxY) maxY = g.y[i];
+        }
+        if (!g.n) {
+            minX = maxX = minY = maxY = 0;
+        }
+        this.cx = (minX + maxX) / 2;
+        this.cy = (minY + maxY) / 2;
+        // A unit of margin around the drawing.
+        this.scale = Math.min(this.width / (maxX - minX + 2), this.height / (maxY - minY + 2));
+        this.redraw();
+    };
+
+    GraphCanvas.prototype.screenX = function (x) {
+        return (x - this.cx) * this.scale + this.width / 2;
+    };
+
+    GraphCanvas.prototype.screenY = function (y) {
+        // Layers grow downwards: larger y is higher up.
+        return (this.cy - y) * this.scale + this.height / 2;
+    };
+
+    GraphCanvas.prototype.redraw = function () {
+        var self = this;
+        if (!this.pending) {
+            this.pending = true;
+            window.requestAnimationFrame(function () {
+                self.pending = false;
+                self.draw();
+            });
+        }
+    };
+
+    GraphCanvas.prototype.draw = function () {
+        var g = this.g, ctx = this.context, scale = this.scale, i, e, s, t;
+        var halfW = this.width / 2 / scale, halfH = this.height / 2 / scale;
+        var x0 = this.cx - halfW, x1 = this.cx + halfW, y0 = this.cy - halfH, y1 = this.cy + halfH;
+        var radius = Math.max(1, Math.min(6, scale * 0.15));
+        ctx.clearRect(0, 0, this.width, this.height);
+
+        // Edges with both ends on the same side outside the view are culled.
+        var edgeCount = 0;
+        for (e = 0; e < g.m; e++) {
+            s = g.sources[e];
+            t = g.targets[e];
+            if ((g.x[s] < x0 && g.x[t] < x0) || (g.x[s] > x1 && g.x[t] > x1) ||
+                (g.y[s] < y0 && g.y[t] < y0) || (g.y[s] > y1 && g.y[t] > y1)) {
+                continue;
+            }
+            this.edges[edgeCount++] = e;
+        }
+        var stride = Math.max(1, Math.ceil(edgeCount / EDGE_LIMIT));
+        var arrows = scale >= ARROW_SPACING;
+        ctx.strokeStyle = stride > 1 ? 'rgba(90, 90, 90, 0.35)' : 'rgba(90, 90, 90, 0.7)';
+        ctx.lineWidth = 1;
+        ctx.beginPath();
+        for (i = 0; i < edgeCount; i += stride) {
+            e = this.edges[i];
+            var sx = this.screenX(g.x[g.sources[e]]), sy = this.screenY(g.y[g.sources[e]]);
+            var tx = this.screenX(g.x[g.targets[e]]), ty = this.screenY(g.y[g.targets[e]]);
+            ctx.moveTo(sx, sy);
+            ctx.lineTo(tx, ty);
+            if (arrows) {
+                var angle = Math.atan2(ty - sy, tx - sx);
+                var ax = tx - radius * Math.cos(angle), ay = ty - radius * Math.sin(angle);
+                ctx.moveTo(ax - 8 * Math.cos(angle - 0.4), ay - 8 * Math.sin(angle - 0.4));
+                ctx.lineTo(ax, ay);
+                ctx.lineTo(ax - 8 * Math.cos(angle + 0.4), ay - 8 * Math.sin(angle + 0.4));
+            }
+        }
+        ctx.stroke();
+
+        this.visibleCount = 0;
+        for (i = 0; i < g.n; i++) {
+            if (g.x[i] >= x0 && g.x[i] <= x1 && g.y[i] >= y0 && g.y[i] <= y1) {
+                this.visible[this.visibleCount++] = i;
+            }
+        }
+        ctx.fillStyle = '#1f77b4';
+        if (radius < 2) {
+            for (i = 0; i < this.visibleCount; i++) {
+                var v = this.visible[i];
+                ctx.fillRect(this.screenX(g.x[v]) - radius, this.screenY(g.y[v]) - radius, 2 * radius, 2 * radius);
+            }
+        } else {
+            ctx.beginPath();
+            for (i = 0; i < this.visibleCount; i++) {
+                var vx = this.screenX(g.x[this.visible[i]]), vy = this.screenY(g.y[this.visible[i]]);
+                ctx.moveTo(vx + radius, vy);
+                ctx.arc(vx, vy, radius, 0, 2 * Math.PI);
+            }
+            ctx.fill();
+        }
+
+        if (scale >= LABEL_SPACING && this.visibleCount <= LABEL_LIMIT) {
+            ctx.fillStyle = '#212529';
+            ctx.font = '12px sans-serif';
+            ctx.textBaseline = 'middle';
+            for (i = 0; i < this.visibleCount; i++) {
+                var l = this.visible[i];
+                ctx.fillText(this.label(l), this.screenX(g.x[l]) + radius + 3, this.screenY(g.y[l]));
+            }
+        }
+        if (this.highlight >= 0) {
+            ctx.fillStyle = '#ff7f0e';
+            ctx.beginPath();
+            ctx.arc(this.screenX(g.x[this.highlight]), this.screenY(g.y[this.highlight]), radius + 2, 0, 2 * Math.PI);
+            ctx.fill();
+        }
+        if (this.hover >= 0) {
+            var hx = this.screenX(g.x[this.hover]), hy = this.screenY(g.y[this.hover]);
+            ctx.fillStyle = '#d62728';
+            ctx.beginPath();
+            ctx.arc(hx, hy, radius + 2, 0, 2 * Math.PI);
+            ctx.fill();
+            ctx.fillStyle = '#212529';
+            ctx.font = 'bold 12px sans-serif';
+            ctx.fillText(g.vids[this.hover] + ', ' + this.label(this.hover), hx + radius + 5, hy - radius - 8);
+        }
+        if (this.status) {
+            this.status.textContent = this.visibleCount + ' of ' + g.n + ' vertices and ' +
+                Math.ceil(edgeCount / stride) + ' of ' + g.m + ' edges shown';
+        }
+    };
+
+    GraphCanvas.prototype.vertexAt = function (px, py) {
+        var g = this.g, best = -1, bestDistance = HIT_PIXELS * HIT_PIXELS;
+        for (var i = 0; i < this.visibleCount; i++) {
+            var v = this.visible[i];
+            var dx = this.screenX(g.x[v]) - px, dy = this.screenY(g.y[v]) - py;
+            if (dx * dx + dy * dy <= bestDistance) {
+                best = v;
+                bestDistance = dx * dx + dy * dy;
+            }
+        }
+        return best;
+    };
+
+    GraphCanvas.prototype.listen = function () {
+        var self = this, canvas = this.canvas, drag = null;
+
+        function position(event) {
+            var rect = canvas.getBoundingClientRect();
+            return [event.clientX - rect.left, event.clientY - rect.top];
+        }
+
+        canvas.addEventListener('mousedown', function (event) {
+            drag = {x: event.clientX, y: event.clientY, moved: false};
+        });
+        window.addEventListener('mouseup', function (event) {
+            if (drag && !drag.moved && event.target === canvas && self.hover >= 0) {
+                window.location = self.vertexUrl.replace(/0$/, self.g.ids[self.hover]);
+            }
+            drag = null;
+        });
+        canvas.addEventListener('mousemove', function (event) {
+            if (drag) {
+                var dx = event.clientX - drag.x, dy = event.clientY - drag.y;
+                if (dx || dy) {
+                    drag.moved = true;
+                    self.cx -= dx / self.scale;
+                    self.cy += dy / self.scale;
+                    drag.x = event.clientX;
+                    drag.y = event.clientY;
+                    self.redraw();
+                }
+                return;
+            }
+            var p = position(event), hover = self.vertexAt(p[0], p[1]);
+            if (hover !== self.hover) {
+                self.hover = hover;
+                canvas.style.cursor = hover >= 0 ? 'pointer' : 'grab';
+                self.redraw();
+            }
+        });
+        canvas.addEventListener('wheel', function (event) {
+            event.preventDefault();
+            var p = position(event);
+            // Keep the point under the cursor in place.
+            var wx = self.cx + (p[0] - self.width / 2) / self.scale;
+            var wy = self.cy - (p[1] - self.height / 2) / self.scale;
+            self.scale *= Math.exp(-event.deltaY * (event.deltaMode ? 0.05 : 0.0015));
+            self.cx = wx - (p[0] - self.width / 2) / self.scale;
+            self.cy = wy + (p[1] - self.height / 2) / self.scale;
+            self.redraw();
+        }, {passive: false});
+        canvas.addEventListener('dblclick', function () {
+            self.fit();
+        });
+        window.addEventListener('resize', function () {
+            self.resize();
+            self.redraw();
+        });
+    };
+
+    document.querySelectorAll('.graph-canvas').forEach(function (container) {
+        var status = container.querySelector('.graph-canvas-status');
+        fetch(container.getAttribute('data-layout-url'))
+            .then(function (response) {
+                if (!response.ok) {
+                    throw new Error(response.status + ' ' + response.statusText);
+                }
+                return response.arrayBuffer();
+            })
+            .then(function (buffer) {
+                var g = parse(buffer);
+                if (!g.n) {
+                    status.textContent = container.getAttribute('data-empty-text');
+                    return;
+                }
+                new GraphCanvas(container, g);
+            })
+            .catch(function (error) {
+                status.textContent = 'Could not load the layout: ' + error.message;
+            });
+    });
+}());
@@ -1,3 +1,470 @@
-from django.test import TestCase
+import gzip
+import json
+import struct
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from graph import reachability
+from graph.importer import GraphImportError, import_graph
+from graph.layout import ensure_layout, LAYERED, FORCE
+from graph.models import Graph, Vertex, Edge, RenderJob, VertexClosure, bump_revision
+from graph.reachability import rebuild_closure
+from graph.payload import MAGIC, VERSION
+from graph.signals import graph_rebuilt
+from graph.snapshot import get_snapshot, invalidate
+from graph.topsort import topsort_in_place
+from graph.traversal import BOTH, IN, OUT, get_backend
+from graph.views import TABLE_ROWS
+from skillmap.pagination import encode_cursor
+from perf.testing import QueryBudgetMixin
+
+
+def make_graph(name, size):
+    """A chain of size vertices, each also linked to the first one."""
+    graph = Graph.objects.create(name=name)
+    vertices = [Vertex.objects.create(graph=graph, name='v%d' % i) for i in range(size)]
+    for previous, vertex in zip(vertices, vertices[1:]):
+        Edge.objects.create(source=previous, target=vertex)
+        if previous is not vertices[0]:
+            Edge.objects.create(source=vertices[0], target=vertex)
+    return graph, vertices
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    # The same budget must hold for a small and a larger graph.
+    SIZES = (3, 30)
+
+    def test_graph_list(self):
+        for size in self.SIZES:
+            make_graph('g%d' % size, size)
+            with self.assertMaxQueries(1):
+                self.assertEqual(self.client.get(reverse('graphs')).status_code, 200)
+
+    def test_graph_detail(self):
+        for size in self.SIZES:
+            graph, _ = make_graph('g%d' % size, size)
+            url = reverse('detail_graph', args=(graph.pk,))
+            with self.settings(GRAPH_RENDER_ASYNC=True):
+                with self.assertMaxQueries(4):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+                # The first look also loads the graph's snapshot.
+                with self.assertMaxQueries(11):
+                    self.assertEqual(self.client.get(url, {'mode': 'image'}).status_code, 200)
+            # The image drawn while the page waits: the positions, the
+            # render and the save.
+            with self.settings(GRAPH_RENDER_ASYNC=False):
+                with self.assertMaxQueries(10):
+                    self.assertEqual(self.client.get(url, {'mode': 'image'}).status_code, 200)
+            self.assertTrue(Graph.objects.get(pk=graph.pk).image_is_fresh())
+
+    def test_graph_layout(self):
+        for size in self.SIZES:
+            graph, _ = make_graph('g%d' % size, size)
+            url = reverse('graph_layout_binary', args=(graph.pk,))
+            before = Graph.objects.get(pk=graph.pk)
+            # The revisions, the graph, its snapshot (version, vertices and
+            # edges) and the stored positions.
+            with self.assertMaxQueries(6):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+            # Reading lays out without storing anything.
+            graph = Graph.objects.get(pk=graph.pk)
+            self.assertEqual((graph.version, graph.layout_revision), (before.version, before.layout_revision))
+            self.assertFalse(graph.vertex_set.filter(x__isnull=False).exists())
+            self.assertEqual(response['ETag'], '"%d-%d-%d-binary"' % (graph.pk, graph.revision, graph.layout_revision))
+            # With the snapshot cached: the revisions, the graph and the positions.
+            with self.assertMaxQueries(3):
+                self.assertEqual(self.client.get(url).content, response.content)
+            with self.assertMaxQueries(1):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            # Stored positions make a new layout revision and a new ETag,
+            # but leave the structural revision.
+            ensure_layout(graph, full=True)
+            graph = Graph.objects.get(pk=graph.pk)
+            self.assertEqual((graph.revision, graph.layout_revision), (before.revision, before.layout_revision + 1))
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_vertex_detail(self):
+        for size in self.SIZES:
+            _, vertices = make_graph('g%d' % size, size)
+            for vertex in (vertices[0], vertices[-1]):
+                # One query for the graph's revision, four for the page.
+                with self.assertMaxQueries(6):
+                    self.assertEqual(self.client.get(reverse('detail_vertex', args=(vertex.pk,))).status_code, 200)
+
+    def test_vertex_reachability(self):
+        for size in self.SIZES:
+            _, vertices = make_graph('g%d' % size, size)
+            for url in (reverse('vertex_ancestors', args=(vertices[-1].pk,)),
+                        reverse('vertex_descendants', args=(vertices[0].pk,))):
+                with self.assertMaxQueries(3):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class SnapshotTests(TransactionTestCase):
+    def add_elsewhere(self, graph, source):
+        """Add a vertex VID 10 below source from another connection: new rows
+        and a new revision, as another process leaves them, but no signal in
+        this process."""
+        def change():
+            Vertex.objects.bulk_create([Vertex(graph=graph, VID=10, name='new')])
+            Edge.objects.bulk_create([Edge(source=source, target=Vertex.objects.get(graph=graph, VID=10))])
+            bump_revision(graph.pk)
+            connection.close()
+        thread = threading.Thread(target=change)
+        thread.start()
+        thread.join()
+        return Vertex.objects.get(graph=graph, VID=10)
+
+    def test_change_from_another_connection(self):
+        graph, vertices = make_graph('g', 3)
+        digest = Graph.objects.get(pk=graph.pk).structure_hash()
+        self.add_elsewhere(graph, vertices[-1])
+        graph = Graph.objects.get(pk=graph.pk)
+        self.assertNotEqual(graph.structure_hash(), digest)
+        snapshot = get_snapshot(graph.pk)
+        self.assertEqual(list(snapshot.vids), [1, 2, 3, 10])
+        self.assertIn((3, 10), snapshot.edge_vids())
+
+    def test_neighbourhood_from_another_connection(self):
+        graph, vertices = make_graph('g', 3)
+        url = reverse('vertex_neighbourhood', args=(vertices[-1].pk,))
+        etag = self.client.get(url)['ETag']
+        new = self.add_elsewhere(graph, vertices[-1])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(new.pk, json.loads(response.content)['ids'])
+        response = self.client.get(reverse('vertex_neighbourhood', args=(new.pk,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['distance'], [2, 2, 1, 0])
+
+
+class TopSortTests(TestCase):
+    def vids(self, graph):
+        return dict(graph.vertex_set.values_list('name', 'VID'))
+
+    def test_sorted_graph_keeps_its_vids(self):
+        graph = Graph.objects.create(name='g')
+        v = {vid: Vertex.objects.create(graph=graph, name='v%d' % vid) for vid in range(1, 5)}
+        Edge.objects.create(source=v[1], target=v[4])
+        Edge.objects.create(source=v[2], target=v[3])
+        before = self.vids(graph)
+        topsort_in_place(Graph.objects.get(pk=graph.pk))
+        self.assertEqual(self.vids(graph), before)
+
+    def test_renumber(self):
+        graph = Graph.objects.create(name='g')
+        v = {vid: Vertex.objects.create(graph=graph, name='v%d' % vid) for vid in range(1, 4)}
+        Edge.objects.create(source=v[3], target=v[1])
+        topsort_in_place(Graph.objects.get(pk=graph.pk))
+        self.assertEqual(self.vids(graph), {'v2': 1, 'v3': 2, 'v1': 3})
+
+
+class DagTests(TestCase):
+    def test_new_vertex_ranks_last(self):
+        graph, vertices = make_graph('g', 3)
+        self.assertEqual([v.rank for v in graph.vertex_set.order_by('VID')], [1, 2, 3])
+        Vertex.objects.bulk_create([Vertex(graph=graph, VID=v, name='v%d' % v) for v in (4, 5)])
+        graph_rebuilt.send(sender=Graph, graph_id=graph.pk)
+        new = Vertex.objects.create(graph=graph, VID=6, name='new')
+        self.assertEqual(new.rank, 6)
+        self.assertEqual(len(set(graph.vertex_set.values_list('rank', flat=True))), 6)
+
+
+class RenderJobTests(TestCase):
+    def failed(self, job, attempts, ago):
+        RenderJob.objects.filter(pk=job.pk).update(status=RenderJob.FAILED, attempts=attempts,
+                                                   finished=timezone.now() - timedelta(seconds=ago))
+
+    @override_settings(GRAPH_RENDER_RETRIES=2, GRAPH_RENDER_RETRY_DELAY=60)
+    def test_failed_render_is_retried(self):
+        graph, _ = make_graph('g', 3)
+        job = graph.request_image()
+        self.failed(job, 1, 30)
+        # Too soon after the failure.
+        self.assertEqual(graph.request_image().status, RenderJob.FAILED)
+        self.failed(job, 1, 61)
+        self.assertEqual(graph.request_image().status, RenderJob.PENDING)
+        # The second retry waits twice as long.
+        self.failed(job, 2, 61)
+        self.assertEqual(graph.request_image().status, RenderJob.FAILED)
+        self.failed(job, 2, 121)
+        self.assertEqual(graph.request_image().status, RenderJob.PENDING)
+        # Retries used up: only a new structure is queued again.
+        self.failed(job, 3, 10 ** 6)
+        self.assertEqual(graph.request_image().status, RenderJob.FAILED)
+        Vertex.objects.create(graph=graph, name='new')
+        job = Graph.objects.get(pk=graph.pk).request_image()
+        self.assertEqual((job.status, job.attempts), (RenderJob.PENDING, 0))
+
+
+class ImportTests(TestCase):
+    def test_import(self):
+        graph = import_graph({'name': 'g', 'vertexes': [{'VID': 1, 'name': 'a'}, {'VID': 2, 'name': 'b'}],
+                              'edges': [{'source': 2, 'target': 1}]})
+        self.assertEqual(get_snapshot(graph.pk).edge_vids(), [(2, 1)])
+
+    def test_rejected(self):
+        vertexes = [{'VID': vid, 'name': 'v%d' % vid} for vid in (1, 2, 3)]
+        for document in ([], 1, {'name': 'g', 'vertexes': {}}, {'name': 'g', 'edges': [1]},
+                         {'name': 'g', 'vertexes': [{'VID': True, 'name': 'a'}]},
+                         {'name': 'g', 'vertexes': vertexes, 'edges': [{'source': True, 'target': 2}]},
+                         {'name': 'g', 'vertexes': vertexes, 'edges': [{'source': [1], 'target': 2}]},
+                         {'name': 'g', 'vertexes': vertexes, 'edges': [{'source': 1, 'target': 2},
+                                                                       {'source': 2, 'target': 3},
+                                                                       {'source': 3, 'target': 1}]},
+                         {'name': 'g', 'vertexes': vertexes, 'edges': [{'source': 2, 'target': 2}]}):
+            with self.assertRaises(GraphImportError):
+                import_graph(document)
+        self.assertFalse(Graph.objects.exists())
+        response = self.client.post(reverse('graph_from_json'), {'text': '[1, 2]'})
+        self.assertEqual(response.status_code, 404)
+
+
+class TraversalTests(TestCase):
+    def setUp(self):
+        # The chain with its shortcuts from v0, plus a side branch into it.
+        self.graph, self.vertices = make_graph('g', 8)
+        side = [Vertex.objects.create(graph=self.graph, name='s%d' % i) for i in range(3)]
+        Edge.objects.create(source=side[0], target=side[1])
+        Edge.objects.create(source=side[1], target=self.vertices[5])
+        Edge.objects.create(source=side[2], target=side[1])
+        self.vertices += side
+
+    def assertSameAnswers(self, backend, directions):
+        expected = get_backend('orm')
+        for vertex in self.vertices:
+            self.assertEqual(backend.ancestors(vertex.pk), expected.ancestors(vertex.pk))
+            self.assertEqual(backend.descendants(vertex.pk), expected.descendants(vertex.pk))
+            for direction in directions:
+                for hops in (0, 1, 2, 5):
+                    self.assertEqual(backend.neighbourhood(vertex.pk, hops, direction),
+                                     expected.neighbourhood(vertex.pk, hops, direction))
+
+    def test_closure(self):
+        self.assertSameAnswers(get_backend('closure'), (IN, OUT, BOTH))
+
+    @skipUnless(connection.vendor == 'postgresql', 'The cte backend needs PostgreSQL')
+    def test_cte(self):
+        self.assertSameAnswers(get_backend('cte'), (IN, OUT, BOTH))
+        self.assertEqual(get_backend().name, 'cte')
+
+    def test_closure_after_deletes(self):
+        def closure():
+            return set(VertexClosure.objects.filter(ancestor__graph=self.graph)
+                       .values_list('ancestor_id', 'descendant_id', 'distance'))
+        Edge.objects.get(source=self.vertices[4], target=self.vertices[5]).delete()
+        Edge.objects.get(source=self.vertices[9], target=self.vertices[5]).delete()
+        # A vertex goes with all its edges, and is recomputed once.
+        with mock.patch('graph.reachability._recompute', wraps=reachability._recompute) as recompute:
+            self.vertices[6].delete()
+        self.assertEqual(recompute.call_count, 1)
+        incremental = closure()
+        rebuild_closure(self.graph.pk)
+        self.assertEqual(incremental, closure())
+
+
+class RevisionTests(QueryBudgetMixin, TestCase):
+    def revision(self, graph):
+        return Graph.objects.values_list('revision', flat=True).get(pk=graph.pk)
+
+    def test_changes_bump_the_revision(self):
+        graph, vertices = make_graph('g', 3)
+        revision = self.revision(graph)
+        Vertex.objects.filter(pk=vertices[1].pk).get().save()
+        self.assertGreater(self.revision(graph), revision)
+        revision = self.revision(graph)
+        self.client.get(reverse('graph_add_nullpoint', args=(graph.pk,)))
+        self.assertGreater(self.revision(graph), revision)
+        revision = self.revision(graph)
+        # A new image alone does not change the page's revision.
+        Graph.objects.get(pk=graph.pk).save(update_fields=['render_hash'])
+        self.assertEqual(self.revision(graph), revision)
+
+    def test_not_modified(self):
+        graph, vertices = make_graph('g', 5)
+        detail = reverse('detail_graph', args=(graph.pk,))
+        for url in (detail, detail + '?mode=image', reverse('graph_to_json', args=(graph.pk,)),
+                    reverse('graph_layout_json', args=(graph.pk,)), reverse('detail_vertex', args=(vertices[0].pk,)),
+                    reverse('vertex_neighbourhood', args=(vertices[0].pk,)) + '?hops=1'):
+            with self.settings(GRAPH_RENDER_ASYNC=True):
+                etag = self.client.get(url)['ETag']
+                with self.assertMaxQueries(1):
+                    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                Edge.objects.filter(source__graph=graph).first().delete()
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_export_if_range(self):
+        graph, _ = make_graph('g', 3)
+        url = reverse('graph_export_json', args=(graph.pk,))
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+        Vertex.objects.create(graph=graph, name='new')
+        # The part the client has is of an older revision: send it all.
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class LayoutTests(TestCase):
+    def positions(self, graph):
+        return {pk: (x, y) for pk, x, y in graph.vertex_set.values_list('pk', 'x', 'y')}
+
+    def test_layered(self):
+        graph, vertices = make_graph('g', 5)
+        ensure_layout(graph)
+        self.assertEqual(graph.layout, LAYERED)
+        positions = self.positions(graph)
+        # Every vertex sits one layer below its deepest predecessor.
+        self.assertEqual([positions[v.pk][1] for v in vertices], [0, -1, -2, -3, -4])
+
+    def test_incremental(self):
+        graph, vertices = make_graph('g', 5)
+        ensure_layout(graph)
+        before = self.positions(graph)
+        new = Vertex.objects.create(graph=graph, name='new')
+        Edge.objects.create(source=vertices[1], target=new)
+        ensure_layout(Graph.objects.get(pk=graph.pk))
+        after = self.positions(graph)
+        self.assertEqual(after.pop(new.pk)[1], -2)
+        self.assertEqual(after, before)
+
+    def test_stored_by_render_worker(self):
+        graph, _ = make_graph('g', 3)
+        graph.request_image()
+        self.assertEqual(RenderJob.run_next().status, RenderJob.DONE)
+        graph = Graph.objects.get(pk=graph.pk)
+        self.assertEqual((graph.layout, graph.layout_revision), (LAYERED, 1))
+        self.assertFalse(graph.vertex_set.filter(x__isnull=True).exists())
+
+    def test_force(self):
+        # A star is much wider than deep, and older graphs may have cycles.
+        graph = Graph.objects.create(name='star')
+        centre = Vertex.objects.create(graph=graph, name='centre')
+        for i in range(30):
+            Edge.objects.create(source=centre, target=Vertex.objects.create(graph=graph, name='v%d' % i))
+        positions = ensure_layout(graph)
+        self.assertEqual(graph.layout, FORCE)
+        self.assertEqual(len(set(positions.values())), 31)
+
+        graph, vertices = make_graph('cycle', 4)
+        Edge.objects.bulk_create([Edge(source=vertices[-1], target=vertices[0])])
+        invalidate(graph.pk)
+        positions = ensure_layout(graph)
+        self.assertEqual(graph.layout, FORCE)
+        self.assertEqual(set(positions), {v.VID for v in vertices})
+
+    def test_payload(self):
+        graph, vertices = make_graph('g', 4)
+        payload = json.loads(self.client.get(reverse('graph_layout_json', args=(graph.pk,))).content)
+        self.assertEqual(payload['ids'], [v.pk for v in vertices])
+        self.assertEqual(payload['labels'], ['v0', 'v1', 'v2', 'v3'])
+        self.assertEqual(payload['y'], [0, -1, -2, -3])
+        self.assertEqual(len(payload['edges']), 2 * Edge.objects.filter(source__graph=graph).count())
+        self.assertIn([0, 1], [payload['edges'][i:i + 2] for i in range(0, len(payload['edges']), 2)])
+
+        response = self.client.get(reverse('graph_layout_binary', args=(graph.pk,)), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        data = gzip.decompress(response.content)
+        magic, version, n, m, text_bytes, revision = struct.unpack_from('<6I', data)
+        self.assertEqual((magic, version, n, m), (MAGIC, VERSION, 4, len(payload['edges']) // 2))
+        self.assertEqual(list(struct.unpack_from('<4I', data, 24)), payload['ids'])
+        self.assertEqual(list(struct.unpack_from('<4f', data, 24 + 3 * 16)), payload['y'])
+        self.assertEqual(data[-text_bytes - (-text_bytes % 4):][:text_bytes], b'v0v1v2v3')
+
+
+class NeighbourhoodTests(QueryBudgetMixin, TestCase):
+    def get(self, vertex, **params):
+        return json.loads(self.client.get(reverse('vertex_neighbourhood', args=(vertex.pk,)), params).content)
+
+    def test_hops(self):
+        # v0 links to every vertex; without it the chain is v1 -> v2 -> ... -> v5.
+        graph, vertices = make_graph('g', 6)
+        payload = self.get(vertices[3], hops=1)
+        self.assertEqual(payload['ids'], [vertices[i].pk for i in (0, 2, 3, 4)])
+        self.assertEqual(payload['distance'], [1, 1, 0, 1])
+        self.assertFalse(payload['truncated'])
+        # Only the edges among the vertices found: v0 -> v2, v0 -> v3, v0 -> v4, v2 -> v3, v3 -> v4.
+        self.assertEqual(len(payload['edges']), 10)
+        self.assertEqual(len(self.get(vertices[3], hops=2)['ids']), 6)
+
+    def test_max_nodes(self):
+        graph, vertices = make_graph('g', 6)
+        payload = self.get(vertices[3], hops=2, max_nodes=3)
+        self.assertEqual(len(payload['ids']), 3)
+        self.assertTrue(payload['truncated'])
+        self.assertEqual(sorted(payload['distance']), [0, 1, 1])
+        url = reverse('vertex_neighbourhood', args=(vertices[3].pk,))
+        self.assertEqual(self.client.get(url, {'hops': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'max_nodes': 0}).status_code, 400)
+
+    def test_cached_per_revision(self):
+        graph, vertices = make_graph('g', 6)
+        url = reverse('vertex_neighbourhood_binary', args=(vertices[3].pk,))
+        first = self.client.get(url).content
+        # Only the revision is read; the subgraph comes from the cache.
+        with self.assertMaxQueries(1):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, first)
+        Vertex.objects.create(graph=graph, name='new')
+        Edge.objects.create(source=vertices[3], target=Vertex.objects.get(graph=graph, name='new'))
+        self.assertNotEqual(self.client.get(url).content, first)
+
+
+class PaginationTests(QueryBudgetMixin, TestCase):
+    def follow(self, url, context_name):
+        """The rows of every page from the first to the last, then of those
+        before the last back to the first."""
+        page = self.client.get(url).context[context_name]
+        pages = [list(page)]
+        for direction in ('next_query', 'previous_query'):
+            while getattr(page, direction) is not None:
+                page = self.client.get(url + '?' + getattr(page, direction)).context[context_name]
+                pages.append(list(page))
+        return pages
+
+    def test_graph_list(self):
+        for i in range(60):
+            Graph.objects.create(name='g%02d' % i, description='x' * 300)
+        make_graph('chain', 3)
+        pages = self.follow(reverse('graphs'), 'page_obj')
+        names = [graph['name'] for page in pages[:2] for graph in page]
+        self.assertEqual(names, sorted(Graph.objects.values_list('name', flat=True)))
+        # Back to the first page, which is also the last one visited.
+        self.assertEqual(pages[-1], pages[0])
+        chain = next(graph for graph in pages[0] if graph['name'] == 'chain')
+        self.assertEqual((chain['vertex_count'], chain['edge_count']), (3, 3))
+        self.assertEqual(len(pages[0][1]['summary']), 201)
+        with self.assertMaxQueries(1):
+            self.assertEqual(self.client.get(reverse('graphs'), {'after': encode_cursor(['g30'])}).status_code, 200)
+        self.assertEqual(self.client.get(reverse('graphs'), {'after': 'not a cursor'}).status_code, 404)
+
+    def test_edge_table(self):
+        graph, vertices = make_graph('g', 31)
+        url = reverse('detail_graph', args=(graph.pk,))
+        pages = self.follow(url, 'edges')
+        self.assertEqual([len(page) for page in pages], [TABLE_ROWS, 59 - TABLE_ROWS, TABLE_ROWS])
+        rows = [(edge['source_id'], edge['target_id'], edge['pk']) for page in pages[:2] for edge in page]
+        self.assertEqual(rows, sorted(Edge.objects.filter(source__graph=graph)
+                                      .values_list('source_id', 'target_id', 'pk')))
+        # The other table keeps its own place.
+        self.assertIsNone(self.client.get(url).context['vertices'].previous_query)
+        # v28 -> v29, v0 -> v29 and v29 -> v30.
+        self.assertEqual(len(self.client.get(url, {'edges_q': 'v29'}).context['edges']), 3)
+        # By VID, where no name contains it: v29 -> v30 and v0 -> v30.
+        self.assertEqual(len(self.client.get(url, {'edges_q': str(vertices[30].VID)}).context['edges']), 2)
+
+    def test_requires(self):
+        graph, vertices = make_graph('g', TABLE_ROWS + 10)
+        pages = self.follow(reverse('detail_vertex', args=(vertices[-1].pk,)), 'requires')
+        self.assertEqual([len(page) for page in pages], [TABLE_ROWS, 9, TABLE_ROWS])
+        # The nearest first: v0 and the one before it are both direct.
+        self.assertEqual([link.distance for link in pages[0][:3]], [1, 1, 2])
+        self.assertEqual({link.ancestor_id for page in pages[:2] for link in page},
+                         {v.pk for v in vertices[:-1]})
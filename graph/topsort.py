@@ -0,0 +1,54 @@
+from django.db import transaction
+
+from graph.models import Graph, Vertex, Edge
+from graph.signals import graph_rebuilt
+from graph.snapshot import get_snapshot
+
+
+def topsort_copy(graph, new_name, batch_size=1000):
+    """Copy graph under new_name with VIDs renumbered 1..n in topological order.
+
+    Raises GraphCycleError if the graph is not acyclic.
+    """
+    with transaction.atomic():
+        snapshot = get_snapshot(graph.pk, graph.version)
+        order = snapshot.topological_order()
+        new_vid = [0] * len(snapshot)
+        for rank, i in enumerate(order):
+            new_vid[i] = rank + 1
+        descriptions = dict(graph.vertex_set.values_list('pk', 'description'))
+        new_g = Graph.objects.create(name=new_name, description=graph.description)
+        Vertex.objects.bulk_create([Vertex(graph=new_g,
+                                           VID=new_vid[i],
+                                           name=snapshot.names[i],
+                                           description=descriptions[snapshot.pks[i]]) for i in order],
+                                   batch_size=batch_size)
+        pk_by_vid = dict(new_g.vertex_set.values_list('VID', 'pk'))
+        index = snapshot.index
+        Edge.objects.bulk_create([Edge(source_id=pk_by_vid[new_vid[index[source_id]]],
+                                       target_id=pk_by_vid[new_vid[index[target_id]]],
+                                       description=description)
+                                  for source_id, target_id, description in
+                                  Edge.objects.filter(source__graph=graph).values_list('source_id', 'target_id',
+                                                                                       'description')
+                                  if source_id in index and target_id in index], batch_size=batch_size)
+        graph_rebuilt.send(sender=Graph, graph_id=new_g.pk)
+    return new_g
+
+
+def topsort_in_place(graph, batch_size=1000):
+    """Renumber the VIDs of graph 1..n in topological order.
+
+    Raises GraphCycleError if the graph is not acyclic.
+    """
+    with transaction.atomic():
+        snapshot = get_snapshot(graph.pk, graph.version)
+        order = snapshot.topological_order()
+        # (graph, VID) is unique and checked row by row, so first move every
+        # vertex below the VIDs in use, then onto 1..n.
+        below = min(snapshot.vids[0] if snapshot.vids else 0, 0) - 1
+        Vertex.objects.bulk_update([Vertex(pk=snapshot.pks[i], VID=below - rank) for rank, i in enumerate(order)],
+                                   ['VID'], batch_size=batch_size)
+        Vertex.objects.bulk_update([Vertex(pk=snapshot.pks[i], VID=rank + 1) for rank, i in enumerate(order)],
+                                   ['VID'], batch_size=batch_size)
+        graph_rebuilt.send(sender=Graph, graph_id=graph.pk)
@@ -0,0 +1,134 @@
+"""Interchangeable graph traversal backends.
+
+Every backend answers the same three questions and returns the same
+shape: a list of (vertex_pk, distance) pairs, excluding the start vertex,
+sorted by distance and then pk. distance is the length of the shortest
+path in the followed direction.
+
+    cte      -- WITH RECURSIVE over the edge table, evaluated by PostgreSQL
+    orm      -- breadth-first search, one edge query per level (any database)
+    closure  -- lookups in the VertexClosure index (directed queries only)
+"""
+from django.db import connection
+
+from graph.models import Vertex, Edge, VertexClosure
+
+CHUNK = 500
+
+OUT, IN, BOTH = 'out', 'in', 'both'
+
+
+class ORMBackend:
+    name = 'orm'
+
+    def neighbourhood(self, vertex_id, hops, direction=BOTH):
+        distance = {vertex_id: 0}
+        frontier = [vertex_id]
+        level = 0
+        while frontier and (hops is None or level < hops):
+            level += 1
+            next_frontier = []
+            for i in range(0, len(frontier), CHUNK):
+                chunk = frontier[i:i + CHUNK]
+                neighbours = []
+                if direction in (OUT, BOTH):
+                    neighbours += Edge.objects.filter(source_id__in=chunk).values_list('target_id', flat=True)
+                if direction in (IN, BOTH):
+                    neighbours += Edge.objects.filter(target_id__in=chunk).values_list('source_id', flat=True)
+                for pk in neighbours:
+                    if pk not in distance:
+                        distance[pk] = level
+                        next_frontier.append(pk)
+            frontier = next_frontier
+        del distance[vertex_id]
+        return sorted(distance.items(), key=lambda item: (item[1], item[0]))
+
+    def ancestors(self, vertex_id):
+        return self.neighbourhood(vertex_id, None, IN)
+
+    def descendants(self, vertex_id):
+        return self.neighbourhood(vertex_id, None, OUT)
+
+
+class RecursiveCTEBackend:
+    name = 'cte'
+
+    # UNION (not UNION ALL) keeps at most one row per (vertex, distance), so
+    # the working table stays linear per level even on DAGs with many
+    # parallel paths. Without a hop limit the depth is bounded by the
+    # number of vertices, which also stops the recursion on legacy cycles.
+    STEP = {
+        OUT: 'SELECT e.{target} FROM {edge} e WHERE e.{source} = r.vertex_id',
+        IN: 'SELECT e.{source} FROM {edge} e WHERE e.{target} = r.vertex_id',
+    }
+    STEP[BOTH] = STEP[OUT] + ' UNION ALL ' + STEP[IN]
+    SQL = '''
+        WITH RECURSIVE reach(vertex_id, distance) AS (
+            SELECT CAST(%s AS bigint), 0
+          UNION
+            SELECT n.vertex_id, r.distance + 1
+            FROM reach r CROSS JOIN LATERAL ({step}) AS n(vertex_id)
+            WHERE r.distance < %s
+        )
+        SELECT vertex_id, MIN(distance) FROM reach
+        WHERE vertex_id <> %s
+        GROUP BY vertex_id
+        ORDER BY 2, 1
+    '''
+
+    def _sql(self, direction):
+        return self.SQL.format(step=self.STEP[direction].format(
+            edge=connection.ops.quote_name(Edge._meta.db_table),
+            source=connection.ops.quote_name(Edge._meta.get_field('source').column),
+            target=connection.ops.quote_name(Edge._meta.get_field('target').column)))
+
+    def neighbourhood(self, vertex_id, hops, direction=BOTH):
+        if hops is None:
+            graph_id = Vertex.objects.filter(pk=vertex_id).values_list('graph_id', flat=True).first()
+            hops = Vertex.objects.filter(graph_id=graph_id).count()
+        with connection.cursor() as cursor:
+            cursor.execute(self._sql(direction), [vertex_id, hops, vertex_id])
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def ancestors(self, vertex_id):
+        return self.neighbourhood(vertex_id, None, IN)
+
+    def descendants(self, vertex_id):
+        return self.neighbourhood(vertex_id, None, OUT)
+
+
+class ClosureBackend:
+    name = 'closure'
+
+    def neighbourhood(self, vertex_id, hops, direction=BOTH):
+        if direction == BOTH:
+            # The closure only knows directed paths.
+            return ORMBackend().neighbourhood(vertex_id, hops, direction)
+        if direction == OUT:
+            rows = VertexClosure.objects.filter(ancestor_id=vertex_id).values_list('descendant_id', 'distance')
+        else:
+            rows = VertexClosure.objects.filter(descendant_id=vertex_id).values_list('ancestor_id', 'distance')
+        if hops is not None:
+            rows = rows.filter(distance__lte=hops)
+        return sorted(rows, key=lambda row: (row[1], row[0]))
+
+    def ancestors(self, vertex_id):
+        return self.neighbourhood(vertex_id, None, IN)
+
+    def descendants(self, vertex_id):
+        return self.neighbourhood(vertex_id, None, OUT)
+
+
+BACKENDS = {backend.name: backend for backend in (ORMBackend, RecursiveCTEBackend, ClosureBackend)}
+
+
+def get_backend(name=None):
+    """Backend by name; 'auto' or None picks cte on PostgreSQL and orm elsewhere."""
+    if name in (None, '', 'auto'):
+        name = 'cte' if connection.vendor == 'postgresql' else 'orm'
+    if name == 'cte' and connection.vendor != 'postgresql':
+        raise ValueError('The cte backend needs PostgreSQL')
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError('Unknown traversal backend: %s' % name)
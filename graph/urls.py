@@ -9,9 +9,21 @@ urlpatterns = [
     path('graph/<int:pk>/topsort', views.TopSortView.as_view(), name='graph_topsort'),
     path('graph/<int:pk>/add_nullpoint', views.AddNullPointView.as_view(), name='graph_add_nullpoint'),
     path('graph/<int:pk>/json', views.GraphToJSONView.as_view(), name='graph_to_json'),
+    path('graph/<int:pk>/image.png', views.GraphImageView.as_view(), name='graph_image'),
+    path('graph/<int:pk>/export.json', views.GraphExportView.as_view(), name='graph_export_json'),
+    path('graph/<int:pk>/layout.json', views.GraphLayoutView.as_view(format='json'), name='graph_layout_json'),
+    path('graph/<int:pk>/layout.bin', views.GraphLayoutView.as_view(format='binary'), name='graph_layout_binary'),
     path('graph/<int:pk>/add_vertex', views.AddVertexView.as_view(), name='add_vertex'),
     path('graph/<int:pk>/add_edge', views.AddEdgeView.as_view(), name='add_edge'),
     path('vertex/<int:pk>', views.VertexDetailView.as_view(), name='detail_vertex'),
+    path('vertex/<int:pk>/ancestors', views.VertexReachabilityView.as_view(direction='ancestors'),
+         name='vertex_ancestors'),
+    path('vertex/<int:pk>/descendants', views.VertexReachabilityView.as_view(direction='descendants'),
+         name='vertex_descendants'),
+    path('vertex/<int:pk>/neighbourhood', views.VertexNeighbourhoodView.as_view(format='json'),
+         name='vertex_neighbourhood'),
+    path('vertex/<int:pk>/neighbourhood.bin', views.VertexNeighbourhoodView.as_view(format='binary'),
+         name='vertex_neighbourhood_binary'),
     path('vertex/<int:pk>/add_incoming', views.AddIncomingEdgeView.as_view(), name='create_incoming'),
     path('vertex/<int:pk>/add_incoming_new', views.CreateIncomingView.as_view(), name='create_incoming_new'),
     path('vertex/<int:pk>/add_outcoming', views.AddOutcomingEdgeView.as_view(), name='create_outcoming'),
@@ -1,23 +1,49 @@
+from django.conf import settings
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Substr
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.urls import reverse_lazy
-from django.views.generic import TemplateView, ListView, CreateView, DetailView, DeleteView, FormView
-from .models import Graph, Vertex, Edge, AddEdgeForm, AddEdgeVertexForm, GraphFromJSONForm, TopSortForm
+from django.views.generic import TemplateView, ListView, CreateView, DetailView, DeleteView, FormView, View
+from .models import Graph, Vertex, Edge, AddEdgeForm, VertexForm, AddEdgeVertexForm, GraphFromJSONForm, TopSortForm
+from .exporter import iter_graph_json, gzip_chunks, slice_chunks, parse_range
+from .importer import import_graph, GraphImportError
+from .neighbourhood import get_neighbourhood, DEFAULT_HOPS, MAX_HOPS, DEFAULT_MAX_NODES, MAX_NODES
+from .payload import layout_json, layout_binary, to_json, to_binary
+from .signals import graph_rebuilt
+from .snapshot import get_snapshot, GraphCycleError
+from .topsort import topsort_copy, topsort_in_place
+from .traversal import get_backend
 from itertools import zip_longest
-import networkx as nx
 import json
-from django.http import Http404
-from networkx.algorithms.dag import topological_sort
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse, JsonResponse
 from django.views.generic.base import RedirectView
-from django.db.models import Count
+from skillmap.conditional import ConditionalGetMixin, revision_etag
+from skillmap.pagination import KeysetListMixin, KeysetPaginator, SUMMARY_LENGTH
+
+# Length of the render hash prefix in image URLs and ETags.
+IMAGE_VERSION_LENGTH = 16
+# Rows per page of the vertex and edge tables of a graph.
+TABLE_ROWS = 50
 
 
 # Create your views here.
 
 
-class GraphListView(ListView):
-    model = Graph
+class GraphListView(KeysetListMixin, ListView):
     context_object_name = 'graphs'
     template_name = 'graph/graphs.html'
+    keys = ('name',)
+
+    def get_queryset(self):
+        vertices = Vertex.objects.filter(graph=OuterRef('pk')).order_by().values('graph')
+        edges = Edge.objects.filter(source__graph=OuterRef('pk')).order_by().values('source__graph')
+        return Graph.objects.values('pk', 'name').annotate(
+            # One character more, so the template knows when to add an ellipsis.
+            summary=Substr('description', 1, SUMMARY_LENGTH + 1),
+            vertex_count=Coalesce(Subquery(vertices.annotate(n=Count('pk')).values('n')), 0),
+            edge_count=Coalesce(Subquery(edges.annotate(n=Count('pk')).values('n')), 0))
 
 
 class CreateGraph(CreateView):
@@ -29,28 +55,92 @@ class CreateGraph(CreateView):
         return reverse_lazy('graphs')
 
 
-class GraphDetailView(DetailView):
+class GraphDetailView(ConditionalGetMixin, DetailView):
+    """The graph drawn by the browser from its layout payload, or with
+    ?mode=image as the picture rendered on the server."""
     model = Graph
     template_name = 'graph/graph_detail.html'
     context_object_name = 'graph'
+    MODES = ('canvas', 'image')
+
+    @property
+    def mode(self):
+        mode = self.request.GET.get('mode')
+        return mode if mode in self.MODES else self.MODES[0]
+
+    @staticmethod
+    def _validators(pk, revision, updated_at, render_hash, job_status, job_finished):
+        # The page also shows the image and how far its render is.
+        return (revision_etag(pk, revision, (render_hash or '')[:IMAGE_VERSION_LENGTH], job_status),
+                max(updated_at, job_finished or updated_at))
+
+    def get_validators(self, pk):
+        if self.mode == 'canvas':
+            # The page links the layout payload of both revisions.
+            row = Graph.objects.filter(pk=pk).values_list('revision', 'updated_at', 'layout_revision').first()
+            return None if row is None else (revision_etag(pk, row[0], row[2], 'canvas'), row[1])
+        self.row = Graph.objects.filter(pk=pk).values_list('revision', 'updated_at', 'render_hash',
+                                                           'render_job__status', 'render_job__finished').first()
+        return None if self.row is None else self._validators(pk, *self.row)
+
+    def get_response_validators(self, validators):
+        if self.mode == 'canvas':
+            return validators
+        # Showing the page renders the image or queues its render; without
+        # a new job, the one read before is still the graph's.
+        graph, job = self.object, getattr(self, 'render_job', None)
+        job_state = (job.status, job.finished) if job else self.row[3:]
+        return self._validators(graph.pk, graph.revision, graph.updated_at, graph.render_hash, *job_state)
 
     def get_context_data(self, **kwargs):
-        self.get_object().create_image()
         context = super().get_context_data(**kwargs)
-        context['edges'] = Edge.objects.filter(source__graph=self.get_object())
+        context['mode'] = self.mode
+        # The canvas draws in the browser; only the image mode renders here.
+        if self.mode == 'image':
+            if settings.GRAPH_RENDER_ASYNC:
+                context['render_job'] = self.render_job = self.object.request_image()
+            else:
+                self.object.create_image()
+        context['vertices'], context['vertex_filter'] = self.vertex_page()
+        context['edges'], context['edge_filter'] = self.edge_page()
         return context
 
+    def vertex_page(self):
+        vertices = Vertex.objects.filter(graph=self.object).values('pk', 'VID', 'depth', 'name', 'description')
+        text = self.request.GET.get('vertices_q', '').strip()
+        if text:
+            vertices = vertices.filter(name__icontains=text)
+        return self.paginate(vertices, ('VID',), 'vertices_'), text
+
+    def edge_page(self):
+        edges = Edge.objects.filter(source__graph=self.object) \
+            .values('pk', 'description', 'source_id', 'target_id',
+                    'source__VID', 'source__name', 'target__VID', 'target__name')
+        text = self.request.GET.get('edges_q', '').strip()
+        if text:
+            match = Q(source__name__icontains=text) | Q(target__name__icontains=text) | Q(description__icontains=text)
+            if text.isdigit():
+                match |= Q(source__VID=int(text)) | Q(target__VID=int(text))
+            edges = edges.filter(match)
+        # Keyed on the edge's own indexed columns: ordering by the VIDs would
+        # sort every edge of the graph through two joins for each page.
+        return self.paginate(edges, ('source_id', 'target_id', 'pk'), 'edges_'), text
+
+    def paginate(self, queryset, keys, prefix):
+        try:
+            return KeysetPaginator(queryset, keys, TABLE_ROWS, prefix).page(self.request.GET)
+        except ValueError as e:
+            raise Http404(str(e))
+
 
 class AddVertexView(CreateView):
-    model = Vertex
-    fields = ['graph', 'VID', 'name', 'description']
+    form_class = VertexForm
     template_name = 'graph/add_vertex.html'
 
     def get_initial(self):
         super(AddVertexView, self).get_initial()
         graph = Graph.objects.get(pk=self.kwargs['pk'])
-        self.initial = {'graph': graph,
-                        'VID': max(Vertex.objects.filter(graph=graph).values_list('VID', flat=True), default=0) + 1}
+        self.initial = {'graph': graph}
         return self.initial
 
     def form_valid(self, form):
@@ -69,9 +159,7 @@ class CreateIncomingView(CreateView):
     def get_initial(self):
         super(CreateIncomingView, self).get_initial()
         self.vertex = Vertex.objects.get(pk=self.kwargs['pk'])
-        self.initial = {'graph': self.vertex.graph,
-                        'VID': max(Vertex.objects.filter(graph=self.vertex.graph).values_list('VID', flat=True),
-                                   default=0) + 1}
+        self.initial = {'graph': self.vertex.graph}
         return self.initial
 
     def form_valid(self, form):
@@ -92,9 +180,7 @@ class CreateOutcomingView(CreateView):
     def get_initial(self):
         super(CreateOutcomingView, self).get_initial()
         self.vertex = Vertex.objects.get(pk=self.kwargs['pk'])
-        self.initial = {'graph': self.vertex.graph,
-                        'VID': max(Vertex.objects.filter(graph=self.vertex.graph).values_list('VID', flat=True),
-                                   default=0) + 1}
+        self.initial = {'graph': self.vertex.graph}
         return self.initial
 
     def form_valid(self, form):
@@ -108,18 +194,161 @@ class CreateOutcomingView(CreateView):
         return reverse_lazy('detail_vertex', kwargs={'pk': self.kwargs['pk']})
 
 
-class VertexDetailView(DetailView):
+class GraphImageView(View):
+    """The rendered picture of a graph. Its URL carries the render hash as
+    ?v=, so a browser may keep a matching copy for good."""
+
+    def get(self, request, pk):
+        graph = get_object_or_404(Graph.objects.only('pk', 'image', 'render_hash'), pk=pk)
+        if not graph.image or not graph.render_hash:
+            raise Http404("The graph has no image yet")
+        version = graph.render_hash[:IMAGE_VERSION_LENGTH]
+        etag = revision_etag(version)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            try:
+                response = FileResponse(graph.image.open('rb'), content_type='image/png')
+            except FileNotFoundError:
+                raise Http404("The graph has no image yet")
+        response['ETag'] = etag
+        if request.GET.get('v') == version:
+            response['Cache-Control'] = 'max-age=31536000, immutable'
+        else:
+            response['Cache-Control'] = 'no-cache'
+        return response
+
+
+class GraphLayoutView(ConditionalGetMixin, View):
+    """Stored vertex positions and edges for drawing the graph in the
+    browser, as JSON or packed binary (see graph.payload). Its URL on the
+    graph page carries the revision and the layout revision as ?v=, like
+    the image's. Positions not stored yet are laid out for the response
+    only; the render worker and the layout_graph command store them."""
+    format = 'json'
+    FORMATS = {'json': (layout_json, 'application/json; charset=utf-8'),
+               'binary': (layout_binary, 'application/octet-stream')}
+
+    def gzipped(self):
+        return 'gzip' in self.request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+    def get_validators(self, pk):
+        row = Graph.objects.filter(pk=pk).values_list('revision', 'layout_revision', 'updated_at').first()
+        if row is None:
+            return None
+        return revision_etag(pk, row[0], row[1], self.format, 'gzip' if self.gzipped() else ''), row[2]
+
+    def get(self, request, pk):
+        graph = get_object_or_404(Graph.objects.only('pk', 'revision', 'updated_at', 'layout', 'layout_revision'),
+                                  pk=pk)
+        build, content_type = self.FORMATS[self.format]
+        body = build(graph)
+        if self.gzipped():
+            response = HttpResponse(b''.join(gzip_chunks([body])), content_type=content_type)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(body, content_type=content_type)
+        response['Vary'] = 'Accept-Encoding'
+        if request.GET.get('v') == '%d.%d' % (graph.revision, graph.layout_revision):
+            response['Cache-Control'] = 'max-age=31536000, immutable'
+        return response
+
+
+class VertexDetailView(ConditionalGetMixin, DetailView):
     model = Vertex
     template_name = 'graph/vertex_detail.html'
     context_object_name = 'vertex'
 
+    def get_validators(self, pk):
+        # Names and edges of the whole graph show up here.
+        row = Vertex.objects.filter(pk=pk).values_list('graph__revision', 'graph__updated_at').first()
+        return None if row is None else (revision_etag(pk, row[0]), row[1])
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        incoming_edges = self.get_object().incoming_edges.all()
-        outcoming_edges = self.get_object().outcoming_edges.all()
+        incoming_edges = self.object.incoming_edges.select_related('source')
+        outcoming_edges = self.object.outcoming_edges.select_related('target')
         context['edges'] = zip_longest(incoming_edges, outcoming_edges)
+        context['requires'] = self.requires_page()
+        context['unlocks_count'] = self.object.descendant_links.count()
         return context
 
+    def requires_page(self):
+        # Nearest first, a page at a time: deep in a large graph most of it is above.
+        links = self.object.ancestor_links.select_related('ancestor')
+        try:
+            return KeysetPaginator(links, ('distance', 'ancestor_id'), TABLE_ROWS, 'requires_').page(self.request.GET)
+        except ValueError as e:
+            raise Http404(str(e))
+
+
+class VertexReachabilityView(View):
+    direction = 'ancestors'
+
+    def get(self, request, pk):
+        vertex = get_object_or_404(Vertex, pk=pk)
+        try:
+            backend = get_backend(request.GET.get('backend', 'closure'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        rows = getattr(backend, self.direction)(vertex.pk)
+        vertices = Vertex.objects.only('pk', 'VID', 'name').in_bulk([pk for pk, _ in rows])
+        return JsonResponse({'vertex': {'pk': vertex.pk, 'VID': vertex.VID, 'name': vertex.name},
+                             'backend': backend.name,
+                             self.direction: [{'pk': pk,
+                                               'VID': vertices[pk].VID,
+                                               'name': vertices[pk].name,
+                                               'distance': distance} for pk, distance in rows]},
+                            json_dumps_params={'ensure_ascii': False})
+
+
+class VertexNeighbourhoodView(ConditionalGetMixin, View):
+    """The subgraph within ?hops= of a vertex, at most ?max_nodes= vertices,
+    as JSON or in the binary format of the graph layout."""
+    format = 'json'
+
+    def params(self):
+        hops = int(self.request.GET.get('hops', DEFAULT_HOPS))
+        max_nodes = int(self.request.GET.get('max_nodes', DEFAULT_MAX_NODES))
+        if not 0 <= hops <= MAX_HOPS:
+            raise ValueError("hops must be between 0 and %d" % MAX_HOPS)
+        if not 1 <= max_nodes <= MAX_NODES:
+            raise ValueError("max_nodes must be between 1 and %d" % MAX_NODES)
+        return hops, max_nodes
+
+    def get_validators(self, pk):
+        self.row = Vertex.objects.filter(pk=pk).values_list('graph_id', 'graph__revision', 'graph__updated_at').first()
+        try:
+            params = self.params()
+        except ValueError:
+            return None
+        return None if self.row is None else (revision_etag(pk, self.row[1], *params, self.format), self.row[2])
+
+    def get(self, request, pk):
+        if self.row is None:
+            raise Http404("No vertex with this pk")
+        try:
+            hops, max_nodes = self.params()
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        graph_id, revision, updated_at = self.row
+        self.found = found = get_neighbourhood(graph_id, (revision, updated_at), pk, hops, max_nodes)
+        if found is None:
+            raise Http404("No vertex with this pk")
+        revision = found.snapshot.version[0]
+        if self.format == 'binary':
+            return HttpResponse(to_binary(found.snapshot, found.pos, revision), content_type='application/octet-stream')
+        return HttpResponse(to_json(found.snapshot, found.pos, vertex=pk, graph=graph_id, revision=revision, hops=hops,
+                                    max_nodes=max_nodes, truncated=found.truncated, distance=found.distance),
+                            content_type='application/json; charset=utf-8')
+
+    def get_response_validators(self, validators):
+        # The subgraph may come from a newer revision than the one read first.
+        found = getattr(self, 'found', None)
+        if found is None:
+            return validators
+        revision, updated_at = found.snapshot.version
+        return revision_etag(self.kwargs['pk'], revision, *self.params(), self.format), updated_at
+
 
 class AddEdgeView(CreateView):
     form_class = AddEdgeForm
@@ -185,49 +414,94 @@ class DeleteIncomingEdgeView(DeleteView):
         return reverse_lazy('detail_vertex', kwargs={'pk': self.target.pk})
 
 
-class GraphToJSONView(DetailView):
+class GraphToJSONView(ConditionalGetMixin, DetailView):
     model = Graph
     template_name = "graph/graph_to_JSON.html"
     context_object_name = "graph"
 
+    def get_validators(self, pk):
+        row = Graph.objects.filter(pk=pk).values_list('revision', 'updated_at').first()
+        return None if row is None else (revision_etag(pk, row[0]), row[1])
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        g = self.get_object()
+        g = self.object
+        vertices = list(g.vertex_set.values_list('pk', 'VID', 'name', 'description'))
+        vid_by_pk = {pk: vid for pk, vid, _, _ in vertices}
+        edges = Edge.objects.filter(source__graph=g).values_list('source_id', 'target_id', 'description')
         d = {'name': g.name,
              'description': g.description,
-             'vertexes': [{'VID': v.VID,
-                           'name': v.name,
-                           'description': v.description} for v in g.vertex_set.all()],
-             'edges': [{'source': e.source.VID,
-                        'target': e.target.VID,
-                        'description': e.description} for e in Edge.objects.filter(source__graph=g)]}
+             'vertexes': [{'VID': vid,
+                           'name': name,
+                           'description': description}
+                          for _, vid, name, description in vertices],
+             # An edge added after the vertices were read may point past them.
+             'edges': [{'source': vid_by_pk[source_id],
+                        'target': vid_by_pk[target_id],
+                        'description': description} for source_id, target_id, description in edges
+                       if source_id in vid_by_pk and target_id in vid_by_pk]}
         g_json = json.dumps(d, ensure_ascii=False)
         context['graph_json'] = g_json
         return context
 
 
+class GraphExportView(View):
+    def get(self, request, pk):
+        graph = get_object_or_404(Graph.objects.only('pk', 'name', 'description', 'revision', 'updated_at'), pk=pk)
+        etag = revision_etag(graph.pk, graph.revision)
+        timestamp = int(graph.updated_at.timestamp())
+        # A range of an older revision would not fit the client's part.
+        use_range = 'HTTP_RANGE' in request.META and \
+            request.META.get('HTTP_IF_RANGE', etag) in (etag, http_date(timestamp))
+        gzipped = not use_range and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if gzipped:
+            etag = revision_etag(graph.pk, graph.revision, 'gzip')
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is not None:
+            response['ETag'] = etag
+            return response
+        byte_range = None
+        if use_range:
+            # The document is generated on the fly, so its length is only known
+            # after a counting pass; that pass streams too and keeps memory flat.
+            length = sum(len(chunk) for chunk in iter_graph_json(graph))
+            try:
+                byte_range = parse_range(request.META['HTTP_RANGE'], length)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */%d' % length
+                return response
+        if byte_range is not None:
+            start, end = byte_range
+            response = StreamingHttpResponse(slice_chunks(iter_graph_json(graph), start, end), status=206)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, length)
+            response['Content-Length'] = end - start + 1
+        elif gzipped:
+            response = StreamingHttpResponse(gzip_chunks(iter_graph_json(graph)))
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = StreamingHttpResponse(iter_graph_json(graph))
+        response['Content-Type'] = 'application/json; charset=utf-8'
+        response['Content-Disposition'] = 'attachment; filename="graph-%d.json"' % graph.pk
+        response['Accept-Ranges'] = 'bytes'
+        response['Vary'] = 'Accept-Encoding'
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(timestamp)
+        return response
+
+
 class GraphFromJSONView(FormView):
     form_class = GraphFromJSONForm
     template_name = "graph/graph_from_JSON.html"
 
     def form_valid(self, form):
-        g_dict = json.loads(form.cleaned_data['text'])
-        if Graph.objects.filter(name=g_dict['name']).exists():
-            raise Http404("Graph with this name already exists!")
         try:
-            g = Graph.objects.create(name=g_dict['name'], description=g_dict['description'])
-            self.pk = g.pk
-            for v_dict in g_dict['vertexes']:
-                Vertex.objects.create(graph=g,
-                                      VID=v_dict['VID'],
-                                      name=v_dict['name'],
-                                      description=v_dict['description'])
-            for e_dict in g_dict['edges']:
-                Edge.objects.create(source=Vertex.objects.get(graph=g, VID=e_dict['source']),
-                                    target=Vertex.objects.get(graph=g, VID=e_dict['target']),
-                                    description=e_dict['description'])
-        except Exception:
+            g = import_graph(json.loads(form.cleaned_data['text']))
+        except GraphImportError as e:
+            raise Http404(str(e))
+        except ValueError:
             raise Http404("Can't make graph")
+        self.pk = g.pk
         return super(GraphFromJSONView, self).form_valid(form)
 
     def get_success_url(self):
@@ -239,38 +513,18 @@ class TopSortView(FormView):
     template_name = "graph/graph_topsort.html"
 
     def form_valid(self, form):
-        if Graph.objects.filter(name=form.cleaned_data['new_name']).exists():
-            raise Http404("Graph with this name already exists!")
-
-        old_g = Graph.objects.get(pk=self.kwargs['pk'])
-        new_g = Graph.objects.create(name=form.cleaned_data['new_name'],
-                                     description=old_g.description)
-        edges = Edge.objects.filter(source__graph=old_g)
-        d = {}
-        for vertex in old_g.vertex_set.all():
-            d[vertex.VID] = [edge.target.VID for edge in vertex.outcoming_edges.all()]
-        old_nxg = nx.DiGraph()
-        old_nxg.add_nodes_from(d.keys())
-        for k, v in d.items():
-            old_nxg.add_edges_from(([(k, t) for t in v]))
-
-        topsort_list = list(topological_sort(old_nxg))
-        for i, old_VID in enumerate(topsort_list):
-            Vertex.objects.create(graph=new_g,
-                                  VID=i + 1,
-                                  name=old_g.vertex_set.get(VID=old_VID).name,
-                                  description=old_g.vertex_set.get(VID=old_VID).description)
-        for edge in edges:
-            old_source_VID = edge.source.VID
-            old_target_VID = edge.target.VID
-            new_source_VID = topsort_list.index(old_source_VID) + 1
-            new_target_VID = topsort_list.index(old_target_VID) + 1
-            new_source = new_g.vertex_set.get(VID=new_source_VID)
-            new_target = new_g.vertex_set.get(VID=new_target_VID)
-            Edge.objects.create(source=new_source,
-                                target=new_target,
-                                description=edge.description)
-        self.pk = new_g.pk
+        old_g = get_object_or_404(Graph, pk=self.kwargs['pk'])
+        try:
+            if form.cleaned_data['in_place']:
+                topsort_in_place(old_g)
+                self.pk = old_g.pk
+            else:
+                if Graph.objects.filter(name=form.cleaned_data['new_name']).exists():
+                    raise Http404("Graph with this name already exists!")
+                self.pk = topsort_copy(old_g, form.cleaned_data['new_name']).pk
+        except GraphCycleError as e:
+            form.add_error(None, str(e))
+            return self.form_invalid(form)
 
         return super(TopSortView, self).form_valid(form)
 
@@ -283,10 +537,9 @@ class AddNullPointView(RedirectView):
 
     def get_redirect_url(self, *args, **kwargs):
         graph = get_object_or_404(Graph, pk=kwargs['pk'])
-        null_point = Vertex.objects.create(graph=graph,
-                                           VID=max(Vertex.objects.filter(graph=graph).values_list('VID', flat=True),
-                                                   default=0) + 1,
-                                           name="null-point")
-        for v in graph.vertex_set.all().annotate(in_count=Count('incoming_edges')).filter(in_count=0):
-            Edge.objects.create(source=null_point, target=v)
+        snapshot = get_snapshot(graph.pk, graph.version)
+        roots = [pk for pk, degree in zip(snapshot.pks, snapshot.in_degrees()) if degree == 0]
+        null_point = Vertex.objects.create(graph=graph, name="null-point")
+        Edge.objects.bulk_create([Edge(source=null_point, target_id=pk) for pk in roots])
+        graph_rebuilt.send(sender=Graph, graph_id=graph.pk)
         return super().get_redirect_url(*args, **kwargs)
@@ -0,0 +1,71 @@
+"""Reproducible synthetic data for benchmarks and load tests.
+
+The same arguments and seed always produce the same rows.
+"""
+import random
+
+from django.db import transaction
+
+from domain.models import Domain, Skill, Strategy, Action, Prerequisite, reserve_codes, domain_rebuilt
+from graph.importer import import_graph
+
+
+def random_dag_dict(vertices, degree=2, component_size=100, seed=0):
+    """JSON dict of a random DAG with VIDs 1..vertices.
+
+    Every vertex gets up to degree predecessors among the earlier vertices
+    of its component. Components keep the transitive-closure index linear
+    in the number of vertices (it grows with component_size squared per
+    component).
+    """
+    rnd = random.Random(seed)
+    edges = []
+    for vid in range(1, vertices + 1):
+        first = vid - (vid - 1) % component_size
+        candidates = range(first, vid)
+        for source in rnd.sample(candidates, min(degree, len(candidates))):
+            edges.append({'source': source, 'target': vid})
+    return {'name': 'dag-%d' % vertices,
+            'description': 'Synthetic DAG: %d vertices, seed %d' % (vertices, seed),
+            'vertexes': [{'VID': vid, 'name': 'skill %d' % vid} for vid in range(1, vertices + 1)],
+            'edges': edges}
+
+
+def random_dag(vertices, degree=2, component_size=100, seed=0, name=None):
+    return import_graph(random_dag_dict(vertices, degree, component_size, seed), name=name)
+
+
+def domain_tree(skills, strategies, actions, prerequisites=2, seed=0, name=None, batch_size=1000):
+    """A domain with skills x strategies x actions rows.
+
+    Each action requires up to prerequisites random strategies created
+    before its own, so the prerequisite graph is acyclic.
+    """
+    rnd = random.Random(seed)
+    with transaction.atomic():
+        domain = Domain.objects.create(name=name or 'domain-%dx%dx%d' % (skills, strategies, actions),
+                                       description='Synthetic domain, seed %d' % seed)
+        codes = reserve_codes(Skill, domain.pk, skills)
+        Skill.objects.bulk_create([Skill(domain=domain, code=code, name='skill %d' % code) for code in codes],
+                                  batch_size=batch_size)
+        # The skills and strategies are new, so their counters do not exist
+        # yet and will be seeded from the codes written here.
+        skill_pks = domain.skill_set.filter(code__in=codes).order_by('code').values_list('pk', flat=True)
+        Strategy.objects.bulk_create([Strategy(skill_goal_id=skill_pk, code=code, name='strategy %d.%d' % (i, code))
+                                      for i, skill_pk in enumerate(skill_pks, 1)
+                                      for code in range(1, strategies + 1)], batch_size=batch_size)
+        strategy_pks = list(Strategy.objects.filter(skill_goal__domain=domain)
+                            .order_by('skill_goal__code', 'code').values_list('pk', flat=True))
+        Action.objects.bulk_create([Action(strategy_id=strategy_pk, order=order, description='step %d' % order)
+                                    for strategy_pk in strategy_pks
+                                    for order in range(1, actions + 1)], batch_size=batch_size)
+        position = {pk: i for i, pk in enumerate(strategy_pks)}
+        links = []
+        for action_pk, strategy_pk in Action.objects.filter(strategy__skill_goal__domain=domain) \
+                .order_by('pk').values_list('pk', 'strategy_id'):
+            earlier = range(position[strategy_pk])
+            for i in rnd.sample(earlier, min(prerequisites, len(earlier))):
+                links.append(Prerequisite(action_id=action_pk, strategy_id=strategy_pks[i]))
+        Prerequisite.objects.bulk_create(links, batch_size=batch_size)
+        domain_rebuilt.send(sender=Domain, domain_id=domain.pk)
+    return domain
@@ -0,0 +1,224 @@
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+from django.urls import reverse
+
+import domain.urls
+import graph.urls
+from domain.models import Strategy
+from graph.models import Edge
+from perf.datasets import random_dag, domain_tree
+from perf.queries import record_queries
+
+# GET views that write; measured once, after everything else.
+MUTATING = {'graph_add_nullpoint'}
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def _consume(response):
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _route_kwargs(pattern, ids):
+    """kwargs for a URL pattern of the graph or domain app, or None if the
+    dataset has nothing to pass."""
+    names = set(pattern.pattern.converters)
+    if not names:
+        return {}
+    route = str(pattern.pattern)
+    if names == {'pk'}:
+        key = 'edge' if route.startswith('vertex/delete') else route.split('/')[0]
+        return {'pk': ids[key]} if key in ids else None
+    if names <= set(ids):
+        return {name: ids[name] for name in names}
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Time every graph and domain page on reproducible synthetic data (uses a test database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=_int_list, default=[100, 1000, 10000],
+                            help='Comma-separated vertex counts of the random DAGs, e.g. 100,1000,10000,50000')
+        parser.add_argument('--degree', type=int, default=2, help='Predecessors per DAG vertex')
+        parser.add_argument('--component-size', type=int, default=100,
+                            help='Vertices per connected component of the DAGs')
+        parser.add_argument('--domain', type=_int_list, default=[50, 20, 3],
+                            help='Skills, strategies per skill and actions per strategy of the domain tree')
+        parser.add_argument('--prerequisites', type=int, default=2, help='Prerequisite links per action')
+        parser.add_argument('--render-limit', type=int, default=100,
+                            help='Also time Graph.create_image for DAGs up to this many vertices')
+        parser.add_argument('--repeat', type=int, default=5, help='Warm requests per URL')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON here instead of stdout')
+        parser.add_argument('--baseline', help='Earlier JSON output to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Relative slowdown of the warm median reported as a regression')
+
+    def handle(self, *args, **options):
+        if len(options['domain']) != 3:
+            raise CommandError('--domain needs three numbers: skills,strategies,actions')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+        logging.getLogger('perf').setLevel(logging.ERROR)
+        runner = DiscoverRunner(interactive=False, verbosity=0)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+                report = self.run(options)
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if baseline is not None:
+            self.compare(baseline, report, options['tolerance'])
+
+    def run(self, options):
+        datasets = []
+        for size in options['sizes']:
+            start = time.perf_counter()
+            g = random_dag(size, options['degree'], options['component_size'], options['seed'])
+            vertex = g.vertex_set.get(VID=max(1, size // 2))
+            edge = Edge.objects.filter(target=vertex).first() or Edge.objects.filter(source__graph=g).first()
+            ids = {'graph': g.pk, 'vertex': vertex.pk}
+            if edge is not None:
+                ids['edge'] = edge.pk
+            datasets.append(('dag-%d' % size, ids, g if size <= options['render_limit'] else None,
+                             time.perf_counter() - start))
+        skills, strategies, actions = options['domain']
+        start = time.perf_counter()
+        d = domain_tree(skills, strategies, actions, options['prerequisites'], options['seed'])
+        strategy = Strategy.objects.select_related('skill_goal').filter(skill_goal__domain=d) \
+            .order_by('skill_goal__code', 'code').last()
+        ids = {'domain_code': d.code, 'skill_code': strategy.skill_goal.code, 'strategy_code': strategy.code}
+        datasets.append(('domain-%dx%dx%d' % (skills, strategies, actions), ids, None, time.perf_counter() - start))
+
+        client = Client()
+        patterns = [p for p in graph.urls.urlpatterns + domain.urls.urlpatterns if p.name]
+        results = []
+        mutating = []
+        for name, ids, rendered, _ in datasets:
+            for pattern in patterns:
+                kwargs = _route_kwargs(pattern, ids)
+                if not kwargs:
+                    continue
+                if pattern.name in MUTATING:
+                    mutating.append((name, pattern.name, kwargs))
+                    continue
+                results.append(self.measure(client, name, pattern.name, kwargs, options['repeat']))
+            if rendered is not None:
+                results.append(self.measure_render(name, rendered))
+        for pattern in patterns:
+            if not pattern.pattern.converters:
+                results.append(self.measure(client, 'all', pattern.name, {}, options['repeat']))
+        for name, url_name, kwargs in mutating:
+            results.append(self.measure(client, name, url_name, kwargs, 0))
+
+        return {
+            'meta': {
+                'commit': _git_commit(),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'options': {k: options[k] for k in ('sizes', 'degree', 'component_size', 'domain',
+                                                     'prerequisites', 'render_limit', 'repeat', 'seed')},
+            },
+            'datasets': {name: {'setup_s': round(setup, 3)} for name, _, _, setup in datasets},
+            'results': results,
+        }
+
+    def measure(self, client, dataset, url_name, kwargs, repeat):
+        path = reverse(url_name, kwargs=kwargs)
+        # Cold: first request, caches empty for this page.
+        start = time.perf_counter()
+        with record_queries() as recorder:
+            response = _consume(client.get(path))
+        cold = time.perf_counter() - start
+        result = {'dataset': dataset, 'url_name': url_name, 'path': path, 'status': response.status_code,
+                  'queries': recorder.count, 'query_ms': round(recorder.duration * 1000, 3),
+                  'repeated_queries': len(recorder.repeated(settings.PERF_REPEATED_QUERY_THRESHOLD)),
+                  'cold_ms': round(cold * 1000, 3)}
+        if repeat:
+            tracemalloc.start()
+            _consume(client.get(path))
+            result['peak_kib'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+            tracemalloc.stop()
+            result['warm_ms'] = self.timings(lambda: _consume(client.get(path)), repeat)
+        return result
+
+    def measure_render(self, dataset, g):
+        start = time.perf_counter()
+        with record_queries() as recorder:
+            g.create_image(force=True)
+        result = {'dataset': dataset, 'url_name': 'Graph.create_image', 'path': None, 'status': None,
+                  'queries': recorder.count, 'query_ms': round(recorder.duration * 1000, 3),
+                  'repeated_queries': 0, 'cold_ms': round((time.perf_counter() - start) * 1000, 3)}
+        tracemalloc.start()
+        g.create_image(force=True)
+        result['peak_kib'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+        return result
+
+    @staticmethod
+    def timings(func, repeat):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append((time.perf_counter() - start) * 1000)
+        return {'min': round(min(times), 3), 'median': round(statistics.median(times), 3),
+                'max': round(max(times), 3)}
+
+    def compare(self, baseline, report, tolerance):
+        before = {(r['dataset'], r['url_name']): r for r in baseline['results']}
+        regressions = 0
+        for r in report['results']:
+            old = before.get((r['dataset'], r['url_name']))
+            if old is None:
+                continue
+            notes = []
+            if r['queries'] > old['queries']:
+                notes.append('queries %d -> %d' % (old['queries'], r['queries']))
+            if 'warm_ms' in r and 'warm_ms' in old and \
+                    r['warm_ms']['median'] > old['warm_ms']['median'] * (1 + tolerance):
+                notes.append('median %.1fms -> %.1fms' % (old['warm_ms']['median'], r['warm_ms']['median']))
+            if notes:
+                regressions += 1
+                self.stderr.write('%s %s: %s' % (r['dataset'], r['url_name'], ', '.join(notes)))
+        self.stderr.write('%d regression(s) against %s' % (regressions, baseline['meta'].get('commit')))
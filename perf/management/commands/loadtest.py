@@ -0,0 +1,284 @@
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.signals import got_request_exception
+from django.db import connection, connections
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from graph.models import RenderJob
+from perf.datasets import random_dag
+
+# view_graph is the graph page with the image rendered on the server,
+# view_canvas the default page and the layout payload it draws from.
+MIXES = {
+    'read': {'view_graph': 3, 'view_canvas': 2, 'view_vertex': 4, 'export': 1},
+    'edit': {'add_vertex': 4, 'add_edge': 4, 'view_graph': 2},
+    'mixed': {'view_graph': 3, 'view_canvas': 1, 'view_vertex': 3, 'add_vertex': 2, 'add_edge': 2, 'export': 1},
+    # Clients that pick the next VID themselves, as the old forms did.
+    'racy': {'add_vertex_vid': 4, 'add_edge': 2, 'view_graph': 2},
+}
+
+
+def _mix(value):
+    if value in MIXES:
+        return MIXES[value]
+    try:
+        mix = {name: float(weight) for name, weight in (item.split('=') for item in value.split(','))}
+    except ValueError:
+        raise ValueError('Mix must be one of %s or name=weight,...' % ', '.join(MIXES))
+    unknown = set(mix) - set(Client.SCENARIOS)
+    if unknown:
+        raise ValueError('Unknown scenarios: %s' % ', '.join(sorted(unknown)))
+    return mix
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def classify_exception(exc):
+    text = str(exc)
+    name = type(exc).__name__
+    if name == 'IntegrityError' and 'VID' in text:
+        return 'duplicate_vid'
+    if isinstance(exc, OSError) and 'graphs' in text:
+        return 'file_race'
+    if name == 'OperationalError' and 'locked' in text:
+        return 'database_locked'
+    return name
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Client:
+    """One simulated user: its own HTTP connection and CSRF cookie."""
+
+    SCENARIOS = ('view_graph', 'view_canvas', 'view_vertex', 'export', 'add_vertex', 'add_vertex_vid', 'add_edge')
+
+    def __init__(self, port, graph_id, rnd):
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.graph_id = graph_id
+        self.rnd = rnd
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join('%s=%s' % item for item in self.cookies.items())
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            headers['X-CSRFToken'] = self.cookies.get('csrftoken', '')
+        self.conn.request(method, path, body=body, headers=headers)
+        response = self.conn.getresponse()
+        content = response.read()
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response.status, content
+
+    def run(self, scenario, pks):
+        """Perform one scenario; returns (status, error class or None)."""
+        g = self.graph_id
+        if scenario == 'view_graph':
+            status, _ = self.request('GET', reverse('detail_graph', args=(g,)) + '?mode=image')
+            return status, None if status == 200 else 'status_%d' % status
+        if scenario == 'view_canvas':
+            status, _ = self.request('GET', reverse('detail_graph', args=(g,)))
+            if status == 200:
+                status, _ = self.request('GET', reverse('graph_layout_binary', args=(g,)))
+            return status, None if status == 200 else 'status_%d' % status
+        if scenario == 'view_vertex':
+            status, _ = self.request('GET', reverse('detail_vertex', args=(self.rnd.choice(pks),)))
+            return status, None if status == 200 else 'status_%d' % status
+        if scenario == 'export':
+            status, _ = self.request('GET', reverse('graph_export_json', args=(g,)))
+            return status, None if status == 200 else 'status_%d' % status
+        if 'csrftoken' not in self.cookies:
+            self.request('GET', reverse('add_vertex', args=(g,)))
+        if scenario in ('add_vertex', 'add_vertex_vid'):
+            data = {'graph': g, 'name': 'load %d' % self.rnd.randrange(10 ** 9), 'VID': ''}
+            if scenario == 'add_vertex_vid':
+                data['VID'] = self.next_vid()
+            status, content = self.request('POST', reverse('add_vertex', args=(g,)), data)
+            if status == 302:
+                return status, None
+            if status == 200 and b'already exists' in content:
+                return status, 'duplicate_vid'
+            return status, 'status_%d' % status
+        if scenario == 'add_edge':
+            # Lower pk -> higher pk never closes a cycle.
+            source, target = sorted(self.rnd.sample(pks, 2))
+            status, content = self.request('POST', reverse('add_edge', args=(g,)),
+                                           {'source': source, 'target': target, 'description': ''})
+            return status, None if status == 302 else 'status_%d' % status
+        raise ValueError(scenario)
+
+    def next_vid(self):
+        status, content = self.request('GET', reverse('graph_export_json', args=(self.graph_id,)))
+        return 1 + max((v['VID'] for v in json.loads(content).get('vertexes', [])), default=0) \
+            if status == 200 and content.startswith(b'{') else 1
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent read/write traffic against an in-process server (uses a test database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mix', default='mixed',
+                            help='One of %s, or scenario=weight,... with scenarios %s'
+                                 % (', '.join(MIXES), ', '.join(Client.SCENARIOS)))
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent client threads')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of traffic')
+        parser.add_argument('--size', type=int, default=200, help='Vertices of the graph under load')
+        parser.add_argument('--sync-render', action='store_true',
+                            help='Render the graph image inside GraphDetailView instead of a queue')
+        parser.add_argument('--render-workers', type=int, default=1,
+                            help='Background render threads when rendering is queued')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', help='Also write the report as JSON to this file')
+
+    def handle(self, *args, **options):
+        try:
+            options['mix'] = _mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(e)
+        runner = DiscoverRunner(interactive=False, verbosity=0)
+        runner.setup_test_environment()
+        with tempfile.TemporaryDirectory() as tmp:
+            if connection.vendor == 'sqlite':
+                # An on-disk test database: server threads then use real
+                # connections with file locking, not one shared in-memory cache.
+                connection.settings_dict['TEST']['NAME'] = os.path.join(tmp, 'loadtest.sqlite3')
+            old_config = runner.setup_databases()
+            try:
+                with override_settings(GRAPH_RENDER_ASYNC=not options['sync_render'], MEDIA_ROOT=tmp):
+                    report = self.run(options)
+            finally:
+                runner.teardown_databases(old_config)
+                runner.teardown_test_environment()
+        self.print_report(report)
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+
+    def run(self, options):
+        g = random_dag(options['size'], seed=options['seed'], name='loadtest')
+        exceptions = Counter()
+        lock = threading.Lock()
+
+        def on_exception(sender, request=None, **kwargs):
+            exc = sys.exc_info()[1]
+            if exc is not None:
+                with lock:
+                    exceptions[classify_exception(exc)] += 1
+
+        got_request_exception.connect(on_exception)
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=False)
+        server.daemon_threads = True
+        server.set_app(WSGIHandler())
+        serving = threading.Thread(target=server.serve_forever, daemon=True)
+        serving.start()
+        port = server.server_address[1]
+
+        stop = threading.Event()
+        samples = defaultdict(list)
+        errors = defaultdict(Counter)
+        names = list(options['mix'])
+        weights = [options['mix'][name] for name in names]
+        pks = list(g.vertex_set.values_list('pk', flat=True))
+
+        def worker(n):
+            rnd = random.Random(options['seed'] * 1000 + n)
+            client = Client(port, g.pk, rnd)
+            while not stop.is_set():
+                scenario = rnd.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    status, error = client.run(scenario, pks)
+                except (OSError, http.client.HTTPException) as e:
+                    error = 'connection_%s' % type(e).__name__
+                    client = Client(port, g.pk, rnd)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    samples[scenario].append(elapsed)
+                    if error:
+                        errors[scenario][error] += 1
+            connections.close_all()
+
+        def render_worker():
+            while not stop.is_set():
+                if RenderJob.run_next() is None:
+                    stop.wait(0.2)
+            connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(options['workers'])]
+        if not options['sync_render']:
+            threads += [threading.Thread(target=render_worker) for _ in range(options['render_workers'])]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        stop.wait(options['duration'])
+        stop.set()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        server.shutdown()
+        server.server_close()
+        got_request_exception.disconnect(on_exception)
+
+        vids = list(g.vertex_set.values_list('VID', flat=True))
+        images = os.path.join(settings.MEDIA_ROOT, 'graphs')
+        report = {'options': {k: options[k] for k in ('mix', 'workers', 'duration', 'size', 'sync_render',
+                                                       'render_workers', 'seed')},
+                  'elapsed_s': round(elapsed, 3),
+                  'database': connection.vendor,
+                  'endpoints': {},
+                  'server_exceptions': dict(exceptions),
+                  'checks': {'vertices': len(vids),
+                             'duplicate_vids': len(vids) - len(set(vids)),
+                             'image_files': len([f for f in os.listdir(images) if f.startswith('loadtest')])
+                             if os.path.isdir(images) else 0}}
+        for scenario, times in sorted(samples.items()):
+            times.sort()
+            report['endpoints'][scenario] = {
+                'requests': len(times),
+                'throughput_rps': round(len(times) / elapsed, 2),
+                'p50_ms': round(percentile(times, 50) * 1000, 2),
+                'p95_ms': round(percentile(times, 95) * 1000, 2),
+                'p99_ms': round(percentile(times, 99) * 1000, 2),
+                'max_ms': round(times[-1] * 1000, 2),
+                'errors': dict(errors[scenario]),
+            }
+        return report
+
+    def print_report(self, report):
+        self.stdout.write('%-16s %8s %8s %9s %9s %9s  %s' % ('scenario', 'requests', 'req/s', 'p50 ms',
+                                                           'p95 ms', 'p99 ms', 'errors'))
+        for scenario, row in report['endpoints'].items():
+            self.stdout.write('%-16s %8d %8.1f %9.1f %9.1f %9.1f  %s' % (
+                scenario, row['requests'], row['throughput_rps'], row['p50_ms'], row['p95_ms'], row['p99_ms'],
+                ', '.join('%s=%d' % item for item in row['errors'].items()) or '-'))
+        self.stdout.write('server exceptions: %s' % (', '.join(
+            '%s=%d' % item for item in report['server_exceptions'].items()) or '-'))
+        self.stdout.write('checks: %s' % ', '.join('%s=%d' % item for item in report['checks'].items()))
@@ -0,0 +1,115 @@
+import cProfile
+import io
+import logging
+import pstats
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from perf import stats
+from perf.queries import record_queries
+from perf.timing import collect, current
+
+logger = logging.getLogger('perf')
+
+
+class ServerTimingMiddleware:
+    """Feeds per-request timings to perf.stats and, with DEBUG on or for
+    staff (as perf.views.StatsView), sends them as a Server-Timing header.
+    With DEBUG off the session and user are not looked up for this alone:
+    staff get the header when the request loaded its user anyway, or when
+    they ask for it with ?timing=1.
+
+    Phases: spans opened with perf.timing.span() during the request (such
+    as the stages of Graph.create_image), db (all queries, including those
+    run while rendering the template), template and total. Streaming
+    bodies are produced after the headers are sent and are not included.
+    The query recorder is left on the request as request.queries for
+    QueryCountMiddleware, so queries are wrapped only once.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with collect() as timings, record_queries() as recorder:
+            request.queries = recorder
+            response = self.get_response(request)
+        timings.add('db', recorder.duration, recorder.count)
+        timings.add('total', time.perf_counter() - start)
+        match = request.resolver_match
+        stats.record(match.view_name if match else 'unresolved', timings)
+        if settings.DEBUG or self.for_staff(request):
+            response['Server-Timing'] = timings.header()
+        return response
+
+    @staticmethod
+    def for_staff(request):
+        user = getattr(request, 'user', None)
+        # AuthenticationMiddleware caches the user once something used it.
+        if user is None or not (hasattr(request, '_cached_user') or request.GET.get('timing')):
+            return False
+        return user.is_staff
+
+    def process_template_response(self, request, response):
+        timings = current()
+        if timings is not None:
+            start = time.perf_counter()
+            response.add_post_render_callback(lambda r: timings.add('template', time.perf_counter() - start))
+        return response
+
+
+class ProfileMiddleware:
+    """With DEBUG on, ?profile=1 answers with a cProfile report of the
+    request instead of the page; ?sort= picks the pstats order."""
+
+    SORT_KEYS = ('cumulative', 'tottime', 'calls')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not (settings.DEBUG and request.GET.get('profile')):
+            return self.get_response(request)
+        sort = request.GET.get('sort')
+        profiler = cProfile.Profile()
+        response = profiler.runcall(self.get_response, request)
+        if response.streaming:
+            profiler.runcall(lambda: [chunk for chunk in response.streaming_content])
+        out = io.StringIO()
+        out.write('%s %s -> %d\n\n' % (request.method, request.get_full_path(), response.status_code))
+        pstats.Stats(profiler, stream=out).sort_stats(sort if sort in self.SORT_KEYS else 'cumulative') \
+            .print_stats(settings.PERF_PROFILE_LINES)
+        return HttpResponse(out.getvalue(), content_type='text/plain; charset=utf-8')
+
+
+class QueryCountMiddleware:
+    """Counts the queries of every request and warns about N+1 patterns.
+
+    A SQL shape repeated PERF_REPEATED_QUERY_THRESHOLD times or more in one
+    request is logged as a warning. With DEBUG on, the count and the time
+    spent in the database are also sent as X-Query-Count / X-Query-Time
+    headers. Queries run while a streaming response is consumed happen
+    after the view returns and are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = getattr(request, 'queries', None)
+        if recorder is not None:
+            # Counted by ServerTimingMiddleware further out; nothing runs
+            # in between but the profiler.
+            response = self.get_response(request)
+        else:
+            with record_queries() as recorder:
+                response = self.get_response(request)
+        for shape, n in recorder.repeated(settings.PERF_REPEATED_QUERY_THRESHOLD):
+            logger.warning("%s %s: query repeated %d times: %s", request.method, request.path, n, shape)
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(recorder.count)
+            response['X-Query-Time'] = '%.1fms' % (recorder.duration * 1000)
+        return response
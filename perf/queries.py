@@ -0,0 +1,46 @@
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager, ExitStack
+
+from django.db import connections
+
+_PARAM_LIST = re.compile(r'%s(?:, %s)+')
+
+
+def sql_shape(sql):
+    """sql with parameter lists of any length collapsed, so that the same
+    query issued for different rows or batches counts as one shape."""
+    return _PARAM_LIST.sub('%s, ...', sql)
+
+
+class QueryRecorder:
+    """execute_wrapper that counts queries, their total time and shapes."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.shapes[sql_shape(sql)] += 1
+
+    def repeated(self, threshold):
+        """(shape, times) of every shape issued at least threshold times."""
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+
+@contextmanager
+def record_queries(recorder=None, using=None):
+    """Record the queries run in this thread on one or all connections."""
+    recorder = recorder if recorder is not None else QueryRecorder()
+    with ExitStack() as stack:
+        for alias in [using] if using else connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        yield recorder
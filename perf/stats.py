@@ -0,0 +1,55 @@
+import threading
+from bisect import bisect_left
+from collections import deque, defaultdict
+
+from django.conf import settings
+
+# Upper bounds of the histogram buckets in milliseconds; the last bucket is open.
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+_lock = threading.Lock()
+_samples = defaultdict(deque)  # view -> deque of {phase: ms}
+
+
+def record(view, timings):
+    sample = {name: total * 1000 for name, (total, _) in timings.spans.items()}
+    with _lock:
+        samples = _samples[view]
+        samples.append(sample)
+        while len(samples) > settings.PERF_STATS_SAMPLES:
+            samples.popleft()
+
+
+def _summary(values):
+    values = sorted(values)
+    counts = [0] * (len(BUCKETS_MS) + 1)
+    for v in values:
+        counts[bisect_left(BUCKETS_MS, v)] += 1
+    return {
+        'count': len(values),
+        'p50': round(values[len(values) // 2], 2),
+        'p95': round(values[min(len(values) - 1, len(values) * 95 // 100)], 2),
+        'max': round(values[-1], 2),
+        'histogram': {('<=%d' % b if i < len(BUCKETS_MS) else '>%d' % BUCKETS_MS[-1]): n
+                      for i, (b, n) in enumerate(zip(BUCKETS_MS + (None,), counts)) if n},
+    }
+
+
+def snapshot():
+    """Per view and phase: count, p50, p95, max and a histogram (ms) over the
+    last PERF_STATS_SAMPLES requests of that view."""
+    with _lock:
+        copied = {view: list(samples) for view, samples in _samples.items()}
+    result = {}
+    for view, samples in sorted(copied.items()):
+        phases = defaultdict(list)
+        for sample in samples:
+            for name, ms in sample.items():
+                phases[name].append(ms)
+        result[view] = {name: _summary(values) for name, values in phases.items()}
+    return result
+
+
+def reset():
+    with _lock:
+        _samples.clear()
@@ -0,0 +1,18 @@
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS
+
+from perf.queries import record_queries
+
+
+class QueryBudgetMixin:
+    """TestCase mixin: assertMaxQueries(budget) fails when the block runs
+    more than budget queries, naming the shapes that were repeated."""
+
+    @contextmanager
+    def assertMaxQueries(self, budget, using=DEFAULT_DB_ALIAS):
+        with record_queries(using=using) as recorder:
+            yield recorder
+        if recorder.count > budget:
+            repeated = ''.join('\n  %dx %s' % (n, shape) for shape, n in recorder.repeated(2))
+            self.fail("%d queries executed, budget is %d%s" % (recorder.count, budget, repeated))
@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from graph.models import Graph
+
+
+class MiddlewareTests(TestCase):
+    def setUp(self):
+        Graph.objects.create(name='g')
+
+    def test_server_timing_is_internal(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('graphs')))
+        self.client.force_login(User.objects.create(username='user'))
+        self.assertNotIn('Server-Timing', self.client.get(reverse('graphs'), {'timing': 1}))
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+        # A page that never looks at the user does not load it for the header...
+        with self.assertNumQueries(1):
+            self.assertNotIn('Server-Timing', self.client.get(reverse('graphs')))
+        # ...unless asked to, or when the view loaded it anyway.
+        self.assertIn('db;dur=', self.client.get(reverse('graphs'), {'timing': 1})['Server-Timing'])
+        self.assertIn('Server-Timing', self.client.get(reverse('perf_stats')))
+
+    @override_settings(DEBUG=True)
+    def test_one_recorder(self):
+        response = self.client.get(reverse('graphs'))
+        self.assertIn('total;dur=', response['Server-Timing'])
+        # Both middlewares report the queries of the one recorder.
+        self.assertEqual(response.wsgi_request.queries.count, int(response['X-Query-Count']))
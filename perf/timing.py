@@ -0,0 +1,48 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar('perf_timings', default=None)
+
+
+class Timings:
+    """Named durations collected during one request, in insertion order."""
+
+    def __init__(self):
+        self.spans = {}
+
+    def add(self, name, duration, count=1):
+        total, n = self.spans.get(name, (0.0, 0))
+        self.spans[name] = (total + duration, n + count)
+
+    def header(self):
+        """Server-Timing header value; durations in milliseconds."""
+        return ', '.join('%s;dur=%.1f' % (name, total * 1000) for name, (total, _) in self.spans.items())
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def collect():
+    timings = Timings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name):
+    """Time the block into the current request's timings, if any."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import JsonResponse
+from django.views.generic import View
+
+from perf import stats
+
+
+class StatsView(View):
+    """Rolling per-view timing histograms of this process (DEBUG or staff only)."""
+
+    def get(self, request):
+        if not (settings.DEBUG or request.user.is_staff):
+            raise PermissionDenied
+        if request.GET.get('reset'):
+            stats.reset()
+        return JsonResponse({'samples_per_view': settings.PERF_STATS_SAMPLES,
+                             'buckets_ms': stats.BUCKETS_MS,
+                             'views': stats.snapshot()})
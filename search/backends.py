@@ -0,0 +1,173 @@
+"""Interchangeable full-text search backends.
+
+Every backend takes the same query and returns the same shape: a list of
+SearchDocument instances, best match first, each with a score (higher is
+better). All words of the query must match, each as a prefix, so that
+results appear while a word is still being typed.
+
+    postgres -- the generated tsvector column and its GIN index (migration 0002)
+    fts5     -- the FTS5 table the triggers of migration 0002 keep in sync (SQLite)
+    like     -- substring filters, for databases without either
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from search.models import SearchDocument
+
+# More words hardly narrow a result down but make every index probe slower.
+MAX_TERMS = 8
+
+FTS_TABLE = 'search_searchdocument_fts'
+
+
+def query_terms(q):
+    """Lower-cased words of q, split like the FTS5 tokenizer does, without
+    any punctuation of a query syntax."""
+    return re.findall(r'[^\W_]+', q.lower())[:MAX_TERMS]
+
+
+def _filters(kind, scope):
+    where, params = [], []
+    if kind:
+        where.append('d.kind = %s')
+        params.append(kind)
+    if scope:
+        where.append('d.scope = %s')
+        params.append(scope)
+    return ''.join(' AND ' + w for w in where), params
+
+
+def _tsquery_literal(lexeme):
+    return "'%s'" % lexeme.replace('\\', '\\\\').replace("'", "''")
+
+
+class PostgresBackend:
+    name = 'postgres'
+
+    # Title words weigh more than body words (setweight A and B). kind and
+    # scope are lexemes of the vector too, so that the GIN index applies
+    # them along with the words; ts_rank_cd ignores them, as they have no
+    # positions. Every match is ranked, so that the best ones come first
+    # however many documents contain a word.
+    SQL = '''
+        SELECT d.*, ts_rank_cd(d.search_vector, to_tsquery('simple', %s)) AS score
+        FROM search_searchdocument d
+        WHERE d.search_vector @@ (to_tsquery('simple', %s){filters})
+        ORDER BY score DESC, d.id
+        LIMIT %s OFFSET %s
+    '''
+
+    def search(self, q, kind=None, scope=None, offset=0, limit=20):
+        if not query_terms(q):
+            return []
+        # Quoted words go through the same parser as the indexed text, so
+        # "3.14" or "e-mail" match as they were indexed.
+        query = ' & '.join(_tsquery_literal(word) + ':*' for word in q.split()[:MAX_TERMS])
+        filters = [_tsquery_literal('%s:%s' % (name, value))
+                   for name, value in (('kind', kind), ('scope', scope)) if value]
+        sql = self.SQL.format(filters=' && %s::tsquery' * len(filters))
+        return list(SearchDocument.objects.raw(sql, [query, query] + filters + [limit, offset]))
+
+
+class FTS5Backend:
+    name = 'fts5'
+
+    # bm25() is lower for better matches; title words weigh ten times more.
+    # CROSS JOIN keeps SQLite from walking the kind or scope index and
+    # probing the FTS table once per row. Every match is ranked.
+    SQL = '''
+        SELECT d.*, -bm25(search_searchdocument_fts, 10.0, 1.0) AS score
+        FROM search_searchdocument_fts CROSS JOIN search_searchdocument d
+            ON d.id = search_searchdocument_fts.rowid
+        WHERE search_searchdocument_fts MATCH %s{filters}
+        ORDER BY score DESC, d.id
+        LIMIT %s OFFSET %s
+    '''
+
+    def search(self, q, kind=None, scope=None, offset=0, limit=20):
+        terms = query_terms(q)
+        if not terms:
+            return []
+        filters, params = _filters(kind, scope)
+        query = ' '.join('"%s"*' % term for term in terms)
+        return list(SearchDocument.objects.raw(self.SQL.format(filters=filters),
+                                               [query] + params + [limit, offset]))
+
+
+class LikeBackend:
+    name = 'like'
+
+    def search(self, q, kind=None, scope=None, offset=0, limit=20):
+        terms = query_terms(q)
+        if not terms:
+            return []
+        documents = SearchDocument.objects.all()
+        for term in terms:
+            documents = documents.filter(Q(title__icontains=term) | Q(body__icontains=term))
+        if kind:
+            documents = documents.filter(kind=kind)
+        if scope:
+            documents = documents.filter(scope=scope)
+        results = list(documents.order_by('title', 'pk')[offset:offset + limit])
+        for document in results:
+            document.score = None
+        return results
+
+
+BACKENDS = {backend.name: backend for backend in (PostgresBackend, FTS5Backend, LikeBackend)}
+
+
+_fts5 = {}
+
+
+def has_fts5():
+    """Whether migration 0002 created the FTS5 table; asked once per database."""
+    key = (connection.alias, connection.settings_dict['NAME'])
+    if key not in _fts5:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            _fts5[key] = cursor.fetchone() is not None
+    return _fts5[key]
+
+
+def get_backend(name=None):
+    """Backend by name; 'auto' or None picks postgres on PostgreSQL, fts5
+    on SQLite when its table exists and like elsewhere."""
+    if name in (None, '', 'auto'):
+        if connection.vendor == 'postgresql':
+            name = 'postgres'
+        elif connection.vendor == 'sqlite' and has_fts5():
+            name = 'fts5'
+        else:
+            name = 'like'
+    if name == 'postgres' and connection.vendor != 'postgresql':
+        raise ValueError('The postgres backend needs PostgreSQL')
+    if name == 'fts5' and (connection.vendor != 'sqlite' or not has_fts5()):
+        raise ValueError('The fts5 backend needs SQLite with FTS5')
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError('Unknown search backend: %s' % name)
+
+
+class Page:
+    """One page of results; has_next is known from fetching one row more."""
+    __slots__ = ('number', 'results', 'has_next')
+
+    def __init__(self, number, results, has_next):
+        self.number = number
+        self.results = results
+        self.has_next = has_next
+
+    @property
+    def has_previous(self):
+        return self.number > 1
+
+
+def search(q, kind=None, scope=None, page=1, per_page=20, backend=None):
+    """Page number page of the results for q, without counting them all."""
+    results = get_backend(backend).search(q, kind=kind, scope=scope,
+                                          offset=(page - 1) * per_page, limit=per_page + 1)
+    return Page(page, results[:per_page], len(results) > per_page)
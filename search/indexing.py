@@ -0,0 +1,133 @@
+"""Copies of the searchable rows in SearchDocument.
+
+Each kind reads its rows with one values_list query and turns them into
+documents: title and body are what the full-text index sees, url is where
+a result links to and scope is the graph or domain the row belongs to.
+Single rows are refreshed by search.signals on save; index_graph and
+index_domain rewrite a whole scope after bulk changes.
+"""
+from django.db import transaction
+from django.urls import reverse
+
+from domain.models import Skill, Strategy, Action
+from graph.models import Vertex
+from search.models import SearchDocument
+
+BATCH_SIZE = 1000
+
+
+def graph_scope(graph_id):
+    return 'graph:%d' % graph_id
+
+
+def domain_scope(domain_id):
+    return 'domain:%d' % domain_id
+
+
+def _vertices(rows):
+    for pk, graph_id, vid, name, description in rows.values_list('pk', 'graph_id', 'VID', 'name', 'description'):
+        yield SearchDocument(kind=SearchDocument.VERTEX, object_id=pk, scope=graph_scope(graph_id),
+                             title='%d, %s' % (vid, name), body=description or '',
+                             url=reverse('detail_vertex', args=(pk,)))
+
+
+def _skills(rows):
+    for pk, domain_id, domain_code, code, name, description in rows.values_list(
+            'pk', 'domain_id', 'domain__code', 'code', 'name', 'description'):
+        yield SearchDocument(kind=SearchDocument.SKILL, object_id=pk, scope=domain_scope(domain_id),
+                             title=name, body=description or '',
+                             url=reverse('skill_detail', args=(domain_code, code)))
+
+
+def _strategies(rows):
+    for pk, domain_id, domain_code, skill_code, code, name, problem in rows.values_list(
+            'pk', 'skill_goal__domain_id', 'skill_goal__domain__code', 'skill_goal__code', 'code',
+            'name', 'problem'):
+        yield SearchDocument(kind=SearchDocument.STRATEGY, object_id=pk, scope=domain_scope(domain_id),
+                             title=name, body=problem or '',
+                             url=reverse('strategy_detail', args=(domain_code, skill_code, code)))
+
+
+def _actions(rows):
+    for pk, domain_id, domain_code, skill_code, strategy_code, strategy_name, order, description in \
+            rows.values_list('pk', 'strategy__skill_goal__domain_id', 'strategy__skill_goal__domain__code',
+                             'strategy__skill_goal__code', 'strategy__code', 'strategy__name', 'order',
+                             'description'):
+        yield SearchDocument(kind=SearchDocument.ACTION, object_id=pk, scope=domain_scope(domain_id),
+                             title='%s, action %d' % (strategy_name, order), body=description,
+                             url=reverse('strategy_detail', args=(domain_code, skill_code, strategy_code)))
+
+
+# kind -> (model, documents of a queryset of that model)
+KINDS = {
+    SearchDocument.VERTEX: (Vertex, _vertices),
+    SearchDocument.SKILL: (Skill, _skills),
+    SearchDocument.STRATEGY: (Strategy, _strategies),
+    SearchDocument.ACTION: (Action, _actions),
+}
+
+
+def _replace(kind, rows, stale):
+    """Write the documents of rows in place of the stale ones."""
+    documents = KINDS[kind][1]
+    stale.delete()
+    SearchDocument.objects.bulk_create(documents(rows.order_by()), batch_size=BATCH_SIZE)
+
+
+def index_object(kind, pk):
+    """Refresh the document of one row: a select and an update, plus an
+    insert the first time."""
+    model, documents = KINDS[kind]
+    for document in documents(model.objects.filter(pk=pk)):
+        fields = {'scope': document.scope, 'title': document.title, 'body': document.body, 'url': document.url}
+        if not SearchDocument.objects.filter(kind=kind, object_id=pk).update(**fields):
+            document.save()
+
+
+def index_objects(kind, pks):
+    """Refresh the documents of the kind's rows with these pks."""
+    model = KINDS[kind][0]
+    pks = list(pks)
+    with transaction.atomic():
+        _replace(kind, model.objects.filter(pk__in=pks), SearchDocument.objects.filter(kind=kind, object_id__in=pks))
+
+
+def index_strategy_actions(strategy_id):
+    actions = Action.objects.filter(strategy_id=strategy_id)
+    with transaction.atomic():
+        _replace(SearchDocument.ACTION, actions,
+                 SearchDocument.objects.filter(kind=SearchDocument.ACTION, object_id__in=actions.values('pk')))
+
+
+def unindex_objects(kind, pks):
+    SearchDocument.objects.filter(kind=kind, object_id__in=list(pks)).delete()
+
+
+def index_graph(graph_id):
+    with transaction.atomic():
+        _replace(SearchDocument.VERTEX, Vertex.objects.filter(graph_id=graph_id),
+                 SearchDocument.objects.filter(scope=graph_scope(graph_id)))
+
+
+def index_domain(domain_id):
+    scope = domain_scope(domain_id)
+    with transaction.atomic():
+        SearchDocument.objects.filter(scope=scope).delete()
+        _replace(SearchDocument.SKILL, Skill.objects.filter(domain_id=domain_id), SearchDocument.objects.none())
+        _replace(SearchDocument.STRATEGY, Strategy.objects.filter(skill_goal__domain_id=domain_id),
+                 SearchDocument.objects.none())
+        _replace(SearchDocument.ACTION, Action.objects.filter(strategy__skill_goal__domain_id=domain_id),
+                 SearchDocument.objects.none())
+
+
+def unindex_scope(scope):
+    SearchDocument.objects.filter(scope=scope).delete()
+
+
+def rebuild():
+    """Index everything from scratch; returns the number of documents."""
+    with transaction.atomic():
+        SearchDocument.objects.all().delete()
+        for kind, (model, documents) in KINDS.items():
+            _replace(kind, model.objects.all(), SearchDocument.objects.none())
+    return SearchDocument.objects.count()
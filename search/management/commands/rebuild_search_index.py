@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from search.indexing import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Index all vertices, skills, strategies and actions for search from scratch'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Indexed %d documents' % rebuild())
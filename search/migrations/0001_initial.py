@@ -0,0 +1,34 @@
+# Generated by Django 3.2.6 on 2026-10-18 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('vertex', 'Vertex'), ('skill', 'Skill'), ('strategy', 'Strategy'), ('action', 'Action')], max_length=16)),
+                ('object_id', models.BigIntegerField()),
+                ('scope', models.CharField(max_length=32)),
+                ('title', models.CharField(max_length=255)),
+                ('body', models.TextField(blank=True, default='')),
+                ('url', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchdocument',
+            index=models.Index(fields=['scope'], name='search_sear_scope_dd7e6e_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchdocument',
+            unique_together={('kind', 'object_id')},
+        ),
+    ]
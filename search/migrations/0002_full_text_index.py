@@ -0,0 +1,82 @@
+from django.db import migrations
+
+# Title words weigh more than body words, on both databases. On PostgreSQL
+# the kind and scope are added as unparsed lexemes, so that the GIN index
+# can filter by them too.
+POSTGRES_CREATE = [
+    '''ALTER TABLE search_searchdocument ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+           setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(body, '')), 'B') ||
+           array_to_tsvector(ARRAY['kind:' || kind, 'scope:' || scope])) STORED''',
+    'CREATE INDEX search_searchdocument_vector_idx ON search_searchdocument USING GIN (search_vector)',
+]
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS search_searchdocument_vector_idx',
+    'ALTER TABLE search_searchdocument DROP COLUMN IF EXISTS search_vector',
+]
+
+# An external-content FTS5 table: it indexes the rows of
+# search_searchdocument without storing a second copy of them. SQLite
+# drops the triggers whenever Django rebuilds that table, so a later
+# migration altering its fields has to create them again. The prefix
+# indexes keep queries for the first letters of a word as fast as others.
+SQLITE_CREATE = [
+    '''CREATE VIRTUAL TABLE search_searchdocument_fts USING fts5(
+           title, body, content='search_searchdocument', content_rowid='id', prefix='1 2 3')''',
+    '''CREATE TRIGGER search_searchdocument_fts_ai AFTER INSERT ON search_searchdocument BEGIN
+           INSERT INTO search_searchdocument_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+       END''',
+    '''CREATE TRIGGER search_searchdocument_fts_ad AFTER DELETE ON search_searchdocument BEGIN
+           INSERT INTO search_searchdocument_fts(search_searchdocument_fts, rowid, title, body)
+           VALUES ('delete', old.id, old.title, old.body);
+       END''',
+    '''CREATE TRIGGER search_searchdocument_fts_au AFTER UPDATE ON search_searchdocument BEGIN
+           INSERT INTO search_searchdocument_fts(search_searchdocument_fts, rowid, title, body)
+           VALUES ('delete', old.id, old.title, old.body);
+           INSERT INTO search_searchdocument_fts(rowid, title, body) VALUES (new.id, new.title, new.body);
+       END''',
+    "INSERT INTO search_searchdocument_fts(search_searchdocument_fts) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS search_searchdocument_fts_au',
+    'DROP TRIGGER IF EXISTS search_searchdocument_fts_ad',
+    'DROP TRIGGER IF EXISTS search_searchdocument_fts_ai',
+    'DROP TABLE IF EXISTS search_searchdocument_fts',
+]
+
+
+def _sqlite_has_fts5(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def statements(schema_editor, create):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        return POSTGRES_CREATE if create else POSTGRES_DROP
+    # Without FTS5 search.backends falls back to substring filters.
+    if vendor == 'sqlite' and _sqlite_has_fts5(schema_editor):
+        return SQLITE_CREATE if create else SQLITE_DROP
+    return []
+
+
+def create_index(apps, schema_editor):
+    for sql in statements(schema_editor, True):
+        schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    for sql in statements(schema_editor, False):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
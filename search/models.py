@@ -0,0 +1,30 @@
+from django.db import models
+
+
+class SearchDocument(models.Model):
+    """A searchable row of the graph or domain app, copied by search.indexing.
+
+    The full-text index itself is not a model field: migration 0002 adds a
+    generated tsvector column with a GIN index on PostgreSQL and an FTS5
+    table kept up to date by triggers on SQLite.
+    """
+    VERTEX = 'vertex'
+    SKILL = 'skill'
+    STRATEGY = 'strategy'
+    ACTION = 'action'
+    KIND_CHOICES = [(VERTEX, 'Vertex'), (SKILL, 'Skill'), (STRATEGY, 'Strategy'), (ACTION, 'Action')]
+
+    class Meta:
+        unique_together = [('kind', 'object_id')]
+        indexes = [models.Index(fields=['scope'])]
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    # 'graph:<pk>' or 'domain:<pk>': what the row belongs to.
+    scope = models.CharField(max_length=32)
+    title = models.CharField(max_length=255)
+    body = models.TextField(blank=True, default='')
+    url = models.CharField(max_length=255)
+
+    def __str__(self):
+        return '%s: %s' % (self.kind, self.title)
@@ -0,0 +1,74 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from domain.models import Domain, Skill, Strategy, Action, domain_rebuilt
+from graph.models import Graph, Vertex, deleting_graph
+from graph.signals import graph_rebuilt
+from search import indexing
+from search.models import SearchDocument
+
+# Vertex fields that end up in its document.
+VERTEX_FIELDS = {'VID', 'name', 'description'}
+
+
+@receiver(post_save, sender=Vertex)
+def vertex_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not VERTEX_FIELDS.intersection(update_fields)):
+        return
+    indexing.index_object(SearchDocument.VERTEX, instance.pk)
+
+
+@receiver(post_delete, sender=Vertex)
+def vertex_deleted(sender, instance, **kwargs):
+    # A deleted graph drops all its documents at once.
+    if deleting_graph() is None:
+        indexing.unindex_objects(SearchDocument.VERTEX, [instance.pk])
+
+
+@receiver(post_delete, sender=Graph)
+def graph_deleted(sender, instance, **kwargs):
+    indexing.unindex_scope(indexing.graph_scope(instance.pk))
+
+
+@receiver(graph_rebuilt)
+def graph_bulk_changed(sender, graph_id, **kwargs):
+    indexing.index_graph(graph_id)
+
+
+@receiver(post_save, sender=Skill)
+def skill_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        indexing.index_object(SearchDocument.SKILL, instance.pk)
+
+
+@receiver(post_save, sender=Strategy)
+def strategy_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    indexing.index_object(SearchDocument.STRATEGY, instance.pk)
+    # Action documents carry the strategy's name and address.
+    if not created:
+        indexing.index_strategy_actions(instance.pk)
+
+
+@receiver(post_save, sender=Action)
+def action_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        indexing.index_object(SearchDocument.ACTION, instance.pk)
+
+
+@receiver(post_delete, sender=Skill)
+@receiver(post_delete, sender=Strategy)
+@receiver(post_delete, sender=Action)
+def domain_row_deleted(sender, instance, **kwargs):
+    indexing.unindex_objects(sender._meta.model_name, [instance.pk])
+
+
+@receiver(post_delete, sender=Domain)
+def domain_deleted(sender, instance, **kwargs):
+    indexing.unindex_scope(indexing.domain_scope(instance.pk))
+
+
+@receiver(domain_rebuilt)
+def domain_bulk_changed(sender, domain_id, **kwargs):
+    indexing.index_domain(domain_id)
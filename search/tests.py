@@ -0,0 +1,91 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from domain.models import Domain, Skill, Strategy, Action
+from graph.importer import import_graph
+from graph.models import Graph, Vertex
+from perf.datasets import domain_tree
+from perf.testing import QueryBudgetMixin
+from search.backends import get_backend, search
+from search.indexing import rebuild
+from search.models import SearchDocument
+
+
+def titles(page):
+    return [document.title for document in page.results]
+
+
+class SearchTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.graph = Graph.objects.create(name='g')
+        self.vertex = Vertex.objects.create(graph=self.graph, name='Linear algebra', description='Matrices')
+        self.domain = Domain.objects.create(name='Mathematics')
+        self.skill = Skill.objects.create(domain=self.domain, name='Algebra', description='Equations and matrices')
+        self.strategy = Strategy.objects.create(skill_goal=self.skill, name='Elimination', problem='Solve a system')
+        self.action = Action.objects.create(strategy=self.strategy, description='Subtract matrix rows')
+
+    def test_index_follows_saves_and_deletes(self):
+        self.assertEqual(titles(search('matri')),
+                         ['1, Linear algebra', 'Algebra', 'Elimination, action 1'])
+        self.strategy.name = 'Gaussian elimination'
+        self.strategy.save()
+        self.assertEqual(titles(search('gauss')), ['Gaussian elimination', 'Gaussian elimination, action 1'])
+        self.assertEqual(search('gauss', kind='strategy').results[0].url,
+                         reverse('strategy_detail', args=(self.domain.code, self.skill.code, self.strategy.code)))
+        self.vertex.delete()
+        self.assertEqual(titles(search('linear')), [])
+        self.domain.delete()
+        self.assertEqual(titles(search('matrices')), [])
+
+    def test_title_ranks_before_body(self):
+        Vertex.objects.create(graph=self.graph, name='Geometry', description='Algebra of shapes')
+        self.assertEqual(titles(search('algebra', kind='vertex')), ['1, Linear algebra', '2, Geometry'])
+
+    def test_every_match_is_ranked(self):
+        # A common word: the one title match comes after a thousand body
+        # matches in index order, and deep pages still have rows.
+        SearchDocument.objects.bulk_create([SearchDocument(kind='vertex', object_id=10 ** 6 + i, scope='bulk',
+                                                           title='t%d' % i, body='common', url='/')
+                                            for i in range(1100)])
+        SearchDocument.objects.create(kind='vertex', object_id=10 ** 7, scope='bulk', title='common', url='/')
+        self.assertEqual(titles(search('common', per_page=5))[0], 'common')
+        self.assertEqual(len(search('common', page=56, per_page=20).results), 1)
+
+    def test_filters_and_pages(self):
+        for i in range(5):
+            Vertex.objects.create(graph=self.graph, name='topic %d' % i)
+        other = Graph.objects.create(name='other')
+        Vertex.objects.create(graph=other, name='topic x')
+        page = search('topic', scope='graph:%d' % self.graph.pk, per_page=2)
+        self.assertEqual((len(page.results), page.has_next), (2, True))
+        last = search('topic', scope='graph:%d' % self.graph.pk, per_page=2, page=3)
+        self.assertEqual((len(last.results), last.has_next), (1, False))
+        self.assertEqual(len(search('topic').results), 6)
+        self.assertEqual(titles(search('topic x')), ['1, topic x'])
+
+    def test_bulk_changes_are_indexed(self):
+        graph = import_graph({'name': 'imported', 'vertexes': [{'VID': 1, 'name': 'Calculus'}], 'edges': []})
+        self.assertEqual(search('calculus').results[0].scope, 'graph:%d' % graph.pk)
+        domain = domain_tree(2, 2, 2, name='synthetic')
+        scope = 'domain:%d' % domain.pk
+        self.assertEqual(len(search('strategy', kind='strategy', scope=scope).results), 4)
+        self.assertEqual(len(search('strategy', kind='action', scope=scope).results), 8)
+        graph.delete()
+        self.assertEqual(titles(search('calculus')), [])
+
+    def test_rebuild_and_backends_agree(self):
+        count = SearchDocument.objects.count()
+        SearchDocument.objects.all().delete()
+        self.assertEqual(rebuild(), count)
+        self.assertEqual(sorted(titles(search('matri'))),
+                         sorted(titles(search('matri', backend='like'))))
+        with self.assertRaises(ValueError):
+            get_backend('nosuch')
+
+    def test_results_endpoint(self):
+        with self.assertMaxQueries(2):
+            response = self.client.get(reverse('search_results'), {'q': 'Elimination', 'kind': 'strategy'})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['id'] for r in response.json()['results']], [self.strategy.pk])
+        self.assertEqual(self.client.get(reverse('search_results'), {'q': 'x', 'kind': 'nosuch'}).status_code, 404)
+        self.assertContains(self.client.get(reverse('search'), {'q': 'algebra'}), 'Linear algebra')
@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('', views.SearchView.as_view(), name='search'),
+    path('results.json', views.SearchResultsView.as_view(), name='search_results'),
+]
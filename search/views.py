@@ -0,0 +1,44 @@
+from django.http import Http404, JsonResponse
+from django.views.generic import TemplateView, View
+
+from search.backends import search
+from search.models import SearchDocument
+
+PER_PAGE = 20
+KINDS = dict(SearchDocument.KIND_CHOICES)
+
+
+def search_page(request):
+    """The Page of results for the q, kind, scope and page parameters."""
+    kind = request.GET.get('kind') or None
+    if kind is not None and kind not in KINDS:
+        raise Http404("Unknown kind")
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    return search(request.GET.get('q', ''), kind=kind, scope=request.GET.get('scope') or None,
+                  page=page, per_page=PER_PAGE)
+
+
+class SearchView(TemplateView):
+    template_name = 'search/search.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['q'] = self.request.GET.get('q', '')
+        context['kind'] = self.request.GET.get('kind', '')
+        context['scope'] = self.request.GET.get('scope', '')
+        context['kinds'] = SearchDocument.KIND_CHOICES
+        context['page'] = search_page(self.request)
+        return context
+
+
+class SearchResultsView(View):
+    """JSON page of search results, best match first."""
+
+    def get(self, request):
+        page = search_page(request)
+        return JsonResponse({'page': page.number, 'has_next': page.has_next,
+                             'results': [{'kind': d.kind, 'id': d.object_id, 'scope': d.scope, 'title': d.title,
+                                          'url': d.url, 'score': d.score} for d in page.results]})
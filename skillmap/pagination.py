@@ -0,0 +1,153 @@
+"""Keyset (seek) pagination for list pages.
+
+A page is the next per_page rows after, or before, the key values of a
+row the client has seen, so the database walks an index from that point
+instead of counting past an OFFSET: every page costs the same however
+deep it is. The keys must be non-null and, taken together, unique (end
+them with the pk when in doubt); a leading '-' orders by a key
+descending. The cursor in the URL is the key values of the boundary row.
+"""
+import base64
+import json
+import operator
+from functools import reduce
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+
+# Characters of a description shown in list pages.
+SUMMARY_LENGTH = 200
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, cls=DjangoJSONEncoder).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != length or \
+            not all(isinstance(value, (str, int, float)) for value in values):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _value(row, field):
+    """A key of a row from values(), or of a model instance."""
+    if isinstance(row, dict):
+        return row[field]
+    for name in field.split('__'):
+        row = getattr(row, name)
+    return row
+
+
+class KeysetPage:
+    """The rows of one page; next_query and previous_query are the query
+    strings of the neighbouring pages, with the other parameters kept."""
+
+    def __init__(self, object_list, params, prefix, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.params = params
+        self.prefix = prefix
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def _query(self, param, cursor):
+        params = self.params.copy()
+        params.pop(self.prefix + 'after', None)
+        params.pop(self.prefix + 'before', None)
+        params[self.prefix + param] = cursor
+        return params.urlencode()
+
+    @property
+    def next_query(self):
+        return self._query('after', self.next_cursor) if self.has_next else None
+
+    @property
+    def previous_query(self):
+        return self._query('before', self.previous_cursor) if self.has_previous else None
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, keys, per_page=50, prefix=''):
+        self.queryset = queryset
+        self.keys = tuple(keys)
+        self.per_page = per_page
+        self.prefix = prefix
+
+    def _seek(self, values, forward):
+        """Rows after (forward) or before the key values, in key order."""
+        # (a, b) > (x, y) is a > x OR (a = x AND b > y), and so on.
+        conditions = []
+        equal = Q()
+        for key, value in zip(self.keys, values):
+            field = key.lstrip('-')
+            lookup = 'gt' if key.startswith('-') != forward else 'lt'
+            conditions.append(equal & Q(**{'%s__%s' % (field, lookup): value}))
+            equal &= Q(**{field: value})
+        return reduce(operator.or_, conditions)
+
+    def _cursor(self, row):
+        return encode_cursor([_value(row, key.lstrip('-')) for key in self.keys])
+
+    def _reversed(self):
+        return [key[1:] if key.startswith('-') else '-' + key for key in self.keys]
+
+    def page(self, params):
+        """The page the query parameters ask for; raises ValueError for a
+        malformed cursor."""
+        after = params.get(self.prefix + 'after')
+        before = params.get(self.prefix + 'before')
+        n = self.per_page
+        if before:
+            rows = list(self.queryset.filter(self._seek(decode_cursor(before, len(self.keys)), False))
+                        .order_by(*self._reversed())[:n + 1])
+            more_before = len(rows) > n
+            rows = rows[:n][::-1]
+            more_after = True
+        else:
+            queryset = self.queryset
+            if after:
+                queryset = queryset.filter(self._seek(decode_cursor(after, len(self.keys)), True))
+            rows = list(queryset.order_by(*self.keys)[:n + 1])
+            more_after = len(rows) > n
+            rows = rows[:n]
+            more_before = bool(after)
+        return KeysetPage(rows, params, self.prefix,
+                          self._cursor(rows[-1]) if rows and more_after else None,
+                          self._cursor(rows[0]) if rows and more_before else None)
+
+
+class KeysetListMixin:
+    """ListView paged by KeysetPaginator over keys, per_page rows at a time,
+    instead of Django's OFFSET pagination."""
+    keys = ('pk',)
+    per_page = 50
+
+    def get_context_data(self, **kwargs):
+        queryset = kwargs.pop('object_list', self.object_list)
+        try:
+            page = KeysetPaginator(queryset, self.keys, self.per_page).page(self.request.GET)
+        except ValueError as e:
+            raise Http404(str(e))
+        context = super().get_context_data(object_list=page.object_list, **kwargs)
+        context['page_obj'] = page
+        context['is_paginated'] = page.has_next or page.has_previous
+        return context
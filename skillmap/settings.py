@@ -39,10 +39,16 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'graph',
     'domain',
+    'allocator',
+    'perf',
+    'search',
     'crispy_forms'
 ]
 
 MIDDLEWARE = [
+    'perf.middleware.ServerTimingMiddleware',
+    'perf.middleware.ProfileMiddleware',
+    'perf.middleware.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -129,6 +135,31 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = BASE_DIR/'media'
 MEDIA_URL = '/media/'
 
+# Render graph images in the background (python manage.py render_worker)
+# instead of inside the request. Set to False to render inline.
+GRAPH_RENDER_ASYNC = True
+
+# A failed background render is queued again by the next request for the
+# image, at most this many times, after a wait doubling from this many seconds.
+GRAPH_RENDER_RETRIES = 3
+GRAPH_RENDER_RETRY_DELAY = 30
+
+# Memory budget of the per-process cache of graph structure snapshots.
+GRAPH_SNAPSHOT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Entries of the per-process cache of vertex neighbourhoods (graph.neighbourhood).
+GRAPH_NEIGHBOURHOOD_CACHE_SIZE = 256
+
+# perf.middleware.QueryCountMiddleware warns when one request issues the
+# same SQL this many times (a likely N+1 query).
+PERF_REPEATED_QUERY_THRESHOLD = 5
+
+# Requests per view kept for the timing histograms at /perf/stats.
+PERF_STATS_SAMPLES = 500
+
+# Lines of the cProfile report returned for ?profile=1 (DEBUG only).
+PERF_PROFILE_LINES = 60
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -24,4 +24,6 @@ urlpatterns = [
     path('', TemplateView.as_view(template_name="index.html"), name='/'),
     path('graph/', include('graph.urls')),
     path('domain/', include('domain.urls')),
+    path('perf/', include('perf.urls')),
+    path('search/', include('search.urls')),
 ]  + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)